@@ -0,0 +1,205 @@
+"""
+Run metrics of Process Loan Interest Accrual
+
+An accrual run is timed in three phases: discovery (finding the loans and schedule rows to
+accrue), calculation (working out the amounts, the default phase) and posting (writing
+the accruals and their GL entries). `collect_metrics` counts, for the whole run and per
+accrual date:
+
+- loans_scanned: loans evaluated, once per date, plus the term loan schedule rows read
+- accruals_written: Loan Interest Accruals posted
+- queries_issued: every `frappe.db.sql` call, which the query builder and get_all go through
+- discovery_seconds, calculation_seconds, posting_seconds
+
+The accrual code marks its phases and dates with `metrics_phase` and `metrics_date` and
+counts with `record_metrics`, all of which do nothing outside `collect_metrics`.
+`save_run_metrics` adds the counts to the run's fields on the Process Loan Interest
+Accrual (queryable for dashboards across runs) and the per date loans scanned, accruals
+written and seconds to its `accrual_date_metrics` table of Loan Accrual Date Metric rows,
+one per date.
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+
+import frappe
+from frappe.query_builder.functions import Coalesce
+from frappe.utils import getdate
+
+from lending_custom.bulk_persistence import bulk_insert_documents, set_child_row_names
+
+PHASE_DISCOVERY = "discovery"
+PHASE_CALCULATION = "calculation"
+PHASE_POSTING = "posting"
+COUNTERS = ("loans_scanned", "accruals_written", "queries_issued")
+TIMERS = tuple(f"{phase}_seconds" for phase in (PHASE_DISCOVERY, PHASE_CALCULATION, PHASE_POSTING))
+DATE_METRICS_DOCTYPE = "Loan Accrual Date Metric"
+DATE_METRICS_FIELD = "accrual_date_metrics"
+
+
+class AccrualMetrics:
+	"""Counters and phase timers of one accrual run, in total and per accrual date"""
+
+	def __init__(self):
+		self.totals = dict.fromkeys(COUNTERS + TIMERS, 0)
+		self.dates = {}
+		self.phase = PHASE_CALCULATION
+		self.date = None
+		self.clock = time.perf_counter()
+
+	def add(self, **counts):
+		for target in self._targets():
+			for key, value in counts.items():
+				target[key] += value
+
+	def charge_time(self):
+		"""Charge the time since the last switch to the current phase and date"""
+		now = time.perf_counter()
+		self.add(**{f"{self.phase}_seconds": now - self.clock})
+		self.clock = now
+
+	@contextmanager
+	def in_phase(self, phase):
+		self.charge_time()
+		previous, self.phase = self.phase, phase
+		try:
+			yield
+		finally:
+			self.charge_time()
+			self.phase = previous
+
+	@contextmanager
+	def for_date(self, date):
+		self.charge_time()
+		previous, self.date = self.date, str(date)
+		self.dates.setdefault(self.date, dict.fromkeys(COUNTERS + TIMERS, 0))
+		try:
+			yield
+		finally:
+			self.charge_time()
+			self.date = previous
+
+	def _targets(self):
+		if self.date:
+			return (self.totals, self.dates[self.date])
+		return (self.totals,)
+
+
+def current_metrics():
+	"""Metrics of the run being collected, or None"""
+	return getattr(frappe.local, "lending_custom_accrual_metrics", None)
+
+
+@contextmanager
+def collect_metrics():
+	"""
+	Collect the metrics of the accrual code run inside the block:
+
+		with collect_metrics() as metrics:
+			process_accruals_for_range(...)
+		save_run_metrics(process_loan_interest, metrics)
+	"""
+	metrics = AccrualMetrics()
+	previous_metrics = current_metrics()
+	db = frappe.local.db
+	sql = db.sql
+
+	def counted_sql(*args, **kwargs):
+		metrics.add(queries_issued=1)
+		return sql(*args, **kwargs)
+
+	frappe.local.lending_custom_accrual_metrics = metrics
+	db.sql = counted_sql
+	try:
+		yield metrics
+	finally:
+		metrics.charge_time()
+		# drop the wrapper so the instance falls back to its class' sql again
+		if db.__dict__.get("sql") is counted_sql:
+			del db.sql
+		frappe.local.lending_custom_accrual_metrics = previous_metrics
+
+
+def metrics_phase(phase):
+	"""Charge the time and queries of the block to `phase`"""
+	metrics = current_metrics()
+	return metrics.in_phase(phase) if metrics else nullcontext()
+
+
+def metrics_date(date):
+	"""Count the work of the block on accrual date `date` too"""
+	metrics = current_metrics()
+	return metrics.for_date(date) if metrics else nullcontext()
+
+
+def record_metrics(**counts):
+	metrics = current_metrics()
+	if metrics:
+		metrics.add(**counts)
+
+
+def save_run_metrics(process_loan_interest, metrics):
+	"""
+	Add the collected metrics to the Process Loan Interest Accrual, committed by the caller.
+	Shards of a run save concurrently: the totals and the rows of dates already saved are
+	incremented in place, under a locking read of the run.
+	"""
+	accrual = frappe.qb.DocType("Process Loan Interest Accrual")
+	query = frappe.qb.update(accrual).where(accrual.name == process_loan_interest)
+	for key in COUNTERS:
+		query = query.set(getattr(accrual, key), Coalesce(getattr(accrual, key), 0) + metrics.totals[key])
+	for key in TIMERS:
+		query = query.set(
+			getattr(accrual, key), Coalesce(getattr(accrual, key), 0) + round(metrics.totals[key], 3)
+		)
+	query.run()
+
+	# the locking read makes the shards of a run merge their per date rows one at a time
+	frappe.db.get_value("Process Loan Interest Accrual", process_loan_interest, "name", for_update=True)
+
+	metric = frappe.qb.DocType(DATE_METRICS_DOCTYPE)
+	saved = dict(
+		frappe.qb.from_(metric)
+		.select(metric.date, metric.name)
+		.where(
+			(metric.parent == process_loan_interest)
+			& (metric.parenttype == "Process Loan Interest Accrual")
+			& (metric.parentfield == DATE_METRICS_FIELD)
+		)
+		.run()
+	)
+
+	new_rows = []
+	for date, counts in sorted(metrics.dates.items()):
+		values = get_date_metric_values(counts)
+		if getdate(date) in saved:
+			query = frappe.qb.update(metric).where(metric.name == saved[getdate(date)])
+			for key, value in values.items():
+				query = query.set(getattr(metric, key), Coalesce(getattr(metric, key), 0) + value)
+			query.run()
+		else:
+			new_rows.append(
+				frappe.get_doc(
+					{
+						"doctype": DATE_METRICS_DOCTYPE,
+						"parent": process_loan_interest,
+						"parenttype": "Process Loan Interest Accrual",
+						"parentfield": DATE_METRICS_FIELD,
+						"idx": len(saved) + len(new_rows) + 1,
+						"date": date,
+						**values,
+					}
+				)
+			)
+
+	set_child_row_names(new_rows)
+	bulk_insert_documents(new_rows)
+
+
+def get_date_metric_values(counts):
+	"""Columns of a Loan Accrual Date Metric row for the counts of one date"""
+	return {
+		"loans_scanned": counts.get("loans_scanned", 0),
+		"accruals_written": counts.get("accruals_written", 0),
+		"seconds": round(sum(counts.get(key, 0) for key in TIMERS), 3),
+	}
@@ -0,0 +1,177 @@
+"""
+Dry run of Process Loan Interest Accrual
+
+Projects the interest a Process Loan Interest Accrual would post, without writing any
+document. The book is read once (open demand loans, their last accrual before the window
+and the accruals already posted in it, and the due term loan schedule rows, in pages) and the
+demand loan interest of the whole window is computed as one loans x dates NumPy matrix,
+with the day counts and per-day rate of lending's accrual:
+
+	interest = per day interest * days since last accrual
+
+The per-day interest follows the company's interest day count convention and the loan's
+interest calculation method (get_per_day_interest_bulk), and a loan disbursed again since
+its last accrual accrues from that disbursement, as lending's get_last_accrual_date
+counts it.
+
+The result is columnar and sparse: one entry per projected accrual, as indexes into the
+`loans` and `dates` lists, plus totals per loan and per date.
+"""
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import add_days, cint, getdate
+
+from lending_custom.function_overrides import iter_term_loan_pages
+from lending_custom.historical_accrual import (
+	get_accrued_dates,
+	get_demand_loans,
+	get_disbursement_dates,
+	get_last_accrual_dates,
+	get_pending_principal,
+	get_term_loan_accrual_date,
+)
+from lending_custom.interest_calculations import get_per_day_interest_bulk
+
+
+def simulate_accruals_for_range(
+	start_date,
+	end_date,
+	open_loans=None,
+	term_loan=None,
+	loan_product=None,
+	include_demand_loans=True,
+	include_term_loans=True,
+):
+	"""Projected accruals of every day from start_date to end_date, both inclusive"""
+	start_date, end_date = getdate(start_date), getdate(end_date)
+	dates = np.arange(np.datetime64(start_date, "D"), np.datetime64(end_date, "D") + 1)
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+
+	loan_names, loan_index = [], {}
+	columns = {"loan": [], "date": [], "interest_amount": [], "is_term_loan": []}
+
+	def add_accruals(loans, date_indexes, amounts, is_term_loan):
+		for loan in loans:
+			if loan not in loan_index:
+				loan_index[loan] = len(loan_names)
+				loan_names.append(loan)
+
+		columns["loan"].extend(loan_index[loan] for loan in loans)
+		columns["date"].extend(date_indexes)
+		columns["interest_amount"].extend(amounts)
+		columns["is_term_loan"].extend([is_term_loan] * len(date_indexes))
+
+	if include_demand_loans:
+		demand_loans = open_loans or get_demand_loans(loan_product)
+		interest = get_demand_loan_interest(demand_loans, dates, precision)
+		loan_rows, date_indexes = np.nonzero(interest)
+		add_accruals(
+			[demand_loans[i].name for i in loan_rows.tolist()],
+			date_indexes.tolist(),
+			interest[loan_rows, date_indexes].tolist(),
+			0,
+		)
+
+	if include_term_loans:
+		for page in iter_term_loan_pages(end_date, term_loan, loan_product):
+			add_accruals(
+				[row.name for row in page],
+				[(get_term_loan_accrual_date(row, start_date) - start_date).days for row in page],
+				[row.interest_amount for row in page],
+				1,
+			)
+
+	amounts = np.asarray(columns["interest_amount"], dtype=np.float64)
+	return frappe._dict(
+		{
+			"loans": loan_names,
+			"dates": [str(date) for date in dates.tolist()],
+			**columns,
+			"total_by_loan": np.round(
+				np.bincount(columns["loan"], weights=amounts, minlength=len(loan_names)), precision
+			).tolist(),
+			"total_by_date": np.round(
+				np.bincount(columns["date"], weights=amounts, minlength=len(dates)), precision
+			).tolist(),
+			"total_interest_amount": round(float(amounts.sum()), precision),
+		}
+	)
+
+
+def get_demand_loan_interest(loans, dates, precision=2):
+	"""loans x dates matrix of the interest each demand loan would accrue on each date"""
+	interest = np.zeros((len(loans), len(dates)))
+	if not loans or not len(dates):
+		return interest
+
+	start_date, end_date = dates[0].item(), dates[-1].item()
+	names = [loan.name for loan in loans]
+	last_accrual_dates = get_last_accrual_dates(names, add_days(start_date, -1))
+	accrued_dates = get_accrued_dates(start_date, end_date, names)
+
+	base = np.array([get_interest_base_date(loan, last_accrual_dates, dates[-1]) for loan in loans])
+	previous = np.concatenate(([np.datetime64("NaT")], dates[:-1]))
+	since = np.where(np.isnat(previous)[None, :], base[:, None], np.maximum(base[:, None], previous[None, :]))
+
+	# a disbursement after the day following the last accrual restarts the count, except on
+	# the first date of a loan never accrued, which counts from its disbursement date
+	disbursed = get_last_disbursed_dates(names, dates, get_disbursement_dates(names, end_date))
+	disbursed[[loan.name not in last_accrual_dates for loan in loans], 0] = np.datetime64("NaT")
+	since = np.where(disbursed > since + 1, disbursed, since)
+	days = np.maximum((dates[None, :] - since).astype(np.int64), 0)
+
+	for i, loan in enumerate(loans):
+		for accrued_date in accrued_dates.get(loan.name, ()):
+			days[i, (np.datetime64(accrued_date, "D") - dates[0]).astype(np.int64)] = 0
+
+	principal = np.array([get_pending_principal(loan) for loan in loans], dtype=np.float64)
+	rate = np.array([loan.rate_of_interest or 0 for loan in loans], dtype=np.float64)
+	methods = np.array([loan.get("interest_calculation_method") for loan in loans], dtype=object)
+	per_day_interest = get_per_day_interest_bulk(
+		np.repeat(principal, len(dates)),
+		np.repeat(rate, len(dates)),
+		np.repeat(np.array([loan.company for loan in loans], dtype=object), len(dates)),
+		posting_dates=np.tile(dates, len(loans)),
+		interest_calculation_methods=np.repeat(methods, len(dates)),
+	).reshape(len(loans), len(dates))
+
+	interest = per_day_interest * days
+	return np.where(np.round(interest, precision) > 0, interest, 0)
+
+
+def get_last_disbursed_dates(loans, dates, disbursement_dates):
+	"""loans x dates matrix of each loan's last disbursement before each date, NaT if none"""
+	disbursed = np.full((len(loans), len(dates)), np.datetime64("NaT"), dtype="datetime64[D]")
+	for i, loan in enumerate(loans):
+		if loan_dates := disbursement_dates.get(loan):
+			loan_dates = np.array(loan_dates, dtype="datetime64[D]")
+			index = np.searchsorted(loan_dates, dates, side="left")
+			disbursed[i] = np.where(index > 0, loan_dates[np.maximum(index - 1, 0)], np.datetime64("NaT"))
+
+	return disbursed
+
+
+def get_interest_base_date(loan, last_accrual_dates, end_date):
+	"""Day after which interest accrues: the last accrual, or the eve of the disbursement"""
+	if loan.name in last_accrual_dates:
+		return np.datetime64(last_accrual_dates[loan.name], "D")
+
+	if loan.disbursement_date:
+		return np.datetime64(getdate(loan.disbursement_date), "D") - 1
+
+	# never disbursed, nothing accrues in the window
+	return end_date
+
+
+@frappe.whitelist()
+def simulate_interest_accrual(doc):
+	"""Dry run of an unsaved Process Loan Interest Accrual, see `simulate_accruals`"""
+	frappe.has_permission("Process Loan Interest Accrual", "create", throw=True)
+
+	doc = frappe.get_doc(frappe.parse_json(doc))
+	if doc.doctype != "Process Loan Interest Accrual":
+		frappe.throw(_("Only a Process Loan Interest Accrual can be simulated"))
+
+	return doc.simulate_accruals()
@@ -0,0 +1,378 @@
+"""
+Loan-sharded background workers for historical interest accrual
+
+A Process Loan Interest Accrual over a date range splits its loans into shards of
+disjoint, sorted loan names. Every shard runs as its own job on the long queue and
+accrues all dates of the range for its loans, in date order. When the job queue is not
+reachable (a site without Redis) the shards run in a local pool of processes instead,
+spawned once the request commits so the request does not wait on them.
+
+The Process Loan Interest Accrual document is the coordinator: it records the number of
+shards, each finished shard increments the completed or failed counter, and the last one
+to finish sets the final status.
+
+It also holds a checkpoint per shard: the shard's loans and the last date accrued for
+them. A shard accrues its range in chunks of days and moves the checkpoint in the same
+transaction as each chunk's accruals, so `resume_accrual_shards` restarts a failed or
+killed run from the last committed date of every unfinished shard.
+
+Shard and chunk sizes, and the size of the local pool, are configured per site:
+
+	bench --site <site> set-config lending_custom_accrual_shard_size 200
+	bench --site <site> set-config lending_custom_accrual_checkpoint_days 30
+	bench --site <site> set-config lending_custom_accrual_workers 4
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, cint, getdate
+
+from lending_custom.accrual_metrics import collect_metrics, save_run_metrics
+from lending_custom.historical_accrual import (
+	ACCRUAL_PERIOD_DAILY,
+	DEMAND_LOAN_STATUSES,
+	get_period_end,
+	process_accruals_for_range,
+)
+
+SHARD_SIZE_KEY = "lending_custom_accrual_shard_size"
+CHECKPOINT_DAYS_KEY = "lending_custom_accrual_checkpoint_days"
+WORKERS_KEY = "lending_custom_accrual_workers"
+DEFAULT_SHARD_SIZE = 200
+DEFAULT_CHECKPOINT_DAYS = 30
+SHARD_TIMEOUT = 4 * 60 * 60
+
+STATUS_QUEUED = "Queued"
+STATUS_IN_PROGRESS = "In Progress"
+STATUS_COMPLETED = "Completed"
+STATUS_FAILED = "Failed"
+
+
+def enqueue_accrual_shards(
+	process_loan_interest,
+	start_date,
+	end_date,
+	term_loan=None,
+	loan_product=None,
+	accrual_type="Regular",
+	include_demand_loans=True,
+	include_term_loans=True,
+	accrual_period=ACCRUAL_PERIOD_DAILY,
+):
+	"""Split the loans of a range accrual into shards and dispatch one job per shard"""
+	shards = get_loan_shards(term_loan, loan_product, include_demand_loans, include_term_loans)
+	checkpoints = {
+		str(shard): {"loans": loans, "accrued_through": None} for shard, loans in enumerate(shards)
+	}
+	set_coordinator_state(process_loan_interest, checkpoints)
+
+	dispatch_shards(
+		process_loan_interest,
+		list(checkpoints),
+		start_date,
+		end_date,
+		term_loan,
+		loan_product,
+		accrual_type,
+		include_demand_loans,
+		include_term_loans,
+		accrual_period,
+	)
+
+
+@frappe.whitelist()
+def resume_accrual_shards(process_loan_interest):
+	"""Dispatch again every shard of a range accrual that has not accrued its whole range"""
+	doc = frappe.get_doc("Process Loan Interest Accrual", process_loan_interest)
+	doc.check_permission("submit")
+
+	if doc.docstatus != 1 or not (doc.start_date and doc.end_date):
+		frappe.throw(_("Only submitted historical accruals with a date range can be resumed"))
+
+	if doc.accrual_status == STATUS_COMPLETED:
+		frappe.throw(_("Interest accrual {0} has already completed").format(frappe.bold(doc.name)))
+
+	checkpoints = get_checkpoints(doc.name)
+	pending = [
+		shard for shard, checkpoint in checkpoints.items() if not is_shard_done(checkpoint, doc.end_date)
+	]
+	frappe.db.set_value(
+		"Process Loan Interest Accrual",
+		doc.name,
+		{
+			"completed_accrual_shards": len(checkpoints) - len(pending),
+			"failed_accrual_shards": 0,
+			"accrual_status": STATUS_QUEUED if pending else STATUS_COMPLETED,
+		},
+		update_modified=False,
+	)
+
+	dispatch_shards(doc.name, pending, **doc.get_range_accrual_args())
+	return len(pending)
+
+
+def dispatch_shards(
+	process_loan_interest,
+	shards,
+	start_date,
+	end_date,
+	term_loan=None,
+	loan_product=None,
+	accrual_type="Regular",
+	include_demand_loans=True,
+	include_term_loans=True,
+	accrual_period=ACCRUAL_PERIOD_DAILY,
+):
+	jobs = [
+		{
+			"process_loan_interest": process_loan_interest,
+			"shard": shard,
+			"start_date": str(start_date),
+			"end_date": str(end_date),
+			"term_loan": term_loan,
+			"loan_product": loan_product,
+			"accrual_type": accrual_type,
+			"include_demand_loans": include_demand_loans,
+			"include_term_loans": include_term_loans,
+			"accrual_period": accrual_period,
+		}
+		for shard in shards
+	]
+	if not jobs:
+		return
+
+	if not (frappe.flags.in_test or is_queue_available()):
+		# the shards read the coordinator state written by this request
+		frappe.db.after_commit.add(partial(start_local_shard_workers, jobs))
+		return
+
+	for job in jobs:
+		frappe.enqueue(
+			"lending_custom.accrual_workers.run_accrual_shard",
+			queue="long",
+			timeout=SHARD_TIMEOUT,
+			# a resumed shard is not enqueued again while its job is still running
+			job_id=f"{process_loan_interest}::{job['shard']}",
+			deduplicate=True,
+			enqueue_after_commit=True,
+			now=frappe.flags.in_test,
+			**job,
+		)
+
+
+def get_loan_shards(term_loan=None, loan_product=None, include_demand_loans=True, include_term_loans=True):
+	"""Sorted loan names to accrue, split into disjoint shards of the configured size"""
+	if term_loan:
+		return [[term_loan]]
+
+	loans = set()
+	filters = {"docstatus": 1}
+	if loan_product:
+		filters["loan_product"] = loan_product
+
+	if include_demand_loans:
+		loans.update(
+			frappe.get_all(
+				"Loan",
+				filters={**filters, "is_term_loan": 0, "status": ("in", DEMAND_LOAN_STATUSES)},
+				pluck="name",
+			)
+		)
+
+	if include_term_loans:
+		loans.update(
+			frappe.get_all(
+				"Loan", filters={**filters, "is_term_loan": 1, "status": "Disbursed"}, pluck="name"
+			)
+		)
+
+	loans = sorted(loans)
+	shard_size = cint(frappe.conf.get(SHARD_SIZE_KEY)) or DEFAULT_SHARD_SIZE
+	return [loans[i : i + shard_size] for i in range(0, len(loans), shard_size)]
+
+
+def set_coordinator_state(process_loan_interest, checkpoints):
+	frappe.db.set_value(
+		"Process Loan Interest Accrual",
+		process_loan_interest,
+		{
+			"accrual_shards": len(checkpoints),
+			"completed_accrual_shards": 0,
+			"failed_accrual_shards": 0,
+			"accrual_status": STATUS_QUEUED if checkpoints else STATUS_COMPLETED,
+			"accrual_checkpoints": frappe.as_json(checkpoints, indent=None),
+		},
+		update_modified=False,
+	)
+
+
+def get_checkpoints(process_loan_interest, for_update=False):
+	"""Checkpoint of every shard, keyed by shard number"""
+	checkpoints = frappe.db.get_value(
+		"Process Loan Interest Accrual", process_loan_interest, "accrual_checkpoints", for_update=for_update
+	)
+	return frappe.parse_json(checkpoints) if checkpoints else {}
+
+
+def save_checkpoint(process_loan_interest, shard, accrued_through):
+	"""Record that `shard` has accrued every date up to accrued_through, committed by the caller"""
+	# the locking read keeps shards finishing a chunk at the same time from losing updates
+	checkpoints = get_checkpoints(process_loan_interest, for_update=True)
+	checkpoints[shard]["accrued_through"] = str(accrued_through)
+	frappe.db.set_value(
+		"Process Loan Interest Accrual",
+		process_loan_interest,
+		"accrual_checkpoints",
+		frappe.as_json(checkpoints, indent=None),
+		update_modified=False,
+	)
+
+
+def is_shard_done(checkpoint, end_date):
+	return bool(checkpoint["accrued_through"]) and getdate(checkpoint["accrued_through"]) >= getdate(end_date)
+
+
+def get_date_chunks(start_date, end_date, accrual_period=ACCRUAL_PERIOD_DAILY):
+	"""
+	(first, last) date of each checkpointed chunk of the range, both inclusive. Chunks of a
+	compacted accrual end on a period end, so no period is split into two accruals.
+	"""
+	days = cint(frappe.conf.get(CHECKPOINT_DAYS_KEY)) or DEFAULT_CHECKPOINT_DAYS
+	chunk_start, end_date = getdate(start_date), getdate(end_date)
+	while chunk_start <= end_date:
+		chunk_end = min(get_period_end(add_days(chunk_start, days - 1), accrual_period), end_date)
+		yield chunk_start, chunk_end
+		chunk_start = add_days(chunk_end, 1)
+
+
+def is_queue_available():
+	try:
+		from frappe.utils.background_jobs import get_redis_conn
+
+		return bool(get_redis_conn().ping())
+	except Exception:
+		return False
+
+
+def start_local_shard_workers(jobs):
+	"""Run the shards in a spawned process, which outlives the request that dispatched them"""
+	# the spawned process has no site loaded, so the pool size is read here
+	multiprocessing.get_context("spawn").Process(
+		target=run_shards_in_process_pool,
+		args=(frappe.local.site, frappe.local.sites_path, jobs, cint(frappe.conf.get(WORKERS_KEY))),
+	).start()
+
+
+def run_shards_in_process_pool(site, sites_path, jobs, workers=None):
+	workers = cint(workers) or os.cpu_count() or 1
+	with ProcessPoolExecutor(
+		max_workers=min(workers, len(jobs)), mp_context=multiprocessing.get_context("spawn")
+	) as pool:
+		# list() waits for every shard; each one reports its own failure to the coordinator
+		list(pool.map(partial(_run_shard_for_site, site, sites_path), jobs))
+
+
+def _run_shard_for_site(site, sites_path, job):
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	try:
+		run_accrual_shard(**job)
+	finally:
+		frappe.destroy()
+
+
+def run_accrual_shard(
+	process_loan_interest,
+	shard,
+	start_date,
+	end_date,
+	term_loan=None,
+	loan_product=None,
+	accrual_type="Regular",
+	include_demand_loans=True,
+	include_term_loans=True,
+	accrual_period=ACCRUAL_PERIOD_DAILY,
+):
+	"""
+	Accrue the dates of the range after the shard's checkpoint for its loans, one committed
+	chunk at a time, then report to the coordinator
+	"""
+	frappe.db.set_value(
+		"Process Loan Interest Accrual",
+		{"name": process_loan_interest, "accrual_status": STATUS_QUEUED},
+		"accrual_status",
+		STATUS_IN_PROGRESS,
+		update_modified=False,
+	)
+	frappe.db.commit()
+
+	try:
+		checkpoint = get_checkpoints(process_loan_interest)[shard]
+		if checkpoint["accrued_through"]:
+			start_date = max(getdate(start_date), add_days(checkpoint["accrued_through"], 1))
+
+		# a single loan accrues even when it is no longer open, as on_submit did
+		open_loans = [frappe.get_doc("Loan", term_loan)] if term_loan else None
+		for chunk_start, chunk_end in get_date_chunks(start_date, end_date, accrual_period):
+			with collect_metrics() as metrics:
+				process_accruals_for_range(
+					process_loan_interest,
+					chunk_start,
+					chunk_end,
+					open_loans=open_loans,
+					term_loan=term_loan,
+					loan_product=loan_product,
+					accrual_type=accrual_type,
+					include_demand_loans=include_demand_loans,
+					include_term_loans=include_term_loans,
+					loans=checkpoint["loans"],
+					accrual_period=accrual_period,
+				)
+			save_checkpoint(process_loan_interest, shard, chunk_end)
+			# the metrics of a chunk are committed with it, a failed chunk counts nothing
+			save_run_metrics(process_loan_interest, metrics)
+			frappe.db.commit()
+
+		failed = False
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(
+			title=f"Interest accrual shard {shard} of {process_loan_interest} failed",
+			reference_doctype="Process Loan Interest Accrual",
+			reference_name=process_loan_interest,
+		)
+		failed = True
+
+	complete_shard(process_loan_interest, failed)
+
+
+def complete_shard(process_loan_interest, failed=False):
+	"""Count a finished shard on the coordinator, the last shard sets the final status"""
+	accrual = frappe.qb.DocType("Process Loan Interest Accrual")
+	counter = accrual.failed_accrual_shards if failed else accrual.completed_accrual_shards
+
+	# the increment locks the coordinator row until the commit, so exactly one shard sees
+	# the final count
+	frappe.qb.update(accrual).set(counter, counter + 1).where(accrual.name == process_loan_interest).run()
+	shards, completed, failed_shards = frappe.db.get_value(
+		"Process Loan Interest Accrual",
+		process_loan_interest,
+		["accrual_shards", "completed_accrual_shards", "failed_accrual_shards"],
+		for_update=True,
+	)
+
+	if completed + failed_shards >= shards:
+		frappe.db.set_value(
+			"Process Loan Interest Accrual",
+			process_loan_interest,
+			"accrual_status",
+			STATUS_FAILED if failed_shards else STATUS_COMPLETED,
+			update_modified=False,
+		)
+
+	frappe.db.commit()
@@ -0,0 +1,310 @@
+"""
+Batched Loan Interest Accrual writer
+
+lending's make_loan_interest_accrual_entry inserts and submits one Loan Interest Accrual
+at a time, and each submit posts its own GL entries through the full GL Entry validation.
+`AccrualWriter` takes the same arguments, buffers them and writes a batch at a time:
+
+- the accruals are checked together, named and inserted submitted with multi-row INSERTs
+- their GL entries (debit loan account, credit interest income, as LoanInterestAccrual
+  posts them) are built for the whole batch and debit = credit is verified per voucher in
+  one pass. Per company and posting date they go through the checks of erpnext's
+  make_gl_entries (accounting period, disabled and frozen accounts, freezing date,
+  accounting dimensions, Payment Ledger Entries, budget) and GLEntry's own validations,
+  then are inserted submitted with multi-row INSERTs. GL Entry doc_events of other apps
+  are not run.
+
+Nothing is committed here: the accrual runs commit once per chunk (one checkpointed chunk
+of dates of a shard, or the request).
+
+Accruals of a batch must not depend on each other. A demand loan accrual reads the
+pending interest of its loan from the ledger, so callers flush before accruing a loan
+again on a later date.
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, getdate, nowdate
+
+from lending_custom.accrual_metrics import PHASE_POSTING, metrics_phase, record_metrics
+from lending_custom.bulk_persistence import bulk_insert_documents
+from lending_custom.tracing import span
+
+BATCH_SIZE_KEY = "lending_custom_accrual_batch_size"
+DEFAULT_BATCH_SIZE = 500
+
+
+class AccrualWriter:
+	"""Buffered stand-in for make_loan_interest_accrual_entry"""
+
+	def __init__(self, batch_size=None):
+		self.batch_size = batch_size or cint(frappe.conf.get(BATCH_SIZE_KEY)) or DEFAULT_BATCH_SIZE
+		self.accruals = []
+
+	def add(self, args):
+		"""Queue one accrual, `args` as for make_loan_interest_accrual_entry"""
+		self.accruals.append(args)
+		if len(self.accruals) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		"""Write the queued accruals and their GL entries"""
+		if not self.accruals:
+			return
+
+		accruals, self.accruals = self.accruals, []
+		with metrics_phase(PHASE_POSTING):
+			write_accruals(accruals)
+		record_metrics(accruals_written=len(accruals))
+
+
+def write_accruals(accruals):
+	with span("write_accruals", rows=len(accruals)):
+		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		docs = [make_accrual_doc(args, precision) for args in accruals]
+		validate_accruals(docs)
+
+		loans = {
+			loan.name: loan
+			for loan in frappe.get_all(
+				"Loan",
+				filters={"name": ("in", list({doc.loan for doc in docs}))},
+				fields=["name", "company", "cost_center", "disbursement_date"],
+			)
+		}
+		for doc in docs:
+			doc.company = loans[doc.loan].company
+
+		set_last_accrual_dates(docs, loans)
+
+		for doc in docs:
+			doc.docstatus = 1
+			doc.set_user_and_timestamp()
+			doc.set_new_name()
+
+		bulk_insert_documents(docs)
+		make_accrual_gl_entries(docs, loans)
+
+
+def make_accrual_doc(args, precision):
+	"""Loan Interest Accrual of make_loan_interest_accrual_entry, not yet saved"""
+	doc = frappe.new_doc("Loan Interest Accrual")
+	doc.update(
+		{
+			"loan": args.loan,
+			"applicant_type": args.applicant_type,
+			"applicant": args.applicant,
+			"interest_income_account": args.interest_income_account,
+			"loan_account": args.loan_account,
+			"pending_principal_amount": flt(args.pending_principal_amount, precision),
+			"interest_amount": flt(args.interest_amount, precision),
+			"total_pending_interest_amount": flt(args.total_pending_interest_amount, precision),
+			"penalty_amount": flt(args.penalty_amount, precision),
+			"posting_date": getdate(args.posting_date or nowdate()),
+			"process_loan_interest_accrual": args.process_loan_interest,
+			"repayment_schedule_name": args.repayment_schedule_name,
+			"payable_principal_amount": args.payable_principal,
+			"accrual_type": args.accrual_type,
+			"due_date": args.due_date,
+			"last_accrual_date": args.last_accrual_date,
+		}
+	)
+	return doc
+
+
+def validate_accruals(docs):
+	"""LoanInterestAccrual.validate for the whole batch, reporting every offending accrual at once"""
+	without_loan = [str(idx) for idx, doc in enumerate(docs, 1) if not doc.loan]
+	if without_loan:
+		frappe.throw(_("Loan is mandatory, missing in accruals {0}").format(", ".join(without_loan)))
+
+	without_amount = [
+		doc.loan for doc in docs if not doc.interest_amount and not doc.payable_principal_amount
+	]
+	if without_amount:
+		frappe.throw(
+			_("Interest Amount or Principal Amount is mandatory, missing for loans {0}").format(
+				", ".join(without_amount)
+			)
+		)
+
+
+def set_last_accrual_dates(docs, loans):
+	"""
+	Fill in the last accrual date the callers did not know, as LoanInterestAccrual.validate
+	does, with one query per posting date instead of one per accrual. The accruals are taken
+	in batch order, and the earlier ones of the same loan count as already posted, as they
+	would be when posted one after the other.
+	"""
+	from lending_custom.historical_accrual import (
+		get_date_after_last_accrual,
+		get_last_accrual_dates,
+		get_last_disbursement_dates,
+	)
+
+	missing = {}
+	for doc in docs:
+		if not doc.last_accrual_date:
+			missing.setdefault(doc.posting_date, set()).add(doc.loan)
+
+	ledger = {
+		posting_date: (
+			get_last_accrual_dates(list(names), posting_date),
+			get_last_disbursement_dates(list(names), posting_date),
+		)
+		for posting_date, names in missing.items()
+	}
+
+	posted = {}
+	for doc in docs:
+		if not doc.last_accrual_date:
+			last_accrual_dates, last_disbursement_dates = ledger[doc.posting_date]
+			# the condition of get_last_accrual_date, over the accruals of the batch so far
+			earlier = [
+				accrual.posting_date
+				for accrual in posted.get(doc.loan, ())
+				if accrual.posting_date <= doc.posting_date
+				or (accrual.last_accrual_date and getdate(accrual.last_accrual_date) <= doc.posting_date)
+			]
+			if doc.loan in last_accrual_dates:
+				earlier.append(last_accrual_dates[doc.loan])
+
+			if earlier:
+				doc.last_accrual_date = get_date_after_last_accrual(
+					max(earlier), last_disbursement_dates.get(doc.loan)
+				)
+			else:
+				doc.last_accrual_date = loans[doc.loan].disbursement_date
+
+		posted.setdefault(doc.loan, []).append(doc)
+
+
+def make_accrual_gl_entries(docs, loans):
+	"""LoanInterestAccrual.make_gl_entries for the whole batch"""
+	gl_map = []
+	for doc in docs:
+		if not doc.interest_amount:
+			continue
+
+		remarks = _("Interest accrued from {0} to {1} against loan: {2}").format(
+			doc.last_accrual_date, doc.posting_date, doc.loan
+		)
+		cost_center = loans[doc.loan].cost_center
+		gl_map.append(
+			doc.get_gl_dict(
+				{
+					"account": doc.loan_account,
+					"party_type": doc.applicant_type,
+					"party": doc.applicant,
+					"against": doc.interest_income_account,
+					"debit": doc.interest_amount,
+					"debit_in_account_currency": doc.interest_amount,
+					"against_voucher_type": "Loan",
+					"against_voucher": doc.loan,
+					"remarks": remarks,
+					"cost_center": cost_center,
+					"posting_date": doc.posting_date,
+				}
+			)
+		)
+		gl_map.append(
+			doc.get_gl_dict(
+				{
+					"account": doc.interest_income_account,
+					"against": doc.loan_account,
+					"credit": doc.interest_amount,
+					"credit_in_account_currency": doc.interest_amount,
+					"against_voucher_type": "Loan",
+					"against_voucher": doc.loan,
+					"remarks": remarks,
+					"cost_center": cost_center,
+					"posting_date": doc.posting_date,
+				}
+			)
+		)
+
+	if not gl_map:
+		return
+
+	validate_vouchers_balance(gl_map)
+
+	# make_gl_entries checks the accounting period, freezing date and period closing of
+	# its first entry, so every group covers a single company and posting date
+	groups = {}
+	for gl in gl_map:
+		groups.setdefault((gl.company, getdate(gl.posting_date)), []).append(gl)
+
+	for group in groups.values():
+		insert_gl_entries(group)
+
+
+def insert_gl_entries(gl_map):
+	"""
+	make_gl_entries(gl_map, merge_entries=False) with one bulk insert: the checks erpnext
+	runs on the map, and the validations GLEntry.submit runs on each entry
+	"""
+	from erpnext.accounts.doctype.budget.budget import validate_expense_against_budget
+	from erpnext.accounts.doctype.gl_entry.gl_entry import validate_balance_type, validate_frozen_account
+	from erpnext.accounts.general_ledger import (
+		check_freezing_date,
+		get_dimension_filter_map,
+		make_acc_dimensions_offsetting_entry,
+		process_debit_credit_difference,
+		process_gl_map,
+		validate_accounting_period,
+		validate_allowed_dimensions,
+		validate_cwip_accounts,
+		validate_disabled_accounts,
+	)
+	from erpnext.accounts.utils import create_payment_ledger_entry
+
+	make_acc_dimensions_offsetting_entry(gl_map)
+	validate_accounting_period(gl_map)
+	validate_disabled_accounts(gl_map)
+	gl_map = process_gl_map(gl_map, merge_entries=False)
+	if not gl_map:
+		return
+
+	create_payment_ledger_entry(gl_map)
+	validate_cwip_accounts(gl_map)
+	process_debit_credit_difference(gl_map)
+	check_freezing_date(gl_map[0]["posting_date"])
+	dimension_filter_map = get_dimension_filter_map()
+
+	entries = []
+	for args in gl_map:
+		validate_allowed_dimensions(args, dimension_filter_map)
+		gle = frappe.new_doc("GL Entry")
+		gle.update(args)
+		gle.flags.ignore_permissions = 1
+		gle.flags.update_outstanding = "Yes"
+		gle.flags.notify_update = False
+		gle.docstatus = 1
+
+		gle.validate()
+		# GLEntry.on_update; the outstanding amount it updates is not kept for Loan vouchers
+		gle.validate_account_details(adv_adj=False)
+		gle.validate_dimensions_for_pl_and_bs()
+		validate_balance_type(gle.account)
+		validate_frozen_account(gle.account)
+
+		gle.set_user_and_timestamp()
+		gle.set_new_name()
+		entries.append(gle)
+
+	bulk_insert_documents(entries)
+
+	for args in gl_map:
+		validate_expense_against_budget(args)
+
+
+def validate_vouchers_balance(gl_map):
+	"""Debit equals credit for every voucher of the batch, in one pass over the entries"""
+	balances = {}
+	for gl in gl_map:
+		balances[gl.voucher_no] = balances.get(gl.voucher_no, 0.0) + flt(gl.debit) - flt(gl.credit)
+
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	unbalanced = [voucher for voucher, balance in balances.items() if abs(flt(balance, precision)) > 0]
+	if unbalanced:
+		frappe.throw(_("Debit and Credit not equal for vouchers {0}").format(", ".join(sorted(unbalanced))))
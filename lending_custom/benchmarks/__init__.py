@@ -0,0 +1,11 @@
+"""
+Benchmark suite for schedule generation and interest math
+
+Runs in-process against a stand-in for frappe and lending (see `standin`), no site needed:
+
+	python -m lending_custom.benchmarks run --save baseline.json
+	python -m lending_custom.benchmarks compare baseline.json
+
+`compare` reruns the benchmarks (or reads a second results file) and exits with status 1
+when a case got slower than the threshold or makes more database calls than the baseline.
+"""
@@ -0,0 +1,50 @@
+import argparse
+import sys
+
+from lending_custom.benchmarks import suite
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+		prog="python -m lending_custom.benchmarks", description="Benchmark the loan hot paths"
+	)
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	run_parser = commands.add_parser("run", help="run the benchmarks")
+	run_parser.add_argument("--save", metavar="PATH", help="save the results as a baseline file")
+	run_parser.add_argument("--filter", metavar="TEXT", help="only run cases whose name contains TEXT")
+
+	compare_parser = commands.add_parser("compare", help="compare results against a baseline file")
+	compare_parser.add_argument("baseline", help="baseline file saved by `run --save`")
+	compare_parser.add_argument(
+		"current", nargs="?", help="results file to compare, the benchmarks are run when omitted"
+	)
+	compare_parser.add_argument("--filter", metavar="TEXT", help="only run cases whose name contains TEXT")
+	compare_parser.add_argument(
+		"--threshold",
+		type=float,
+		default=suite.DEFAULT_THRESHOLD,
+		help="slowdown counted as a regression (default: %(default)s)",
+	)
+
+	args = parser.parse_args(argv)
+
+	if args.command == "run":
+		report = suite.run(args.filter)
+		if args.save:
+			suite.save(report, args.save)
+			print(f"Saved results to {args.save}")
+		return 0
+
+	baseline = suite.load(args.baseline)
+	current = suite.load(args.current) if args.current else suite.run(args.filter, echo=lambda line: None)
+	regressions = suite.compare(baseline, current, args.threshold)
+	if regressions:
+		print(f"{len(regressions)} regression(s)")
+		return 1
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+In-process stand-in for the parts of frappe and lending used by the benchmarked code
+
+`install()` registers lightweight `frappe`, `frappe.utils`, `frappe.query_builder` and
+`lending` modules in `sys.modules`, so the loan hot paths can be imported and timed without a site. Database
+reads are served from `db.values` and every database method counts its calls in
+`db.calls`.
+"""
+
+import calendar
+import datetime
+import json
+import secrets
+import sys
+import types
+from collections import Counter
+
+
+class _dict(dict):
+	__getattr__ = dict.get
+	__setattr__ = dict.__setitem__
+	__delattr__ = dict.__delitem__
+
+	def copy(self):
+		return _dict(self)
+
+
+class ValidationError(Exception):
+	pass
+
+
+class Database:
+	def __init__(self):
+		self.values = {}
+		self.calls = Counter()
+
+	def get_value(self, doctype, filters=None, fieldname="name", as_dict=False, **kwargs):
+		self.calls["get_value"] += 1
+		record = self.values.get((doctype, filters))
+		if record is None:
+			return None
+
+		if isinstance(fieldname, (list, tuple)):
+			values = [record.get(field) for field in fieldname]
+			return _dict(zip(fieldname, values, strict=True)) if as_dict else values
+
+		return record.get(fieldname)
+
+	def get_all(self, doctype, filters=None, fields=None, pluck=None, **kwargs):
+		self.calls["get_all"] += 1
+		records = [
+			_dict(record, name=name)
+			for (record_doctype, name), record in self.values.items()
+			if record_doctype == doctype
+		]
+		return [record.get(pluck) for record in records] if pluck else records
+
+	def sql(self, *args, **kwargs):
+		self.calls["sql"] += 1
+		return []
+
+	def bulk_insert(self, *args, **kwargs):
+		self.calls["bulk_insert"] += 1
+
+	def delete(self, *args, **kwargs):
+		self.calls["delete"] += 1
+
+	def set_value(self, *args, **kwargs):
+		self.calls["set_value"] += 1
+
+	def reset(self):
+		self.calls.clear()
+
+
+def getdate(value=None):
+	if value is None:
+		return datetime.date.today()
+	if isinstance(value, datetime.datetime):
+		return value.date()
+	if isinstance(value, datetime.date):
+		return value
+	return datetime.date.fromisoformat(str(value)[:10])
+
+
+def flt(value, precision=None):
+	try:
+		number = float(value or 0)
+	except (TypeError, ValueError):
+		number = 0.0
+	return round(number, precision) if precision is not None else number
+
+
+def cint(value):
+	try:
+		return int(float(value or 0))
+	except (TypeError, ValueError):
+		return 0
+
+
+def add_days(date, days):
+	return getdate(date) + datetime.timedelta(days=days)
+
+
+def add_months(date, months):
+	date = getdate(date)
+	month = date.month - 1 + months
+	year = date.year + month // 12
+	month = month % 12 + 1
+	return datetime.date(year, month, min(date.day, calendar.monthrange(year, month)[1]))
+
+
+def get_last_day(date):
+	date = getdate(date)
+	return datetime.date(date.year, date.month, calendar.monthrange(date.year, date.month)[1])
+
+
+def date_diff(end, start):
+	return (getdate(end) - getdate(start)).days
+
+
+def days_in_year(year):
+	return 366 if calendar.isleap(year) else 365
+
+
+def get_quarter_ending(date):
+	date = getdate(date)
+	return get_last_day(datetime.date(date.year, (date.month - 1) // 3 * 3 + 3, 1))
+
+
+def get_year_ending(date):
+	return datetime.date(getdate(date).year, 12, 31)
+
+
+def add_single_month(date):
+	if getdate(date) == get_last_day(date):
+		return get_last_day(add_months(date, 1))
+	return add_months(date, 1)
+
+
+class QueryFunction:
+	"""Stand-in for the frappe.query_builder.functions the accrual code imports"""
+
+	def __init__(self, *args, **kwargs):
+		self.args = args
+
+
+class Document:
+	"""Attribute bag standing in for frappe.model.document.Document"""
+
+	def __init__(self, **fields):
+		self.__dict__.update(fields)
+		self.flags = _dict()
+
+	def __getattr__(self, name):
+		return None
+
+	def get(self, key, default=None):
+		return self.__dict__.get(key, default)
+
+	def set(self, key, value):
+		self.__dict__[key] = value
+
+	def update(self, values):
+		self.__dict__.update(values)
+
+	def append(self, key, value):
+		row = Document(**value)
+		if self.get(key) is None:
+			self.set(key, [])
+		self.get(key).append(row)
+		return row
+
+
+class LoanRepaymentSchedule(Document):
+	def add_repayment_schedule_row(
+		self, payment_date, principal_amount, interest_amount, total_payment, balance_loan_amount, days
+	):
+		self.append(
+			"repayment_schedule",
+			{
+				"payment_date": payment_date,
+				"principal_amount": principal_amount,
+				"interest_amount": interest_amount,
+				"total_payment": total_payment,
+				"balance_loan_amount": balance_loan_amount,
+				"number_of_days": days,
+			},
+		)
+
+
+def _noop(*args, **kwargs):
+	pass
+
+
+class _Logger:
+	def __getattr__(self, name):
+		return _noop
+
+
+def _make_module(name, **attributes):
+	module = types.ModuleType(name)
+	module.__dict__.update(attributes)
+	sys.modules[name] = module
+	return module
+
+
+def install():
+	"""Register the stand-in modules and return the stand-in `frappe` module"""
+	db = Database()
+
+	def throw(message, exc=ValidationError, *args, **kwargs):
+		raise exc(message)
+
+	def get_cached_value(doctype, name, fieldname, as_dict=False):
+		return db.get_value(doctype, name, fieldname, as_dict=as_dict)
+
+	frappe = _make_module(
+		"frappe",
+		_dict=_dict,
+		_=lambda message, *args, **kwargs: message,
+		ValidationError=ValidationError,
+		bold=lambda text: text,
+		throw=throw,
+		msgprint=_noop,
+		log_error=_noop,
+		logger=lambda *args, **kwargs: _Logger(),
+		whitelist=lambda *args, **kwargs: lambda fn: fn,
+		parse_json=lambda value: json.loads(value) if isinstance(value, str) else value,
+		generate_hash=lambda *args, length=10, **kwargs: secrets.token_hex(length)[:length],
+		get_cached_value=get_cached_value,
+		get_all=db.get_all,
+		db=db,
+		local=types.SimpleNamespace(form_dict=None),
+		conf=_dict(),
+		flags=_dict(),
+		form_dict=None,
+	)
+	_make_module(
+		"frappe.utils",
+		add_days=add_days,
+		add_months=add_months,
+		cint=cint,
+		date_diff=date_diff,
+		days_in_year=days_in_year,
+		flt=flt,
+		get_datetime=lambda value=None: (
+			datetime.datetime.fromisoformat(str(value)) if value else datetime.datetime.now()
+		),
+		get_last_day=get_last_day,
+		get_quarter_ending=get_quarter_ending,
+		get_year_ending=get_year_ending,
+		getdate=getdate,
+		nowdate=lambda: datetime.date.today().isoformat(),
+	)
+	frappe.utils = sys.modules["frappe.utils"]
+	frappe.query_builder = _make_module("frappe.query_builder", __path__=[])
+	frappe.query_builder.functions = _make_module(
+		"frappe.query_builder.functions",
+		Coalesce=type("Coalesce", (QueryFunction,), {}),
+		Max=type("Max", (QueryFunction,), {}),
+		Sum=type("Sum", (QueryFunction,), {}),
+	)
+
+	doctype = "lending.loan_management.doctype"
+	for package in ("lending", "lending.loan_management", doctype):
+		_make_module(package, __path__=[])
+	_make_module(
+		f"{doctype}.loan_repayment_schedule.loan_repayment_schedule",
+		LoanRepaymentSchedule=LoanRepaymentSchedule,
+		add_single_month=add_single_month,
+		get_monthly_repayment_amount=_noop,
+	)
+	_make_module(f"{doctype}.loan.loan", Loan=type("Loan", (Document,), {}))
+	_make_module(
+		f"{doctype}.loan_application.loan_application",
+		LoanApplication=type("LoanApplication", (Document,), {}),
+	)
+	_make_module(
+		f"{doctype}.loan_repayment.loan_repayment", LoanRepayment=type("LoanRepayment", (Document,), {})
+	)
+	_make_module(
+		f"{doctype}.process_loan_interest_accrual.process_loan_interest_accrual",
+		ProcessLoanInterestAccrual=type("ProcessLoanInterestAccrual", (Document,), {}),
+	)
+	_make_module(
+		f"{doctype}.loan_interest_accrual.loan_interest_accrual",
+		make_accrual_interest_entry_for_demand_loans=_noop,
+		make_accrual_interest_entry_for_term_loans=_noop,
+	)
+
+	# modules imported before the stand-in was installed are bound to the real frappe; the
+	# benchmarks and tests that install it are not
+	for name in list(sys.modules):
+		if name.startswith("lending_custom.") and not name.startswith(
+			("lending_custom.benchmarks", "lending_custom.tests")
+		):
+			del sys.modules[name]
+
+	return frappe
@@ -0,0 +1,230 @@
+"""
+Benchmarks of the loan hot paths
+
+Every case runs once per interest calculation method and schedule length in
+PERIODS, as a cold request: the request-scoped settings cache and the payment
+calendars are cleared before each run. Reported per case:
+
+- wall_ms: best wall time over the timed repeats
+- peak_kib: peak memory allocated during one run (tracemalloc)
+- db_calls: database calls made during one run
+- rows: rows in the resulting schedule, where there is one
+"""
+
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from lending_custom.benchmarks import standin
+
+PERIODS = (12, 120, 1200, 10000)
+INTEREST_CALCULATION_METHODS = ("Monthly Prorated", "One-time Percentage")
+
+# A low rate on a large principal keeps the rounded up instalment of even a 10,000 period
+# loan amortizing, so long schedules actually run (close) to term
+LOAN_AMOUNT = 100_000_000
+RATE_OF_INTEREST = 1.2
+REPAYMENT_START_DATE = "2024-01-15"
+POSTING_DATE = "2024-01-01"
+
+# Timed repeats per case stop after this many seconds (at least MIN_REPEATS runs)
+TIME_BUDGET = 0.5
+MIN_REPEATS = 3
+
+# A case counts as a regression when it gets this much slower than the baseline, and by
+# more than MIN_REGRESSION_MS so timer noise on sub-microsecond cases is not reported
+DEFAULT_THRESHOLD = 0.1
+MIN_REGRESSION_MS = 0.01
+
+
+def _setup():
+	frappe = standin.install()
+	frappe.db.values[("Loan Product", "Benchmark Product")] = {
+		"interest_calculation_method": None,
+		"repayment_schedule_type": "Monthly as per repayment start date",
+		"repayment_date_on": None,
+	}
+	return frappe
+
+
+def get_cases():
+	"""(name, method, periods, fn) for every benchmark case; fn runs the case once"""
+	frappe = _setup()
+
+	from lending_custom.interest_calculations import (
+		calculate_payable_amount_custom,
+		get_monthly_repayment_amount_custom,
+	)
+	from lending_custom.overrides.loan_repayment_schedule import LoanRepaymentScheduleOverride
+
+	def new_schedule(method, periods):
+		frappe.db.values[("Loan", "Benchmark Loan")] = {
+			"loan_product": "Benchmark Product",
+			"interest_calculation_method": method,
+		}
+		return LoanRepaymentScheduleOverride(
+			loan="Benchmark Loan",
+			loan_product="Benchmark Product",
+			loan_amount=LOAN_AMOUNT,
+			rate_of_interest=RATE_OF_INTEREST,
+			repayment_periods=periods,
+			monthly_repayment_amount=get_monthly_repayment_amount_custom(
+				LOAN_AMOUNT, RATE_OF_INTEREST, periods, method
+			),
+			repayment_start_date=REPAYMENT_START_DATE,
+			posting_date=POSTING_DATE,
+			adjusted_interest=0,
+		)
+
+	def monthly_repayment_amount(method, periods):
+		get_monthly_repayment_amount_custom(LOAN_AMOUNT, RATE_OF_INTEREST, periods, method)
+
+	def payable_amount(method, periods):
+		calculate_payable_amount_custom(
+			frappe._dict(
+				name="Benchmark Application",
+				loan_amount=LOAN_AMOUNT,
+				rate_of_interest=RATE_OF_INTEREST,
+				repayment_amount=get_monthly_repayment_amount_custom(
+					LOAN_AMOUNT, RATE_OF_INTEREST, periods, method
+				),
+				interest_calculation_method=method,
+			)
+		)
+
+	def repayment_schedule(method, periods):
+		schedule = new_schedule(method, periods)
+		schedule.make_repayment_schedule()
+		return len(schedule.repayment_schedule)
+
+	def one_time_schedule(method, periods):
+		schedule = new_schedule(method, periods)
+		schedule.make_repayment_schedule_one_time()
+		return len(schedule.repayment_schedule)
+
+	cases = []
+	for method in INTEREST_CALCULATION_METHODS:
+		for periods in PERIODS:
+			cases.append(("get_monthly_repayment_amount_custom", method, periods, monthly_repayment_amount))
+			cases.append(("calculate_payable_amount_custom", method, periods, payable_amount))
+			cases.append(("make_repayment_schedule", method, periods, repayment_schedule))
+			if method == "One-time Percentage":
+				cases.append(("make_repayment_schedule_one_time", method, periods, one_time_schedule))
+
+	return cases
+
+
+def get_case_key(name, method, periods):
+	return f"{name}[{method}, {periods}]"
+
+
+def _start_request():
+	import frappe
+
+	from lending_custom.loan_settings import clear_loan_settings_cache
+	from lending_custom.schedule_engine import clear_payment_calendar_cache
+
+	clear_loan_settings_cache()
+	clear_payment_calendar_cache()
+	frappe.db.reset()
+
+
+def measure(fn, *args):
+	"""Wall time, peak allocation, database calls and result of running fn(*args)"""
+	import frappe
+
+	_start_request()
+	tracemalloc.start()
+	result = fn(*args)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	db_calls = sum(frappe.db.calls.values())
+
+	timings = []
+	started = time.perf_counter()
+	while len(timings) < MIN_REPEATS or time.perf_counter() - started < TIME_BUDGET:
+		_start_request()
+		run_started = time.perf_counter()
+		fn(*args)
+		timings.append(time.perf_counter() - run_started)
+
+	return {
+		"wall_ms": round(min(timings) * 1000, 4),
+		"peak_kib": round(peak / 1024, 1),
+		"db_calls": db_calls,
+		"rows": result,
+		"repeats": len(timings),
+	}
+
+
+def run(pattern=None, echo=print):
+	"""Run all cases whose key contains `pattern` and return the results keyed by case"""
+	results = {}
+	for name, method, periods, fn in get_cases():
+		key = get_case_key(name, method, periods)
+		if pattern and pattern not in key:
+			continue
+
+		results[key] = measure(fn, method, periods)
+		echo(format_result(key, results[key]))
+
+	return {
+		"meta": {
+			"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"machine": platform.machine(),
+		},
+		"results": results,
+	}
+
+
+def format_result(key, result):
+	rows = "" if result["rows"] is None else f"  rows={result['rows']}"
+	return (
+		f"{key:<72} {result['wall_ms']:>11.3f} ms  {result['peak_kib']:>10.1f} KiB"
+		f"  db={result['db_calls']}{rows}"
+	)
+
+
+def save(report, path):
+	with open(path, "w") as f:
+		json.dump(report, f, indent=1, sort_keys=True)
+
+
+def load(path):
+	with open(path) as f:
+		return json.load(f)
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, echo=print):
+	"""
+	Print the change of every case present in both reports and return the keys of
+	regressed cases: slower by more than `threshold` or making more database calls
+	"""
+	regressions = []
+	for key, before in baseline["results"].items():
+		after = current["results"].get(key)
+		if not after:
+			continue
+
+		ratio = after["wall_ms"] / before["wall_ms"] if before["wall_ms"] else 1.0
+		slower = ratio > 1 + threshold and after["wall_ms"] - before["wall_ms"] > MIN_REGRESSION_MS
+		regressed = slower or after["db_calls"] > before["db_calls"]
+		if regressed:
+			regressions.append(key)
+
+		echo(
+			f"{key:<72} {before['wall_ms']:>11.3f} -> {after['wall_ms']:>11.3f} ms ({ratio:>6.2f}x)"
+			f"  db {before['db_calls']} -> {after['db_calls']}"
+			f"  peak {before['peak_kib']:.1f} -> {after['peak_kib']:.1f} KiB"
+			+ ("  REGRESSION" if regressed else "")
+		)
+
+	for key in sorted(set(current["results"]) - set(baseline["results"])):
+		echo(f"{key:<72} new case")
+
+	return regressions
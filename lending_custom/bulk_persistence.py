@@ -0,0 +1,131 @@
+"""
+Bulk persistence of child table rows
+
+Frappe writes child rows one INSERT (or UPDATE) at a time. Daily and weekly collection
+products produce repayment schedules with hundreds or thousands of rows, so
+LoanRepaymentScheduleOverride hands its `repayment_schedule` table to these helpers
+instead: rows are named in a single pass, checked together and written with
+multi-row INSERT statements. `bulk_insert_documents` does the same for already named and
+validated documents, such as the Loan Interest Accruals of the batched accrual writer.
+"""
+
+import frappe
+from frappe import _
+
+# Rows per INSERT statement
+BULK_INSERT_CHUNK_SIZE = 1000
+
+
+def set_child_row_names(rows):
+	"""Name every unnamed row in one pass, the way frappe names hash-named child rows"""
+	for row in rows:
+		if not row.name:
+			row.name = frappe.generate_hash(length=10)
+
+
+def validate_child_rows(rows):
+	"""Check the whole set of rows before writing it, reporting every offending row at once"""
+	mandatory_fields = [df.fieldname for df in frappe.get_meta(rows[0].doctype).get("fields", {"reqd": 1})]
+
+	seen = set()
+	duplicates = []
+	missing = []
+	for row in rows:
+		if row.name in seen:
+			duplicates.append(str(row.idx))
+		seen.add(row.name)
+
+		if any(row.get(fieldname) in (None, "") for fieldname in mandatory_fields):
+			missing.append(str(row.idx))
+
+	if duplicates:
+		frappe.throw(_("Duplicate row names in rows {0}").format(", ".join(duplicates)))
+
+	if missing:
+		frappe.throw(
+			_("Mandatory fields missing in {0} rows {1}").format(_(rows[0].doctype), ", ".join(missing))
+		)
+
+
+def bulk_insert_child_rows(parent, fieldname, rows=None):
+	"""
+	Insert rows of the child table `fieldname` of `parent` with multi-row INSERTs, all of
+	them unless a subset is passed as `rows`
+	"""
+	table = parent.get(fieldname) or []
+	for idx, row in enumerate(table, 1):
+		row.parent = parent.name
+		row.parenttype = parent.doctype
+		row.parentfield = fieldname
+		row.idx = idx
+
+	rows = table if rows is None else rows
+	if not rows:
+		return
+
+	set_child_row_names(rows)
+	validate_child_rows(rows)
+	bulk_insert_documents(rows)
+
+
+def bulk_insert_documents(docs):
+	"""Insert documents of one doctype with multi-row INSERTs, they must already be named"""
+	if not docs:
+		return
+
+	records = [doc.get_valid_dict(convert_dates_to_str=True) for doc in docs]
+	fields = list(records[0])
+	frappe.db.bulk_insert(
+		docs[0].doctype,
+		fields,
+		[[record.get(field) for field in fields] for record in records],
+		chunk_size=BULK_INSERT_CHUNK_SIZE,
+	)
+
+	for doc in docs:
+		doc.set("__islocal", False)
+
+
+def replace_child_rows(parent, fieldname, df=None):
+	"""
+	Bulk version of Document.update_child_table: delete the stored rows of the child table
+	and insert the current ones, one DELETE and one INSERT per chunk instead of a statement
+	per row
+	"""
+	df = df or parent.meta.get_field(fieldname)
+	frappe.db.delete(
+		df.options, {"parent": parent.name, "parenttype": parent.doctype, "parentfield": fieldname}
+	)
+	bulk_insert_child_rows(parent, fieldname)
+
+
+def update_child_rows(parent, fieldname, changed_names, df=None):
+	"""
+	Incremental version of replace_child_rows: insert new rows in bulk, update only the
+	stored rows named in `changed_names` and delete stored rows no longer in the table
+	"""
+	df = df or parent.meta.get_field(fieldname)
+	rows = parent.get(fieldname) or []
+
+	new_rows = [row for row in rows if row.get("__islocal") or not row.name]
+	for row in rows:
+		if row.name in changed_names and not row.get("__islocal"):
+			row.db_update()
+
+	bulk_insert_child_rows(parent, fieldname, new_rows)
+
+	doc_before_save = parent.get_doc_before_save()
+	if doc_before_save:
+		stored_names = {row.name for row in doc_before_save.get(fieldname) or []}
+	else:
+		stored_names = set(
+			frappe.get_all(
+				df.options,
+				filters={"parent": parent.name, "parenttype": parent.doctype, "parentfield": fieldname},
+				pluck="name",
+			)
+		)
+
+	removed_names = stored_names - {row.name for row in rows}
+	if removed_names:
+		frappe.db.delete(df.options, {"name": ("in", list(removed_names))})
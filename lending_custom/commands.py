@@ -36,10 +36,14 @@ def update_mint_loan_filters(context, site=None):
 @click.option('--bank-account', help='Specific bank account to reconcile')
 @click.option('--from-date', help='From date (YYYY-MM-DD)')
 @click.option('--to-date', help='To date (YYYY-MM-DD)')
-@click.option('--limit', default=100, help='Maximum number of transactions to process (default: 100)')
+@click.option('--limit', default=100, help='Maximum number of transactions to preview (default: 100)')
 @click.option('--preview', is_flag=True, help='Preview matches without reconciling')
+@click.option('--max-rows', default=None, type=int, help='Stop reconciling after this many transactions')
+@click.option('--max-seconds', default=None, type=float, help='Stop reconciling after this many seconds')
+@click.option('--parallel', is_flag=True, help='Reconcile the bank accounts in parallel worker processes')
+@click.option('--workers', default=None, type=int, help='Worker processes of --parallel (default: site config or CPU count)')
 @pass_context
-def auto_reconcile_loan_repayments(context, site=None, bank_account=None, from_date=None, to_date=None, limit=100, preview=False):
+def auto_reconcile_loan_repayments(context, site=None, bank_account=None, from_date=None, to_date=None, limit=100, preview=False, max_rows=None, max_seconds=None, parallel=False, workers=None):
 	"""
 	Auto reconcile Loan Repayments with Bank Transactions
 	
@@ -53,7 +57,11 @@ def auto_reconcile_loan_repayments(context, site=None, bank_account=None, from_d
 		bench --site county auto-reconcile-loan-repayments --preview
 		bench --site county auto-reconcile-loan-repayments --bank-account "ACC-001"
 		bench --site county auto-reconcile-loan-repayments --from-date 2024-01-01 --to-date 2024-12-31
-		bench --site county auto-reconcile-loan-repayments --limit 500
+		bench --site county auto-reconcile-loan-repayments --limit 500 --preview
+		bench --site county auto-reconcile-loan-repayments --max-seconds 3600
+		bench --site county auto-reconcile-loan-repayments --parallel --workers 8
+
+	With --parallel the row and time budgets apply to each partition of bank accounts.
 	"""
 	if not site:
 		site = get_site(context)
@@ -94,17 +102,34 @@ def auto_reconcile_loan_repayments(context, site=None, bank_account=None, from_d
 				click.echo(f"\nRun without --preview to reconcile these transactions.")
 			else:
 				click.echo("\n=== Auto Reconciling Loan Repayments ===\n")
-				result = reconcile(
-					bank_account=bank_account,
-					from_date=from_date,
-					to_date=to_date
-				)
+				if parallel:
+					from lending_custom.reconciliation_workers import reconcile_in_parallel
+
+					result = reconcile_in_parallel(
+						bank_account=bank_account,
+						from_date=from_date,
+						to_date=to_date,
+						max_rows=max_rows,
+						max_seconds=max_seconds,
+						workers=workers
+					)
+				else:
+					result = reconcile(
+						bank_account=bank_account,
+						from_date=from_date,
+						to_date=to_date,
+						max_rows=max_rows,
+						max_seconds=max_seconds
+					)
 				
 				click.echo(f"Total Processed: {result['total_processed']}")
 				click.echo(f"Reconciled: {result['reconciled']}")
 				click.echo(f"Skipped: {result['skipped']}")
 				click.echo(f"Failed: {result['failed']}")
 				
+				if result['budget_exhausted']:
+					click.echo("Budget reached, run again to reconcile the remaining transactions.")
+
 				if result['reconciled_details']:
 					click.echo("\nReconciled Transactions:")
 					for item in result['reconciled_details']:
@@ -114,6 +139,11 @@ def auto_reconcile_loan_repayments(context, site=None, bank_account=None, from_d
 					click.echo("\nFailed Transactions:")
 					for item in result['failed_details']:
 						click.echo(f"  {item['bank_transaction']}: {item['error']}")
+
+				if result.get('failed_partitions'):
+					click.echo("\nFailed Bank Accounts:")
+					for item in result['failed_partitions']:
+						click.echo(f"  {', '.join(item['bank_accounts'])}: {item['error']}")
 			
 			frappe.db.commit()
 			
@@ -166,13 +196,60 @@ def regenerate_loan_gl_entries(context, site=None, limit=None, preview=False):
 			frappe.destroy()
 
 
+@click.command('explain-lending-queries')
+@click.option('--site', help='Site name')
+@pass_context
+def explain_lending_queries(context, site=None):
+	"""
+	Run EXPLAIN on the lending hot queries and report whether each uses its composite index.
+
+	The indexes are added by the add_hot_query_indexes patch. Exits with status 1 when a
+	query does not use its index; a query on an empty table is skipped.
+
+	Examples:
+		bench --site county explain-lending-queries
+	"""
+	if not site:
+		site = get_site(context)
+
+	with frappe.init_site(site):
+		frappe.connect()
+
+		try:
+			from lending_custom.query_indexes import explain_hot_queries
+
+			results = explain_hot_queries()
+			for result in results:
+				if result.skipped:
+					status = "skipped"
+				else:
+					status = "uses index" if result.uses_index else "DOES NOT USE INDEX"
+				click.echo(f"{result.name} ({result.source})")
+				click.echo(f"  {result.index}: {status}" + ("" if result.index_exists else " (index missing)"))
+				click.echo(f"  plan: {result.plan}")
+
+			missing = [result for result in results if not (result.uses_index or result.skipped)]
+			skipped = sum(1 for result in results if result.skipped)
+			click.echo(
+				f"\n{len(results) - len(missing) - skipped} of {len(results)} queries use their index"
+				+ (f", {skipped} skipped for lack of rows" if skipped else "")
+			)
+
+		finally:
+			frappe.destroy()
+
+	if missing:
+		raise SystemExit(1)
+
+
 # Commands list for Frappe
 def get_commands():
 	"""Return list of commands for Frappe CLI"""
 	return [
 		update_mint_loan_filters,
 		auto_reconcile_loan_repayments,
-		regenerate_loan_gl_entries
+		regenerate_loan_gl_entries,
+		explain_lending_queries
 	]
 
 
@@ -5,14 +5,67 @@ import frappe
 from frappe.utils import flt
 from frappe.query_builder.functions import Sum
 
+from lending_custom.accrual_metrics import PHASE_DISCOVERY, metrics_phase
 
-def get_term_loans_override(date, term_loan=None, loan_product=None):
+# Schedule rows fetched per query by iter_term_loan_pages
+TERM_LOANS_PAGE_SIZE = 1000
+
+
+def get_term_loans_override(date, term_loan=None, loan_product=None, loans=None):
 	"""
 	Override for lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual.get_term_loans
 	
 	Modified to allow historical processing by removing the loan_schedule.status == "Active" restriction.
 	This enables processing of closed/paid loans for historical interest accrual.
+	`loans` optionally restricts the rows to a list of loans (one accrual shard).
+	"""
+	term_loans = get_term_loans_query(date, term_loan, loan_product, loans).run(as_dict=1)
+
+	return term_loans
+
+
+def iter_term_loan_pages(date, term_loan=None, loan_product=None, loans=None, page_size=TERM_LOANS_PAGE_SIZE):
+	"""
+	Rows of get_term_loans_override in pages of at most `page_size` rows, in keyset order
+	(loan, payment_date, schedule row), so memory stays bounded by one page however many
+	rows a historical run has to accrue
 	"""
+	loan = frappe.qb.DocType("Loan")
+	loan_repayment_schedule = frappe.qb.DocType("Repayment Schedule")
+	last_row = None
+
+	while True:
+		query = get_term_loans_query(date, term_loan, loan_product, loans)
+		if last_row:
+			# resume after the last row of the previous page
+			query = query.where(
+				(loan.name > last_row.name)
+				| ((loan.name == last_row.name) & (loan_repayment_schedule.payment_date > last_row.payment_date))
+				| (
+					(loan.name == last_row.name)
+					& (loan_repayment_schedule.payment_date == last_row.payment_date)
+					& (loan_repayment_schedule.name > last_row.payment_entry)
+				)
+			)
+
+		with metrics_phase(PHASE_DISCOVERY):
+			page = (
+				query.orderby(loan.name)
+				.orderby(loan_repayment_schedule.payment_date)
+				.orderby(loan_repayment_schedule.name)
+				.limit(page_size)
+				.run(as_dict=1)
+			)
+		if page:
+			yield page
+
+		if len(page) < page_size:
+			return
+
+		last_row = page[-1]
+
+
+def get_term_loans_query(date, term_loan=None, loan_product=None, loans=None):
 	loan = frappe.qb.DocType("Loan")
 	loan_schedule = frappe.qb.DocType("Loan Repayment Schedule")
 	loan_repayment_schedule = frappe.qb.DocType("Repayment Schedule")
@@ -62,9 +115,10 @@ def get_term_loans_override(date, term_loan=None, loan_product=None):
 	if loan_product:
 		query = query.where(loan.loan_product == loan_product)
 
-	term_loans = query.run(as_dict=1)
+	if loans:
+		query = query.where(loan.name.isin(loans))
 
-	return term_loans
+	return query
 
 
 def apply_lending_overrides(bootinfo=None):
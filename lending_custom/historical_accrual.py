@@ -0,0 +1,607 @@
+"""
+Range-native historical interest accrual
+
+Process Loan Interest Accrual with a start_date..end_date window used to call lending's
+accrual functions once per day, and each of them re-queried the whole portfolio. Here each
+loan's state is loaded once for the window and the accruals are worked out in memory.
+They are posted with the same values as the day-by-day path:
+
+- term loans: the unaccrued schedule rows due by the end of the window are read in keyset
+  pages. A row due before the window is accrued on its first day, any other row on its
+  payment date, and the rows of a page are flagged accrued with one UPDATE.
+- demand loans: the loan list, the accrual dates already posted in the window and the
+  pending principal are loaded once. Consecutive days accrue one day of interest each; the
+  day count of the others (the first day, or after a gap) comes from the last accrual and
+  disbursement dates, read for all loans of a day in two grouped queries
+  (get_demand_loan_state). Only the ledger dependent pending interest and penalty are
+  still read per accrual.
+
+A single posting date is the one-day window, so the daily Process Loan Interest Accrual
+takes this path too.
+
+Accruals are written through an AccrualWriter in batches: one date's demand loan accruals
+at a time (a loan's next accrual reads the ledger its previous one wrote), and one page of
+term loan accruals at a time.
+
+For backfills, an accrual_period (Monthly, Quarterly, Yearly) compacts the demand loan
+accruals to one per loan per period, equal to the sum of the daily ones. A compacted
+accrual's last_accrual_date is the first day it covers, and every day from there to its
+posting date counts as accrued, both here and in the last accrual date lookups.
+"""
+
+import bisect
+
+import frappe
+from frappe import _
+from frappe.query_builder.functions import Max
+from frappe.utils import (
+	add_days,
+	cint,
+	date_diff,
+	flt,
+	get_last_day,
+	get_quarter_ending,
+	get_year_ending,
+	getdate,
+)
+
+from lending_custom.accrual_metrics import (
+	PHASE_DISCOVERY,
+	PHASE_POSTING,
+	metrics_date,
+	metrics_phase,
+	record_metrics,
+)
+from lending_custom.accrual_writer import AccrualWriter
+from lending_custom.function_overrides import iter_term_loan_pages
+from lending_custom.tracing import span
+
+DEMAND_LOAN_STATUSES = ("Disbursed", "Partially Disbursed")
+
+ACCRUAL_PERIOD_DAILY = "Daily"
+PERIOD_ENDS = {
+	ACCRUAL_PERIOD_DAILY: getdate,
+	"Monthly": get_last_day,
+	"Quarterly": get_quarter_ending,
+	"Yearly": get_year_ending,
+}
+
+
+def process_accruals_for_range(
+	process_loan_interest,
+	start_date,
+	end_date,
+	open_loans=None,
+	term_loan=None,
+	loan_product=None,
+	accrual_type="Regular",
+	include_demand_loans=True,
+	include_term_loans=True,
+	loans=None,
+	accrual_period=ACCRUAL_PERIOD_DAILY,
+):
+	"""
+	Post the accruals of every day from start_date to end_date, both inclusive.
+	`loans` restricts the run to a list of loans (one accrual shard). With an accrual_period
+	other than Daily, demand loans post one accrual per period instead of one per day.
+	"""
+	start_date, end_date = getdate(start_date), getdate(end_date)
+
+	with metrics_phase(PHASE_DISCOVERY):
+		demand_loans = []
+		if include_demand_loans:
+			demand_loans = open_loans or get_demand_loans(loan_product, loans)
+
+		accrued_dates = get_accrued_dates(start_date, end_date, [loan.name for loan in demand_loans])
+		pending_principal_amounts = {loan.name: get_pending_principal(loan) for loan in demand_loans}
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	writer = AccrualWriter()
+
+	if accrual_period == ACCRUAL_PERIOD_DAILY:
+		accrue_demand_loans_daily(
+			process_loan_interest,
+			start_date,
+			end_date,
+			demand_loans,
+			accrued_dates,
+			pending_principal_amounts,
+			accrual_type,
+			precision,
+			writer,
+		)
+	else:
+		accrue_demand_loans_by_period(
+			process_loan_interest,
+			start_date,
+			end_date,
+			demand_loans,
+			accrued_dates,
+			pending_principal_amounts,
+			accrual_type,
+			precision,
+			writer,
+			accrual_period,
+		)
+
+	if include_term_loans:
+		# term loan accruals do not depend on each other, they are posted page by page, and
+		# counted on the last date of the window
+		with metrics_date(end_date):
+			accrue_term_loans(
+				process_loan_interest,
+				start_date,
+				end_date,
+				term_loan,
+				loan_product,
+				accrual_type,
+				loans,
+				writer,
+			)
+
+
+def accrue_term_loans(
+	process_loan_interest, start_date, end_date, term_loan, loan_product, accrual_type, loans, writer
+):
+	"""Accrual of every due term loan schedule row, flushed page by page"""
+	for page in iter_term_loan_pages(end_date, term_loan, loan_product, loans):
+		with span("term_loan_accruals", process=process_loan_interest, rows=len(page)):
+			record_metrics(loans_scanned=len(page))
+			for row in page:
+				make_term_loan_accrual(
+					row,
+					get_term_loan_accrual_date(row, start_date),
+					process_loan_interest,
+					accrual_type,
+					writer,
+				)
+
+			writer.flush()
+			mark_schedule_rows_accrued([row.payment_entry for row in page])
+
+
+def accrue_demand_loans_daily(
+	process_loan_interest,
+	start_date,
+	end_date,
+	demand_loans,
+	accrued_dates,
+	pending_principal_amounts,
+	accrual_type,
+	precision,
+	writer,
+):
+	"""One accrual per demand loan per day, flushed day by day"""
+	# loans accrued on the previous day accrue exactly one day of interest
+	accrued_previous_day = set()
+	posting_date = start_date
+	while posting_date <= end_date:
+		with (
+			span("accrual_for_date", process=process_loan_interest, posting_date=str(posting_date)) as s,
+			metrics_date(posting_date),
+		):
+			record_metrics(loans_scanned=len(demand_loans))
+			accrued_today = {
+				loan.name for loan in demand_loans if posting_date in accrued_dates.get(loan.name, ())
+			}
+			# the day count of loans not accrued the day before comes from the ledger, read for
+			# all of them at once
+			with metrics_phase(PHASE_DISCOVERY):
+				state = get_demand_loan_state(
+					[
+						loan
+						for loan in demand_loans
+						if loan.name not in accrued_today and loan.name not in accrued_previous_day
+					],
+					posting_date,
+				)
+
+			for loan in demand_loans:
+				if loan.name in accrued_today:
+					# accrual already posted for this date
+					continue
+
+				if loan.name in accrued_previous_day:
+					no_of_days = 1
+				else:
+					no_of_days = get_no_of_days_for_accrual(state[loan.name], posting_date)
+
+				if make_demand_loan_accrual(
+					loan,
+					posting_date,
+					process_loan_interest,
+					accrual_type,
+					pending_principal_amounts[loan.name],
+					precision,
+					no_of_days,
+					writer,
+				):
+					accrued_today.add(loan.name)
+
+			writer.flush()
+			s.set(demand_loans=len(accrued_today))
+
+		accrued_previous_day = accrued_today
+		posting_date = add_days(posting_date, 1)
+
+
+def accrue_demand_loans_by_period(
+	process_loan_interest,
+	start_date,
+	end_date,
+	demand_loans,
+	accrued_dates,
+	pending_principal_amounts,
+	accrual_type,
+	precision,
+	writer,
+	accrual_period,
+):
+	"""
+	One accrual per demand loan per period. Each day is worked out as the daily path posts
+	it, with the last accrual date kept in memory instead of in the ledger, and a loan's
+	daily amounts of a period (rounded as each accrual would be) are posted as one accrual
+	on the last day that accrued. Its last_accrual_date is the first day it covers, so
+	get_last_accrual_dates treats every day of the period as accrued.
+	"""
+	from lending.loan_management.doctype.loan_interest_accrual import loan_interest_accrual
+	from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts
+
+	names = [loan.name for loan in demand_loans]
+	last_accrual_dates = get_last_accrual_dates(names, add_days(start_date, -1))
+	disbursement_dates = get_disbursement_dates(names, end_date)
+
+	period_start = start_date
+	while period_start <= end_date:
+		period_end = min(get_period_end(period_start, accrual_period), end_date)
+		with (
+			span(
+				"accrual_for_period",
+				process=process_loan_interest,
+				start_date=str(period_start),
+				end_date=str(period_end),
+			) as s,
+			metrics_date(period_end),
+		):
+			record_metrics(loans_scanned=len(demand_loans) * (date_diff(period_end, period_start) + 1))
+			posted = 0
+			for loan in demand_loans:
+				first_day = posting_date = None
+				interest_amount = 0.0
+
+				day = period_start
+				while day <= period_end:
+					last_accrual_date = last_accrual_dates.get(loan.name)
+					if day in accrued_dates.get(loan.name, ()):
+						# accrual already posted for this date
+						last_accrual_dates[loan.name] = day
+						day = add_days(day, 1)
+						continue
+
+					if last_accrual_date:
+						accrual_start_date = get_date_after_last_accrual(
+							last_accrual_date, get_last_date_before(disbursement_dates.get(loan.name), day)
+						)
+					else:
+						accrual_start_date = loan.disbursement_date
+
+					no_of_days = date_diff(day, accrual_start_date) + 1 if accrual_start_date else 0
+					if no_of_days > 0:
+						daily_interest = flt(
+							loan_interest_accrual.get_interest_amount(
+								no_of_days,
+								pending_principal_amounts[loan.name],
+								loan.rate_of_interest,
+								loan.company,
+								day,
+							),
+							precision,
+						)
+						if daily_interest > 0:
+							first_day = first_day or getdate(accrual_start_date)
+							posting_date = day
+							interest_amount += daily_interest
+							last_accrual_dates[loan.name] = day
+
+					day = add_days(day, 1)
+
+				if not posting_date:
+					continue
+
+				pending_amounts = calculate_amounts(loan.name, posting_date, payment_type="Loan Closure")
+				writer.add(
+					frappe._dict(
+						{
+							"loan": loan.name,
+							"applicant_type": loan.applicant_type,
+							"applicant": loan.applicant,
+							"interest_income_account": loan.interest_income_account,
+							"loan_account": loan.loan_account,
+							"pending_principal_amount": pending_principal_amounts[loan.name],
+							"interest_amount": interest_amount,
+							"total_pending_interest_amount": pending_amounts["interest_amount"],
+							"penalty_amount": pending_amounts["penalty_amount"],
+							"process_loan_interest": process_loan_interest,
+							"posting_date": posting_date,
+							"due_date": posting_date,
+							"accrual_type": accrual_type,
+							"last_accrual_date": first_day,
+						}
+					)
+				)
+				posted += 1
+
+			# the next period's pending interest is read from the ledger
+			writer.flush()
+			s.set(demand_loans=posted)
+
+		period_start = add_days(period_end, 1)
+
+
+def get_period_end(date, accrual_period):
+	"""Last day of the accrual period `date` falls in"""
+	if accrual_period not in PERIOD_ENDS:
+		frappe.throw(_("Invalid accrual period {0}").format(frappe.bold(accrual_period)))
+
+	return getdate(PERIOD_ENDS[accrual_period](date))
+
+
+def get_demand_loans(loan_product=None, loans=None):
+	"""Open demand loans, as selected by lending's make_accrual_interest_entry_for_demand_loans"""
+	filters = {"status": ("in", DEMAND_LOAN_STATUSES), "docstatus": 1, "is_term_loan": 0}
+	if loan_product:
+		filters["loan_product"] = loan_product
+	if loans:
+		filters["name"] = ("in", loans)
+
+	return frappe.get_all("Loan", filters=filters, fields=["*"])
+
+
+def get_term_loan_accrual_date(row, start_date):
+	"""A schedule row due before the window is accrued on its first day"""
+	return max(start_date, getdate(row.payment_date))
+
+
+def get_accrued_dates(start_date, end_date, loans):
+	"""
+	Dates of the window covered by the submitted accruals of `loans`, per loan: every day
+	from an accrual's last_accrual_date to its posting date
+	"""
+	if not loans:
+		return {}
+
+	start_date, end_date = getdate(start_date), getdate(end_date)
+	accrued_dates = {}
+	for accrual in frappe.get_all(
+		"Loan Interest Accrual",
+		filters={"loan": ("in", loans), "docstatus": 1, "posting_date": (">=", start_date)},
+		or_filters={"posting_date": ("<=", end_date), "last_accrual_date": ("<=", end_date)},
+		fields=["loan", "posting_date", "last_accrual_date"],
+	):
+		posting_date = getdate(accrual.posting_date)
+		day = max(getdate(accrual.last_accrual_date or posting_date), start_date)
+		while day <= min(posting_date, end_date):
+			accrued_dates.setdefault(accrual.loan, set()).add(day)
+			day = add_days(day, 1)
+
+	return accrued_dates
+
+
+def get_last_accrual_dates(loans, posting_date):
+	"""
+	Last submitted accrual date of each of `loans` up to posting_date, inclusive, or later
+	when a compacted accrual covers posting_date
+	"""
+	if not loans:
+		return {}
+
+	accrual = frappe.qb.DocType("Loan Interest Accrual")
+	rows = (
+		frappe.qb.from_(accrual)
+		.select(accrual.loan, Max(accrual.posting_date))
+		.where(
+			(accrual.loan.isin(loans))
+			& (accrual.docstatus == 1)
+			& ((accrual.posting_date <= posting_date) | (accrual.last_accrual_date <= posting_date))
+		)
+		.groupby(accrual.loan)
+		.run()
+	)
+	return {loan: getdate(last_accrual_date) for loan, last_accrual_date in rows}
+
+
+def get_last_disbursement_dates(loans, posting_date):
+	"""Last submitted disbursement date of each of `loans` before posting_date"""
+	if not loans:
+		return {}
+
+	disbursement = frappe.qb.DocType("Loan Disbursement")
+	rows = (
+		frappe.qb.from_(disbursement)
+		.select(disbursement.against_loan, Max(disbursement.posting_date))
+		.where(
+			(disbursement.against_loan.isin(loans))
+			& (disbursement.docstatus == 1)
+			& (disbursement.posting_date < posting_date)
+		)
+		.groupby(disbursement.against_loan)
+		.run()
+	)
+	return {loan: getdate(last_disbursement_date) for loan, last_disbursement_date in rows}
+
+
+def get_disbursement_dates(loans, end_date):
+	"""Sorted dates of the submitted disbursements of each of `loans` before end_date"""
+	if not loans:
+		return {}
+
+	disbursement_dates = {}
+	for disbursement in frappe.get_all(
+		"Loan Disbursement",
+		filters={"against_loan": ("in", loans), "docstatus": 1, "posting_date": ("<", end_date)},
+		fields=["against_loan", "posting_date"],
+		order_by="posting_date",
+	):
+		disbursement_dates.setdefault(disbursement.against_loan, []).append(
+			getdate(disbursement.posting_date)
+		)
+
+	return disbursement_dates
+
+
+def get_last_date_before(dates, date):
+	"""Last of the sorted `dates` before `date`, as get_last_disbursement_dates picks it"""
+	index = bisect.bisect_left(dates or [], getdate(date))
+	return dates[index - 1] if index else None
+
+
+def get_date_after_last_accrual(last_accrual_date, last_disbursement_date=None):
+	"""
+	First day not yet accrued, as lending's get_last_accrual_date returns it: interest for
+	the last accrual date is already booked, unless the loan was disbursed again since
+	"""
+	if last_disbursement_date and getdate(last_disbursement_date) > add_days(getdate(last_accrual_date), 1):
+		last_accrual_date = last_disbursement_date
+
+	return add_days(last_accrual_date, 1)
+
+
+def get_no_of_days_for_accrual(state, posting_date):
+	"""
+	Days a demand loan accrues on posting_date, from its prefetched state, as lending's
+	get_no_of_days_for_interest_accural counts them
+	"""
+	if state.last_accrual_date:
+		accrual_start_date = get_date_after_last_accrual(
+			state.last_accrual_date, state.last_disbursement_date
+		)
+	else:
+		accrual_start_date = state.disbursement_date
+
+	return date_diff(posting_date, accrual_start_date) + 1 if accrual_start_date else 0
+
+
+def get_demand_loan_state(loans, posting_date):
+	"""
+	What the demand loan accrual of posting_date reads per loan, for all `loans` at once:
+	whether it is already accrued, its last accrual and disbursement dates and its pending
+	principal
+	"""
+	posting_date = getdate(posting_date)
+	names = [loan.name for loan in loans]
+	last_accrual_dates = get_last_accrual_dates(names, posting_date)
+	last_disbursement_dates = get_last_disbursement_dates(names, posting_date)
+
+	return {
+		loan.name: frappe._dict(
+			{
+				"accrued": bool(last_accrual_dates.get(loan.name))
+				and last_accrual_dates[loan.name] >= posting_date,
+				"last_accrual_date": last_accrual_dates.get(loan.name),
+				"last_disbursement_date": last_disbursement_dates.get(loan.name),
+				"disbursement_date": loan.disbursement_date,
+				"pending_principal_amount": get_pending_principal(loan),
+			}
+		)
+		for loan in loans
+	}
+
+
+def get_pending_principal(loan):
+	from lending.loan_management.doctype.loan_repayment.loan_repayment import get_pending_principal_amount
+
+	return get_pending_principal_amount(loan)
+
+
+def make_demand_loan_accrual(
+	loan,
+	posting_date,
+	process_loan_interest,
+	accrual_type,
+	pending_principal_amount,
+	precision,
+	no_of_days=None,
+	writer=None,
+):
+	"""
+	Accrual of one demand loan for one day, as calculate_accrual_amount_for_demand_loans
+	posts it. `no_of_days` is looked up per loan when not given (see
+	get_no_of_days_for_accrual for a whole book). The accrual is queued on `writer` when
+	given. Returns True if an accrual was posted.
+	"""
+	from lending.loan_management.doctype.loan_interest_accrual import loan_interest_accrual
+	from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts
+
+	if no_of_days is None:
+		no_of_days = loan_interest_accrual.get_no_of_days_for_interest_accural(loan, posting_date)
+
+	if no_of_days <= 0:
+		return False
+
+	payable_interest = loan_interest_accrual.get_interest_amount(
+		no_of_days, pending_principal_amount, loan.rate_of_interest, loan.company, posting_date
+	)
+	if flt(payable_interest, precision) <= 0.0:
+		return False
+
+	pending_amounts = calculate_amounts(loan.name, posting_date, payment_type="Loan Closure")
+	post_accrual = writer.add if writer else loan_interest_accrual.make_loan_interest_accrual_entry
+	post_accrual(
+		frappe._dict(
+			{
+				"loan": loan.name,
+				"applicant_type": loan.applicant_type,
+				"applicant": loan.applicant,
+				"interest_income_account": loan.interest_income_account,
+				"loan_account": loan.loan_account,
+				"pending_principal_amount": pending_principal_amount,
+				"interest_amount": payable_interest,
+				"total_pending_interest_amount": pending_amounts["interest_amount"],
+				"penalty_amount": pending_amounts["penalty_amount"],
+				"process_loan_interest": process_loan_interest,
+				"posting_date": posting_date,
+				"due_date": posting_date,
+				"accrual_type": accrual_type,
+				"last_accrual_date": add_days(posting_date, 1 - no_of_days),
+			}
+		)
+	)
+	return True
+
+
+def make_term_loan_accrual(row, posting_date, process_loan_interest, accrual_type, writer=None):
+	"""
+	Accrual of one term loan schedule row, as make_accrual_interest_entry_for_term_loans
+	posts it. The accrual is queued on `writer` when given.
+	"""
+	from lending.loan_management.doctype.loan_interest_accrual import loan_interest_accrual
+
+	post_accrual = writer.add if writer else loan_interest_accrual.make_loan_interest_accrual_entry
+	post_accrual(
+		frappe._dict(
+			{
+				"loan": row.name,
+				"applicant_type": row.applicant_type,
+				"applicant": row.applicant,
+				"interest_income_account": row.interest_income_account,
+				"loan_account": row.loan_account,
+				"interest_amount": row.interest_amount,
+				"payable_principal": row.principal_amount,
+				"process_loan_interest": process_loan_interest,
+				"repayment_schedule_name": row.payment_entry,
+				"posting_date": posting_date,
+				"accrual_type": accrual_type,
+				"due_date": row.payment_date,
+			}
+		)
+	)
+
+
+def mark_schedule_rows_accrued(payment_entries):
+	if not payment_entries:
+		return
+
+	schedule = frappe.qb.DocType("Repayment Schedule")
+	with metrics_phase(PHASE_POSTING):
+		frappe.qb.update(schedule).set(schedule.is_accrued, 1).where(
+			schedule.name.isin(payment_entries)
+		).run()
@@ -98,8 +98,12 @@ whitelisted_methods = [
 	"lending_custom.loan_auto_reconciliation.auto_reconcile_loan_repayments",
 	"lending_custom.loan_auto_reconciliation.get_loan_repayment_reconciliation_preview",
 	"lending_custom.loan_auto_reconciliation.reconcile_selected_transactions",
+	"lending_custom.reconciliation_workers.get_parallel_reconciliation_summary",
 	"lending_custom.regenerate_gl_entries.preview_missing_gl_entries",
-	"lending_custom.regenerate_gl_entries.regenerate_gl_entries_api"
+	"lending_custom.regenerate_gl_entries.regenerate_gl_entries_api",
+	"lending_custom.loan_quotes.get_loan_quote_grid",
+	"lending_custom.accrual_workers.resume_accrual_shards",
+	"lending_custom.accrual_simulation.simulate_interest_accrual"
 ]
 
 # Startup
@@ -194,6 +198,14 @@ override_doctype_class = {
 doc_events = {
 	"Company": {
 		"validate": "lending_custom.overrides.company.validate_loan_tables",
+	},
+	"Loan": {
+		"on_update": "lending_custom.loan_settings.clear_loan_settings_cache",
+		"on_trash": "lending_custom.loan_settings.clear_loan_settings_cache",
+	},
+	"Loan Product": {
+		"on_update": "lending_custom.loan_settings.clear_loan_settings_cache",
+		"on_trash": "lending_custom.loan_settings.clear_loan_settings_cache",
 	}
 }
 
@@ -3,6 +3,8 @@ from frappe import _
 from frappe.utils import flt, cint, date_diff, getdate, add_days, get_last_day
 import math
 
+import numpy as np
+
 # Override the get_monthly_repayment_amount function for one-time percentage calculation
 def get_monthly_repayment_amount_custom(loan_amount, rate_of_interest, repayment_periods, interest_calculation_method=None):
 	"""
@@ -47,32 +49,156 @@ def get_monthly_repayment_amount_custom(loan_amount, rate_of_interest, repayment
 		else:
 			return math.ceil(loan_amount / (repayment_periods or 1))
 
+def get_monthly_repayment_amounts(loan_amount, rate_of_interest, repayment_periods, interest_calculation_method):
+	"""
+	Array version of get_monthly_repayment_amount_custom: monthly repayment amount for every
+	element of equally shaped (or broadcastable) arrays of loan terms
+	"""
+	loan_amount, rate_of_interest, repayment_periods, interest_calculation_method = np.broadcast_arrays(
+		np.atleast_1d(np.asarray(loan_amount, dtype=float)),
+		np.atleast_1d(np.asarray(rate_of_interest, dtype=float)),
+		np.atleast_1d(np.asarray(repayment_periods, dtype=np.int64)),
+		np.atleast_1d(np.asarray(interest_calculation_method, dtype=object)),
+	)
+	has_periods = repayment_periods > 0
+	periods = np.where(has_periods, repayment_periods, 1)
+
+	# One-time Percentage: total amount including upfront interest divided equally over periods
+	total_amount = loan_amount + loan_amount * (rate_of_interest / 100)
+	one_time_amount = np.where(has_periods, total_amount / periods, total_amount)
+
+	# Monthly Prorated: equated monthly instalment, rounded up
+	monthly_interest_rate = rate_of_interest / (12 * 100)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		growth = (1 + monthly_interest_rate) ** periods
+		emi = loan_amount * (monthly_interest_rate * growth) / (growth - 1)
+	prorated_amount = np.ceil(
+		np.where((rate_of_interest != 0) & has_periods, emi, loan_amount / periods)
+	)
+
+	return np.where(interest_calculation_method == "One-time Percentage", one_time_amount, prorated_amount)
+
+
+# Longest interest free schedule get_total_payable_interest replays instalment by instalment
+MAX_REPLAYED_PERIODS = 100000
+
+
 # Override the calculate_payable_amount method for loan applications
 def calculate_payable_amount_custom(doc):
 	"""
 	Calculate total payable amount based on interest calculation method
 	"""
-	if doc.interest_calculation_method == "One-time Percentage":
+	calculate_payable_amounts([doc])
+
+
+def calculate_payable_amounts(docs):
+	"""
+	Calculate total payable interest and amount for a batch of loan applications in one call,
+	e.g. when bulk importing applications from partner channels
+	"""
+	if not docs:
+		return docs
+
+	loan_amount = np.array([flt(doc.loan_amount) for doc in docs])
+	rate_of_interest = np.array([flt(doc.rate_of_interest) for doc in docs])
+	repayment_amount = np.array([flt(doc.repayment_amount) for doc in docs])
+	one_time = np.array([doc.interest_calculation_method == "One-time Percentage" for doc in docs])
+
+	total_payable_interest = np.where(
+		one_time,
 		# For one-time percentage, calculate total interest upfront
-		doc.total_payable_interest = doc.loan_amount * (doc.rate_of_interest / 100)
-		doc.total_payable_amount = doc.loan_amount + doc.total_payable_interest
-	else:
-		# Original monthly prorated calculation
-		balance_amount = doc.loan_amount
-		doc.total_payable_amount = 0
-		doc.total_payable_interest = 0
-
-		while balance_amount > 0:
-			interest_amount = flt(balance_amount * doc.rate_of_interest / (12 * 100))
-			balance_amount = flt(balance_amount + interest_amount - doc.repayment_amount)
-			
-			if balance_amount < 0:
-				interest_amount += balance_amount  # Adjust for overpayment
-				balance_amount = 0
-			
-			doc.total_payable_interest += interest_amount
-
-		doc.total_payable_amount = doc.loan_amount + doc.total_payable_interest
+		loan_amount * (rate_of_interest / 100),
+		0.0,
+	)
+
+	prorated = ~one_time
+	if prorated.any():
+		total_payable_interest[prorated] = get_total_payable_interest(
+			loan_amount[prorated],
+			rate_of_interest[prorated],
+			repayment_amount[prorated],
+			names=[doc.name for doc, is_prorated in zip(docs, prorated, strict=True) if is_prorated],
+		)
+
+	for doc, interest, amount in zip(docs, total_payable_interest.tolist(), loan_amount.tolist(), strict=True):
+		doc.total_payable_interest = interest
+		doc.total_payable_amount = amount + interest
+
+	return docs
+
+
+def get_total_payable_interest(loan_amount, rate_of_interest, repayment_amount, names=None):
+	"""
+	Total interest of monthly reducing balance loans repaid by a fixed amount, in closed form.
+
+	Gives the same result as walking the balance down month by month:
+
+		while balance > 0:
+			interest = balance * rate / 1200
+			balance = balance + interest - repayment
+			if balance < 0:
+				interest += balance
+				balance = 0
+			total_interest += interest
+
+	With r the monthly rate, the balance after k months is b[k] = L + (L * r - R) * a[k] where
+	a[k] = ((1 + r) ** k - 1) / r, so the month n in which the balance is cleared follows from a
+	logarithm, and the interest telescopes to 2 * b[n - 1] * (1 + r) - L + (n - 2) * R.
+	Arguments are scalars or arrays, the result is always an array.
+	"""
+	loan_amount, rate_of_interest, repayment_amount = np.broadcast_arrays(
+		np.atleast_1d(np.asarray(loan_amount, dtype=float)),
+		np.atleast_1d(np.asarray(rate_of_interest, dtype=float)),
+		np.atleast_1d(np.asarray(repayment_amount, dtype=float)),
+	)
+	monthly_rate = rate_of_interest / (12 * 100)
+	has_balance = loan_amount > 0
+
+	amortizing = repayment_amount > loan_amount * monthly_rate
+	if not np.all(amortizing | ~has_balance):
+		idx = int(np.flatnonzero(~amortizing & has_balance)[0])
+		message = _("Repayment Amount must be greater than {0}").format(
+			flt(loan_amount[idx] * monthly_rate[idx], 2)
+		)
+		if names:
+			message = _("Loan Application {0}: {1}").format(frappe.bold(names[idx]), message)
+		frappe.throw(message)
+
+	with np.errstate(divide="ignore", invalid="ignore"):
+		shortfall = np.where(amortizing, repayment_amount - loan_amount * monthly_rate, 1.0)
+		periods = np.where(
+			monthly_rate > 0,
+			np.log1p(monthly_rate * loan_amount / shortfall) / np.log1p(monthly_rate),
+			loan_amount / np.where(repayment_amount > 0, repayment_amount, 1.0),
+		)
+	periods = np.maximum(np.ceil(periods), 1)
+
+	def balance_after(months):
+		with np.errstate(divide="ignore", invalid="ignore"):
+			annuity_factor = np.where(
+				monthly_rate > 0, np.expm1(months * np.log1p(monthly_rate)) / monthly_rate, months
+			)
+		return loan_amount + (loan_amount * monthly_rate - repayment_amount) * annuity_factor
+
+	# the logarithm can land one month either side of the exact crossing
+	periods = np.where(balance_after(periods) > 0, periods + 1, periods)
+	periods = np.where((periods > 1) & (balance_after(periods - 1) <= 0), periods - 1, periods)
+
+	total_interest = (
+		2 * balance_after(periods - 1) * (1 + monthly_rate) - loan_amount + (periods - 2) * repayment_amount
+	)
+
+	# Interest free loans can leave a float residue after the "last" instalment, which the month
+	# by month walk turns into one more instalment. Replay the subtractions to land on the same side.
+	replay = has_balance & (monthly_rate == 0) & (periods <= MAX_REPLAYED_PERIODS)
+	for idx in np.flatnonzero(replay):
+		balance = np.subtract.accumulate(
+			np.concatenate(([loan_amount[idx]], np.full(int(periods[idx]) + 1, repayment_amount[idx])))
+		)
+		total_interest[idx] = balance[int(np.argmax(balance[1:] <= 0)) + 1]
+
+	return np.where(has_balance, total_interest, 0.0)
+
 
 # Custom interest accrual function for one-time percentage method
 def get_per_day_interest_custom(principal_amount, rate_of_interest, company, posting_date=None, interest_day_count_convention=None, interest_calculation_method="Monthly Prorated"):
@@ -101,4 +227,66 @@ def get_per_day_interest_custom(principal_amount, rate_of_interest, company, pos
 			from frappe.utils import days_in_year
 			year_divisor = days_in_year(getdate(posting_date).year)
 
-		return flt((principal_amount * rate_of_interest) / (year_divisor * 100))
\ No newline at end of file
+		return flt((principal_amount * rate_of_interest) / (year_divisor * 100))
+
+def get_per_day_interest_bulk(
+	principal_amounts,
+	rates_of_interest,
+	companies,
+	posting_dates=None,
+	interest_calculation_methods=None,
+):
+	"""
+	Array version of get_per_day_interest_custom for a whole loan book
+
+	Each company's interest day count convention is resolved once, and Actual/Actual year
+	divisors are computed once for every year in the span of posting dates. Scalars are
+	broadcast, so a single company or posting date can be shared by all loans.
+
+	Returns:
+		numpy.ndarray: Per day interest of every loan
+	"""
+	principal_amounts = np.atleast_1d(np.asarray(principal_amounts, dtype=float))
+	size = principal_amounts.size
+
+	rates_of_interest = np.broadcast_to(np.asarray(rates_of_interest, dtype=float), size)
+	companies = np.broadcast_to(np.asarray(companies, dtype=object), size)
+	posting_dates = np.broadcast_to(
+		np.array(getdate() if posting_dates is None else posting_dates, dtype="datetime64[D]"), size
+	)
+	if interest_calculation_methods is None:
+		interest_calculation_methods = "Monthly Prorated"
+	interest_calculation_methods = np.broadcast_to(np.asarray(interest_calculation_methods, dtype=object), size)
+
+	if not size:
+		return np.zeros(0)
+
+	conventions = {
+		d.name: d.interest_day_count_convention
+		for d in frappe.get_all(
+			"Company",
+			filters={"name": ("in", list(set(companies.tolist())))},
+			fields=["name", "interest_day_count_convention"],
+		)
+	}
+	fixed_divisor = {"Actual/365": 365, "30/365": 365, "30/360": 360, "Actual/360": 360}
+	year_divisor = np.array(
+		[fixed_divisor.get(conventions.get(company), 0) for company in companies.tolist()], dtype=float
+	)
+
+	# Default is Actual/Actual
+	actual = year_divisor == 0
+	if actual.any():
+		years = posting_dates[actual].astype("datetime64[Y]").astype(np.int64) + 1970
+		first_year = int(years.min())
+		from frappe.utils import days_in_year
+
+		days_by_year = np.array(
+			[days_in_year(year) for year in range(first_year, int(years.max()) + 1)], dtype=float
+		)
+		year_divisor[actual] = days_by_year[years - first_year]
+
+	per_day_interest = (principal_amounts * rates_of_interest) / (year_divisor * 100)
+
+	# For one-time percentage, no daily interest accrual - interest is calculated upfront
+	return np.where(interest_calculation_methods == "One-time Percentage", 0.0, per_day_interest)
@@ -6,70 +6,122 @@ This script provides automatic bank reconciliation for Loan Repayments by matchi
 - amount_paid on Loan Repayment == deposit on Bank Transaction
 - posting_date on Loan Repayment == date on Bank Transaction
 
+All eligible Bank Transactions are streamed in keyset pages of (date, name), each page
+matched in bulk and committed, so one run can clear the whole backlog with bounded memory.
+An optional row or time budget stops the run early; the next run carries on.
+
+With group matching on (see repayment_matcher), the transactions of a page left unmatched
+are then reconciled with a group of repayments they pay for together, or in groups with
+the one repayment they were split from. Groups are only formed within a page: the parts of
+a split deposit that fall on both sides of a page boundary (every RECONCILIATION_PAGE_SIZE
+transactions in date order) are left unmatched, for manual reconciliation or a run over a
+date range that holds them in one page.
+
 Usage:
     - Via bench command: bench --site [site] execute lending_custom.loan_auto_reconciliation.auto_reconcile_loan_repayments
     - Via API: frappe.call("lending_custom.loan_auto_reconciliation.auto_reconcile_loan_repayments")
+    - In parallel, one partition per bank account: bench --site [site] auto-reconcile-loan-repayments --parallel
 """
 
 import json
+import time
 
 import frappe
 from frappe import _
-from frappe.utils import flt, getdate
+from frappe.utils import add_days, cint, flt, getdate
+
+from lending_custom.repayment_matcher import (
+    SKIP_AMOUNT_DIFFERENCE,
+    SKIP_NO_MATCH,
+    CandidateIndex,
+    RepaymentMatcher,
+    get_allocated_repayments_query,
+    get_amount_difference,
+    get_candidate_repayments,
+    get_match_tolerance,
+)
+from lending_custom.tracing import traced
+
+# Bank Transactions fetched, matched and committed at a time
+RECONCILIATION_PAGE_SIZE = 500
 
 
 @frappe.whitelist()
-def auto_reconcile_loan_repayments(bank_account=None, from_date=None, to_date=None):
+def auto_reconcile_loan_repayments(bank_account=None, from_date=None, to_date=None, max_rows=None, max_seconds=None, parallel=None):
     """
     Auto reconcile Loan Repayments with Bank Transactions based on exact matching criteria:
     - reference_number matches
     - amount matches (deposit == amount_paid)
     - date matches (date == posting_date)
     
+    The site's matching tolerances, if any, relax these (see repayment_matcher).
+
     Args:
         bank_account: Optional - Specific bank account to reconcile
         from_date: Optional - Filter bank transactions from this date
         to_date: Optional - Filter bank transactions to this date
+        max_rows: Optional - Stop after processing this many bank transactions
+        max_seconds: Optional - Stop once the run has taken this many seconds
+        parallel: Optional - Reconcile each bank account in its own background job, the
+            budgets applying to each job (see reconciliation_workers)
     
     Returns:
         dict: Summary of reconciliation results
     """
+    if cint(parallel):
+        from lending_custom.reconciliation_workers import reconcile_in_parallel
+
+        return reconcile_in_parallel(bank_account, from_date, to_date, max_rows, max_seconds, use_queue=True)
+
     frappe.flags.auto_reconcile_vouchers = True
     
-    # Get unreconciled bank transactions
-    bank_transactions = get_unreconciled_bank_transactions(bank_account, from_date, to_date)
+    max_rows = cint(max_rows)
+    deadline = time.monotonic() + flt(max_seconds) if flt(max_seconds) > 0 else None
     
+    processed = 0
+    budget_exhausted = False
     reconciled = []
     failed = []
     skipped = []
     
-    for transaction in bank_transactions:
-        try:
-            result = reconcile_single_transaction(transaction)
+    for bank_transactions in iter_unreconciled_bank_transaction_pages(bank_account, from_date, to_date):
+        if max_rows:
+            bank_transactions = bank_transactions[:max_rows - processed]
+
+        # Candidate repayments of the page are fetched at once and joined in memory
+        matcher = RepaymentMatcher(bank_transactions)
+
+        results, budget_exhausted = reconcile_transactions(bank_transactions, matcher, deadline)
+        processed += len(results)
+
+        for result in results:
             if result.get("status") == "reconciled":
                 reconciled.append(result)
             elif result.get("status") == "skipped":
                 skipped.append(result)
-        except Exception as e:
-            frappe.log_error(
-                title=f"Auto Reconciliation Error for {transaction.name}",
-                message=str(e)
-            )
-            failed.append({
-                "bank_transaction": transaction.name,
-                "error": str(e)
-            })
+            else:
+                failed.append(result)
+
+        # Keep what each page reconciled, however the run ends
+        frappe.db.commit()
+
+        if max_rows and processed >= max_rows:
+            budget_exhausted = True
+
+        if budget_exhausted:
+            break
     
     frappe.flags.auto_reconcile_vouchers = False
     
     # Generate summary
     summary = {
-        "total_processed": len(bank_transactions),
+        "total_processed": processed,
         "reconciled": len(reconciled),
         "skipped": len(skipped),
         "failed": len(failed),
         "reconciled_details": reconciled,
-        "failed_details": failed
+        "failed_details": failed,
+        "budget_exhausted": budget_exhausted
     }
     
     # Show message to user
@@ -91,7 +143,41 @@ def auto_reconcile_loan_repayments(bank_account=None, from_date=None, to_date=No
 
 def get_unreconciled_bank_transactions(bank_account=None, from_date=None, to_date=None, limit=1000):
     """
-    Get all unreconciled bank transactions (deposits only for loan repayments)
+    Get the oldest `limit` unreconciled bank transactions (deposits only for loan repayments)
+    """
+    return get_unreconciled_bank_transactions_query(bank_account, from_date, to_date).limit(limit).run(as_dict=True)
+
+
+def iter_unreconciled_bank_transaction_pages(bank_account=None, from_date=None, to_date=None, page_size=RECONCILIATION_PAGE_SIZE):
+    """
+    All unreconciled bank transactions in pages of at most `page_size`, in keyset order of
+    (date, name): each page resumes after the last row of the previous one, so rows
+    reconciled in between do not shift the pages
+    """
+    bt = frappe.qb.DocType("Bank Transaction")
+    last_transaction = None
+
+    while True:
+        query = get_unreconciled_bank_transactions_query(bank_account, from_date, to_date)
+        if last_transaction:
+            query = query.where(
+                (bt.date > last_transaction.date)
+                | ((bt.date == last_transaction.date) & (bt.name > last_transaction.name))
+            )
+
+        page = query.limit(page_size).run(as_dict=True)
+        if page:
+            yield page
+
+        if len(page) < page_size:
+            return
+
+        last_transaction = page[-1]
+
+
+def get_unreconciled_bank_transactions_query(bank_account=None, from_date=None, to_date=None):
+    """
+    Unreconciled bank transactions (deposits only for loan repayments), oldest first
     """
     bt = frappe.qb.DocType("Bank Transaction")
     
@@ -109,14 +195,28 @@ def get_unreconciled_bank_transactions(bank_account=None, from_date=None, to_dat
             bt.party_type,
             bt.party
         )
+        .orderby(bt.date)
+        .orderby(bt.name)
+    )
+
+    return filter_unreconciled_bank_transactions(query, bank_account, from_date, to_date)
+
+
+def filter_unreconciled_bank_transactions(query, bank_account=None, from_date=None, to_date=None):
+    """
+    Restrict a query on Bank Transaction to the unreconciled deposits, of the bank account
+    and within the dates when given
+    """
+    bt = frappe.qb.DocType("Bank Transaction")
+
+    query = (
+        query
         .where(bt.docstatus == 1)
         .where(bt.status.isin(["Pending", "Unreconciled"]))
         .where(bt.deposit > 0)  # Only deposits for loan repayments
         .where(bt.unallocated_amount > 0)
         .where(bt.reference_number.isnotnull())
         .where(bt.reference_number != "")
-        .orderby(bt.date)
-        .limit(limit)
     )
     
     if bank_account:
@@ -128,10 +228,103 @@ def get_unreconciled_bank_transactions(bank_account=None, from_date=None, to_dat
     if to_date:
         query = query.where(bt.date <= getdate(to_date))
     
-    return query.run(as_dict=True)
+    return query
+
+
+def reconcile_transactions(bank_transactions, matcher, deadline=None, allow_amount_difference=False):
+    """
+    Reconcile a batch of bank transactions: each with its own matching Loan Repayment first,
+    then, with group matching on, the unmatched ones with a group of repayments (one deposit
+    for a collection) or together with one repayment (a repayment deposited in parts)
+
+    Matches whose amounts differ are skipped unless `allow_amount_difference` (a user
+    confirming them), as reconciling them leaves one side partly allocated.
+
+    The group passes are skipped once the deadline is reached, their transactions keep the
+    no match result and are tried again by the next run.
+
+    Returns the result of every transaction processed, in order, and whether the deadline
+    stopped the batch early
+    """
+    results = {}
+    deadline_reached = False
+
+    for transaction in bank_transactions:
+        if deadline and time.monotonic() >= deadline:
+            deadline_reached = True
+            break
 
+        results[transaction.name] = run_reconciliation(
+            transaction, reconcile_single_transaction, transaction, matcher, allow_amount_difference
+        )
+
+    if matcher.tolerance.group_matching and not deadline_reached:
+        unmatched = [
+            t for t in bank_transactions
+            if t.name in results and results[t.name].get("reason") == SKIP_NO_MATCH
+        ]
+        for transaction, repayments in matcher.match_groups(unmatched):
+            if deadline and time.monotonic() >= deadline:
+                deadline_reached = True
+                break
+
+            if not allow_amount_difference and get_amount_difference(transaction.deposit, repayments):
+                results[transaction.name] = get_amount_difference_result(transaction, repayments)
+                continue
+
+            results[transaction.name] = run_reconciliation(
+                transaction, reconcile_transaction_with_repayments, transaction, repayments
+            )
+
+        unmatched = [t for t in unmatched if results[t.name].get("reason") == SKIP_NO_MATCH]
+        for repayment, transactions in matcher.match_splits([] if deadline_reached else unmatched):
+            if deadline and time.monotonic() >= deadline:
+                deadline_reached = True
+                break
+
+            deposited = sum(flt(t.deposit) for t in transactions)
+            for transaction in transactions:
+                if not allow_amount_difference and get_amount_difference(deposited, [repayment]):
+                    results[transaction.name] = get_amount_difference_result(transaction, [repayment])
+                    continue
+
+                results[transaction.name] = run_reconciliation(
+                    transaction, reconcile_split_deposit, transaction, repayment
+                )
+
+    return list(results.values()), deadline_reached
 
-def reconcile_single_transaction(transaction):
+
+def run_reconciliation(transaction, reconcile, *args):
+    """
+    Result of reconcile(*args), or a failed result for the transaction with the error logged
+    """
+    try:
+        return reconcile(*args)
+    except Exception as e:
+        frappe.log_error(
+            title=f"Auto Reconciliation Error for {transaction.name}",
+            message=str(e)
+        )
+        return {
+            "status": "failed",
+            "bank_transaction": transaction.name,
+            "error": str(e)
+        }
+
+
+def get_amount_difference_result(transaction, repayments):
+    return {
+        "status": "skipped",
+        "bank_transaction": transaction.name,
+        "reason": SKIP_AMOUNT_DIFFERENCE,
+        "loan_repayment": ", ".join(r.name for r in repayments),
+        "amount_difference": get_amount_difference(transaction.deposit, repayments)
+    }
+
+
+@traced("reconcile_transaction")
+def reconcile_single_transaction(transaction, matcher=None, allow_amount_difference=False):
     """
     Try to reconcile a single bank transaction with a matching Loan Repayment
     
@@ -139,37 +332,25 @@ def reconcile_single_transaction(transaction):
     - reference_number on Loan Repayment == reference_number on Bank Transaction
     - amount_paid on Loan Repayment == deposit on Bank Transaction
     - posting_date on Loan Repayment == date on Bank Transaction
-    """
-    # Get bank account's GL account
-    bank_account_info = frappe.db.get_value(
-        "Bank Account", 
-        transaction.bank_account, 
-        ["account", "company"], 
-        as_dict=True
-    )
     
-    if not bank_account_info:
-        return {
-            "status": "skipped",
-            "bank_transaction": transaction.name,
-            "reason": "Bank account not found"
-        }
+    Pass the RepaymentMatcher of a batch of transactions to match without querying per transaction.
+    A match within the site's amount tolerance is only reconciled with `allow_amount_difference`.
+    """
+    if matcher is None:
+        matcher = RepaymentMatcher([transaction])
     
-    # Find matching Loan Repayment
-    matching_repayment = find_matching_loan_repayment(
-        reference_number=transaction.reference_number,
-        amount=transaction.deposit,
-        date=transaction.date,
-        payment_account=bank_account_info.account
-    )
+    matching_repayment, reason = matcher.match(transaction)
     
     if not matching_repayment:
         return {
             "status": "skipped",
             "bank_transaction": transaction.name,
-            "reason": "No matching Loan Repayment found"
+            "reason": reason
         }
     
+    if not allow_amount_difference and get_amount_difference(transaction.deposit, [matching_repayment]):
+        return get_amount_difference_result(transaction, [matching_repayment])
+
     # Perform reconciliation
     try:
         reconcile_bank_transaction_with_loan_repayment(
@@ -192,7 +373,7 @@ def reconcile_single_transaction(transaction):
         }
 
 
-def find_matching_loan_repayment(reference_number, amount, date, payment_account):
+def find_matching_loan_repayment(reference_number, amount, date, payment_account, tolerance=None):
     """
     Find a Loan Repayment that exactly matches the bank transaction criteria:
     - Same reference number
@@ -200,7 +381,19 @@ def find_matching_loan_repayment(reference_number, amount, date, payment_account
     - Same date
     - Same payment account
     - Not already reconciled (clearance_date is null)
+
+    With a relaxed tolerance (date window, amount tolerance or reference normalization, see
+    repayment_matcher.get_match_tolerance) the best scored repayment within it is returned.
     """
+    tolerance = tolerance or get_match_tolerance()
+    if not tolerance.exact:
+        candidates = get_candidate_repayments(
+            [payment_account],
+            from_date=add_days(getdate(date), -tolerance.date_window),
+            to_date=add_days(getdate(date), tolerance.date_window)
+        )
+        return CandidateIndex(candidates).take_best(payment_account, reference_number, amount, date, tolerance)
+
     lr = frappe.qb.DocType("Loan Repayment")
     
     query = (
@@ -220,6 +413,7 @@ def find_matching_loan_repayment(reference_number, amount, date, payment_account
         .where(lr.amount_paid == flt(amount))
         .where(lr.posting_date == getdate(date))
         .where(lr.payment_account == payment_account)
+        .where(lr.name.notin(get_allocated_repayments_query()))
     )
     
     # Handle repay_from_salary field if it exists
@@ -253,6 +447,48 @@ def reconcile_bank_transaction_with_loan_repayment(bank_transaction_name, loan_r
     reconcile_vouchers(bank_transaction_name, vouchers)
 
 
+@traced("reconcile_transaction_group")
+def reconcile_transaction_with_repayments(transaction, repayments):
+    """
+    Reconcile a bank transaction with the group of Loan Repayments it pays for together
+    """
+    from lending_custom.loan_repayment_reconciliation import reconcile_loan_repayments_with_bank_transaction
+
+    reconcile_loan_repayments_with_bank_transaction(transaction.name, repayments)
+
+    return {
+        "status": "reconciled",
+        "bank_transaction": transaction.name,
+        "loan_repayment": ", ".join(r.name for r in repayments),
+        "amount": transaction.deposit,
+        "reference_number": transaction.reference_number,
+        "match_type": "one-to-many"
+    }
+
+
+@traced("reconcile_split_deposit")
+def reconcile_split_deposit(transaction, repayment):
+    """
+    Reconcile one part of a Loan Repayment deposited in parts: the bank transaction is
+    allocated its deposit of the repayment
+    """
+    from lending_custom.loan_repayment_reconciliation import reconcile_loan_repayments_with_bank_transaction
+
+    reconcile_loan_repayments_with_bank_transaction(
+        transaction.name,
+        [{"name": repayment.name, "amount_paid": flt(transaction.deposit)}]
+    )
+
+    return {
+        "status": "reconciled",
+        "bank_transaction": transaction.name,
+        "loan_repayment": repayment.name,
+        "amount": transaction.deposit,
+        "reference_number": repayment.reference_number,
+        "match_type": "many-to-one"
+    }
+
+
 @frappe.whitelist()
 def get_loan_repayment_reconciliation_preview(bank_account=None, from_date=None, to_date=None, limit=100):
     """
@@ -266,67 +502,15 @@ def get_loan_repayment_reconciliation_preview(bank_account=None, from_date=None,
     if not bank_transactions:
         return []
     
-    # Get all reference numbers from bank transactions
-    reference_numbers = [t.reference_number for t in bank_transactions if t.reference_number]
-    
-    if not reference_numbers:
-        return []
-    
-    # Batch query for all potentially matching loan repayments
-    lr = frappe.qb.DocType("Loan Repayment")
-    
-    query = (
-        frappe.qb.from_(lr)
-        .select(
-            lr.name,
-            lr.amount_paid,
-            lr.reference_number,
-            lr.posting_date,
-            lr.applicant_type,
-            lr.applicant,
-            lr.against_loan,
-            lr.payment_account
-        )
-        .where(lr.docstatus == 1)
-        .where(lr.clearance_date.isnull())
-        .where(lr.reference_number.isin(reference_numbers))
-    )
-    
-    # Handle repay_from_salary field if it exists
-    if frappe.db.has_column("Loan Repayment", "repay_from_salary"):
-        query = query.where((lr.repay_from_salary == 0))
-    
-    loan_repayments = query.run(as_dict=True)
-    
-    # Create lookup dictionaries
-    lr_by_ref = {}
-    for lr_doc in loan_repayments:
-        # Convert datetime to date for proper comparison
-        lr_date = getdate(lr_doc.posting_date) if lr_doc.posting_date else None
-        key = (lr_doc.reference_number, str(lr_date), flt(lr_doc.amount_paid), lr_doc.payment_account)
-        lr_by_ref[key] = lr_doc
-    
-    # Get bank account to GL account mapping
-    bank_accounts = list(set(t.bank_account for t in bank_transactions))
-    ba_to_gl = {}
-    for ba in bank_accounts:
-        gl_account = frappe.db.get_value("Bank Account", ba, "account")
-        if gl_account:
-            ba_to_gl[ba] = gl_account
+    # Same set-based matching as the reconciliation itself
+    matcher = RepaymentMatcher(bank_transactions)
     
     matches = []
     
     for transaction in bank_transactions:
-        if transaction.bank_account not in ba_to_gl:
-            continue
+        lr_doc = matcher.match(transaction)[0]
         
-        gl_account = ba_to_gl[transaction.bank_account]
-        # Convert transaction date to date for proper comparison
-        bt_date = getdate(transaction.date) if transaction.date else None
-        key = (transaction.reference_number, str(bt_date), flt(transaction.deposit), gl_account)
-        
-        if key in lr_by_ref:
-            lr_doc = lr_by_ref[key]
+        if lr_doc:
             matches.append({
                 "bank_transaction": transaction.name,
                 "bank_transaction_date": transaction.date,
@@ -336,7 +520,9 @@ def get_loan_repayment_reconciliation_preview(bank_account=None, from_date=None,
                 "loan_repayment_amount": lr_doc.amount_paid,
                 "loan_repayment_date": lr_doc.posting_date,
                 "loan": lr_doc.against_loan,
-                "applicant": lr_doc.applicant
+                "applicant": lr_doc.applicant,
+                "match_score": lr_doc.match_score,
+                "amount_difference": get_amount_difference(transaction.deposit, [lr_doc])
             })
     
     return matches
@@ -355,15 +541,28 @@ def reconcile_selected_transactions(transactions):
     
     results = []
     
-    for bt_name in transactions:
-        transaction = frappe.db.get_value(
+    bank_transactions = {
+        t.name: t
+        for t in frappe.get_all(
             "Bank Transaction",
-            bt_name,
-            ["name", "date", "deposit", "reference_number", "bank_account", "unallocated_amount"],
-            as_dict=True
+            filters={"name": ("in", transactions)},
+            fields=[
+                "name", "date", "deposit", "reference_number", "bank_account",
+                "unallocated_amount", "party_type", "party"
+            ]
         )
-        
-        if not transaction:
+    }
+    matcher = RepaymentMatcher(list(bank_transactions.values()))
+
+    found = [bank_transactions[bt_name] for bt_name in transactions if bt_name in bank_transactions]
+    # the user confirmed these, so matches within the amount tolerance are reconciled too
+    found_results = {
+        result["bank_transaction"]: result
+        for result in reconcile_transactions(found, matcher, allow_amount_difference=True)[0]
+    }
+
+    for bt_name in transactions:
+        if bt_name not in found_results:
             results.append({
                 "status": "failed",
                 "bank_transaction": bt_name,
@@ -371,8 +570,7 @@ def reconcile_selected_transactions(transactions):
             })
             continue
         
-        result = reconcile_single_transaction(transaction)
-        results.append(result)
+        results.append(found_results[bt_name])
     
     reconciled_count = sum(1 for r in results if r.get("status") == "reconciled")
     
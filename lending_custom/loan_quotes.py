@@ -0,0 +1,136 @@
+"""
+Bulk loan quotes for sales
+
+Prices every combination of loan amount, rate of interest, repayment periods and interest
+calculation method in one vectorized call, instead of one Loan Application round trip per
+quote. Results are memoized per set of inputs, so re-running the same grid while tweaking a
+quote in the UI is free.
+
+Usage:
+    frappe.call("lending_custom.loan_quotes.get_loan_quote_grid", {
+        loan_amounts: [50000, 100000],
+        rates_of_interest: [12, 18],
+        repayment_periods: [12, 24, 36],
+        interest_calculation_methods: ["Monthly Prorated", "One-time Percentage"]
+    })
+"""
+
+from functools import lru_cache
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import cint, flt
+
+from lending_custom.interest_calculations import get_monthly_repayment_amounts, get_total_payable_interest
+
+INTEREST_CALCULATION_METHODS = ("Monthly Prorated", "One-time Percentage")
+
+# Largest number of combinations a single grid may price
+MAX_QUOTE_GRID_SIZE = 100000
+
+
+@frappe.whitelist()
+def get_loan_quote_grid(
+	loan_amounts, rates_of_interest, repayment_periods, interest_calculation_methods=None
+):
+	"""
+	Quote every combination of the given loan terms
+
+	Args:
+		loan_amounts: List (or JSON list) of loan amounts
+		rates_of_interest: List of annual rates of interest
+		repayment_periods: List of repayment periods in months
+		interest_calculation_methods: Optional - list of interest calculation methods,
+			defaults to Monthly Prorated
+
+	Returns:
+		list: One dict per combination with the monthly repayment amount, total payable
+		interest and total payable amount
+	"""
+	loan_amounts = tuple(flt(d) for d in _parse_list(loan_amounts))
+	rates_of_interest = tuple(flt(d) for d in _parse_list(rates_of_interest))
+	repayment_periods = tuple(cint(d) for d in _parse_list(repayment_periods))
+	interest_calculation_methods = tuple(_parse_list(interest_calculation_methods) or ["Monthly Prorated"])
+
+	for method in interest_calculation_methods:
+		if method not in INTEREST_CALCULATION_METHODS:
+			frappe.throw(_("Invalid Interest Calculation Method {0}").format(frappe.bold(method)))
+
+	grid_size = (
+		len(loan_amounts)
+		* len(rates_of_interest)
+		* len(repayment_periods)
+		* len(interest_calculation_methods)
+	)
+	if grid_size > MAX_QUOTE_GRID_SIZE:
+		frappe.throw(
+			_("Quote grid of {0} combinations exceeds the limit of {1}").format(
+				grid_size, MAX_QUOTE_GRID_SIZE
+			)
+		)
+
+	quotes = _get_quote_grid(loan_amounts, rates_of_interest, repayment_periods, interest_calculation_methods)
+
+	# the memoized rows are shared between callers, hand out copies
+	return [frappe._dict(quote) for quote in quotes]
+
+
+@lru_cache(maxsize=256)
+def _get_quote_grid(loan_amounts, rates_of_interest, repayment_periods, interest_calculation_methods):
+	if not (loan_amounts and rates_of_interest and repayment_periods):
+		return ()
+
+	loan_amount, rate_of_interest, periods, method = (
+		grid.ravel()
+		for grid in np.meshgrid(
+			np.array(loan_amounts, dtype=float),
+			np.array(rates_of_interest, dtype=float),
+			np.array(repayment_periods, dtype=np.int64),
+			np.array(interest_calculation_methods, dtype=object),
+			indexing="ij",
+		)
+	)
+
+	monthly_repayment_amount = get_monthly_repayment_amounts(loan_amount, rate_of_interest, periods, method)
+
+	one_time = method == "One-time Percentage"
+	total_payable_interest = np.where(one_time, loan_amount * (rate_of_interest / 100), 0.0)
+
+	prorated = ~one_time & (loan_amount > 0)
+	if prorated.any():
+		total_payable_interest[prorated] = get_total_payable_interest(
+			loan_amount[prorated], rate_of_interest[prorated], monthly_repayment_amount[prorated]
+		)
+
+	return tuple(
+		{
+			"loan_amount": amount,
+			"rate_of_interest": rate,
+			"repayment_periods": period,
+			"interest_calculation_method": interest_calculation_method,
+			"monthly_repayment_amount": repayment_amount,
+			"total_payable_interest": interest,
+			"total_payable_amount": amount + interest,
+		}
+		for amount, rate, period, interest_calculation_method, repayment_amount, interest in zip(
+			loan_amount.tolist(),
+			rate_of_interest.tolist(),
+			periods.tolist(),
+			method.tolist(),
+			monthly_repayment_amount.tolist(),
+			total_payable_interest.tolist(),
+			strict=True,
+		)
+	)
+
+
+def _parse_list(value):
+	if value is None or value == "":
+		return []
+
+	value = frappe.parse_json(value)
+	if isinstance(value, list | tuple):
+		return list(value)
+
+	return [value]
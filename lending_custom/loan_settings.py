@@ -0,0 +1,65 @@
+"""
+Request-scoped resolution of loan and loan product settings
+
+The overrides need `interest_calculation_method`, `repayment_schedule_type` and
+`repayment_date_on` at several points of a single save (Loan validate, schedule validate,
+schedule generation). These helpers load each Loan and Loan Product once per request
+into `frappe.local` and serve every later lookup from memory. The Loan and Loan Product
+doc events clear the cached entry when either document changes.
+"""
+
+import frappe
+
+LOAN_FIELDS = ("loan_product", "interest_calculation_method")
+LOAN_PRODUCT_FIELDS = ("interest_calculation_method", "repayment_schedule_type", "repayment_date_on")
+
+
+def _get_cache():
+	if not hasattr(frappe.local, "lending_custom_settings"):
+		frappe.local.lending_custom_settings = {}
+
+	return frappe.local.lending_custom_settings
+
+
+def _get_settings(doctype, name, fields):
+	if not name:
+		return frappe._dict({field: None for field in fields})
+
+	cache = _get_cache()
+	key = (doctype, name)
+	if key not in cache:
+		settings = frappe.db.get_value(doctype, name, list(fields), as_dict=1)
+		if not settings:
+			# not cached, the document may be inserted later in the same request
+			return frappe._dict({field: None for field in fields})
+
+		cache[key] = settings
+
+	return cache[key]
+
+
+def get_loan_settings(loan):
+	"""`loan_product` and `interest_calculation_method` of a Loan"""
+	return _get_settings("Loan", loan, LOAN_FIELDS)
+
+
+def get_loan_product_settings(loan_product):
+	"""Interest calculation method and repayment schedule settings of a Loan Product"""
+	return _get_settings("Loan Product", loan_product, LOAN_PRODUCT_FIELDS)
+
+
+def get_interest_calculation_method(loan=None, loan_product=None):
+	"""Interest calculation method set on the Loan, or on the Loan Product if no loan is given"""
+	if loan:
+		return get_loan_settings(loan).interest_calculation_method
+
+	return get_loan_product_settings(loan_product).interest_calculation_method
+
+
+def clear_loan_settings_cache(doc=None, method=None):
+	"""Doc event: drop the cached settings of a Loan or Loan Product that was changed"""
+	cache = _get_cache()
+	if doc:
+		cache.pop((doc.doctype, doc.name), None)
+	else:
+		cache.clear()
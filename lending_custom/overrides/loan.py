@@ -8,18 +8,17 @@ from lending_custom.interest_calculations import (
 	calculate_payable_amount_custom,
 	get_per_day_interest_custom
 )
+from lending_custom.loan_settings import get_loan_product_settings
+from lending_custom.tracing import span, traced
 
 
 class LoanOverride(Loan):
 	def validate(self):
 		# Set interest calculation method from loan product if not set
 		if not self.interest_calculation_method and self.loan_product:
-			self.interest_calculation_method = frappe.db.get_value(
-				"Loan Product", self.loan_product, "interest_calculation_method"
-			) or "Monthly Prorated"
-			print(f"DEBUG Loan.validate: Set interest_calculation_method to {self.interest_calculation_method} from loan_product {self.loan_product}")
-
-		print(f"DEBUG Loan.validate: interest_calculation_method={self.interest_calculation_method}, loan_product={self.loan_product}")
+			self.interest_calculation_method = get_loan_product_settings(
+				self.loan_product
+			).interest_calculation_method or "Monthly Prorated"
 
 		# Set loan amount if not set
 		self.set_loan_amount()
@@ -31,7 +30,6 @@ class LoanOverride(Loan):
 		# Set repayment_start_date if not set
 		if not self.repayment_start_date:
 			self.repayment_start_date = frappe.utils.nowdate()
-			print(f"DEBUG Loan.validate: Set repayment_start_date to {self.repayment_start_date}")
 
 		# Call parent validate
 		super().validate()
@@ -45,7 +43,6 @@ class LoanOverride(Loan):
 
 	def calculate_repayment_details(self):
 		"""Calculate repayment details based on repayment method and interest calculation method"""
-		print(f"DEBUG Loan.calculate_repayment_details: START - method={self.repayment_method}, interest_calc={self.interest_calculation_method}, loan_amount={self.loan_amount}, rate={self.rate_of_interest}, periods={self.repayment_periods}")
 		
 		# Skip if required fields are not set
 		if not self.loan_amount or not self.rate_of_interest:
@@ -56,7 +53,6 @@ class LoanOverride(Loan):
 			self.monthly_repayment_amount = get_monthly_repayment_amount_custom(
 				self.loan_amount, self.rate_of_interest, self.repayment_periods, self.interest_calculation_method
 			)
-			print(f"DEBUG Loan: Calculated monthly_repayment_amount = {self.monthly_repayment_amount}")
 
 		if self.repayment_method == "Repay Fixed Amount per Period":
 			if self.interest_calculation_method == "One-time Percentage":
@@ -66,7 +62,6 @@ class LoanOverride(Loan):
 					self.repayment_periods = math.ceil(total_amount / self.monthly_repayment_amount)
 				else:
 					self.repayment_periods = 1
-				print(f"DEBUG Loan: One-time percentage - total_amount={total_amount}, periods={self.repayment_periods}")
 			else:
 				# Original calculation for monthly prorated
 				if not self.monthly_repayment_amount:
@@ -85,7 +80,6 @@ class LoanOverride(Loan):
 
 		# Calculate total payable amount and interest
 		self.calculate_total_payable()
-		print(f"DEBUG Loan.calculate_repayment_details: END - monthly_repayment_amount={self.monthly_repayment_amount}")
 
 	def calculate_total_payable(self):
 		"""Calculate total payable amount and interest based on interest calculation method"""
@@ -93,10 +87,8 @@ class LoanOverride(Loan):
 			# For one-time percentage, calculate total interest upfront
 			self.total_interest_payable = self.loan_amount * (self.rate_of_interest / 100)
 			self.total_payment = self.loan_amount + self.total_interest_payable
-			print(f"DEBUG Loan.calculate_total_payable: One-time percentage - total_payment={self.total_payment}, total_interest_payable={self.total_interest_payable}")
 		else:
 			# Use the original calculation for monthly prorated
-			print(f"DEBUG Loan.calculate_total_payable: Using original calculation for method={self.interest_calculation_method}")
 			# Call the parent method or implement the original logic
 			# For now, we'll set basic values - the original logic would be more complex
 			# This is a simplified version
@@ -107,10 +99,9 @@ class LoanOverride(Loan):
 				self.total_payment = self.loan_amount
 				self.total_interest_payable = 0
 
+	@traced("calculate_totals")
 	def calculate_totals(self, on_insert=False):
 		"""Override to prevent original calculate_totals from overriding our custom calculations"""
-		print(f"DEBUG Loan.calculate_totals: on_insert={on_insert}, interest_calculation_method={self.interest_calculation_method}")
-
 		if self.interest_calculation_method == "One-time Percentage":
 			# For one-time percentage, we've already calculated the totals in calculate_total_payable
 			# Just ensure the schedule values are correct
@@ -120,19 +111,16 @@ class LoanOverride(Loan):
 				if schedule.monthly_repayment_amount != self.monthly_repayment_amount:
 					schedule.monthly_repayment_amount = self.monthly_repayment_amount
 					schedule.save()
-					print(f"DEBUG Loan.calculate_totals: Updated schedule monthly_repayment_amount to {self.monthly_repayment_amount}")
 
 				# Set the database values
 				self.db_set("total_interest_payable", self.total_interest_payable)
 				self.db_set("monthly_repayment_amount", self.monthly_repayment_amount)
 				self.db_set("total_payment", self.total_payment)
-				print(f"DEBUG Loan.calculate_totals: Set DB values - total_payment={self.total_payment}, total_interest_payable={self.total_interest_payable}, monthly_repayment_amount={self.monthly_repayment_amount}")
 		else:
 			# Use original calculation for other methods
 			super().calculate_totals(on_insert)
 
 	def make_draft_schedule(self):
-		print(f"DEBUG Loan.make_draft_schedule: Creating schedule with monthly_repayment_amount={self.monthly_repayment_amount}, interest_calc={self.interest_calculation_method}")
 		schedule = frappe.get_doc(
 			{
 				"doctype": "Loan Repayment Schedule",
@@ -147,5 +135,6 @@ class LoanOverride(Loan):
 				"posting_date": self.posting_date,
 			}
 		)
-		schedule.insert()
-		print(f"DEBUG Loan.make_draft_schedule: Schedule created with monthly_repayment_amount={schedule.monthly_repayment_amount}")
\ No newline at end of file
+		with span("schedule_insert", loan=self.name) as s:
+			schedule.insert()
+			s.set(rows=len(schedule.repayment_schedule or []))
\ No newline at end of file
@@ -8,6 +8,7 @@ from lending_custom.interest_calculations import (
 	calculate_payable_amount_custom,
 	get_per_day_interest_custom
 )
+from lending_custom.loan_settings import get_loan_product_settings
 
 
 class LoanApplicationOverride(LoanApplication):
@@ -15,9 +16,9 @@ class LoanApplicationOverride(LoanApplication):
 		# Set interest calculation method from loan product if not set
 		interest_calc_method = getattr(self, 'interest_calculation_method', None)
 		if not interest_calc_method and self.loan_product:
-			interest_calc_method = frappe.db.get_value(
-				"Loan Product", self.loan_product, "interest_calculation_method"
-			) or "Monthly Prorated"
+			interest_calc_method = get_loan_product_settings(
+				self.loan_product
+			).interest_calculation_method or "Monthly Prorated"
 			if hasattr(self, 'interest_calculation_method'):
 				self.interest_calculation_method = interest_calc_method
 
@@ -46,7 +47,6 @@ class LoanApplicationOverride(LoanApplication):
 				self.repayment_amount = get_monthly_repayment_amount_custom(
 					self.loan_amount, self.rate_of_interest, self.repayment_periods, interest_calc_method
 				)
-				print(f"DEBUG: Calculated repayment_amount = {self.repayment_amount}")
 
 			if self.repayment_method == "Repay Fixed Amount per Period":
 				if interest_calc_method == "One-time Percentage":
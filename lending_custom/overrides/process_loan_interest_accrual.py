@@ -2,10 +2,10 @@ import frappe
 from frappe.utils import nowdate, getdate, add_days, date_diff
 
 from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import ProcessLoanInterestAccrual
-from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
-	make_accrual_interest_entry_for_demand_loans,
-	make_accrual_interest_entry_for_term_loans,
-)
+from lending_custom.accrual_metrics import collect_metrics, save_run_metrics
+from lending_custom.accrual_simulation import simulate_accruals_for_range
+from lending_custom.accrual_workers import enqueue_accrual_shards
+from lending_custom.historical_accrual import ACCRUAL_PERIOD_DAILY, process_accruals_for_range
 
 
 class ProcessLoanInterestAccrualOverride(ProcessLoanInterestAccrual):
@@ -21,40 +21,79 @@ class ProcessLoanInterestAccrualOverride(ProcessLoanInterestAccrual):
 
 		# Check if date range is provided for batch processing
 		if hasattr(self, 'start_date') and hasattr(self, 'end_date') and self.start_date and self.end_date:
-			start = getdate(self.start_date)
-			end = getdate(self.end_date)
-			
-			# Process each date in the range
-			current_date = start
-			while current_date <= end:
-				self._process_for_date(current_date, open_loans, loan_doc)
-				current_date = add_days(current_date, 1)
+			# Accrue the range in loan-sharded background jobs, tracked on this document
+			enqueue_accrual_shards(self.name, **self.get_range_accrual_args(loan_doc))
 		else:
 			# Single date processing (original behavior)
 			self._process_for_date(getdate(self.posting_date), open_loans, loan_doc)
 
-	def _process_for_date(self, posting_date, open_loans, loan_doc):
-		"""Process accrual for a specific date"""
-		frappe.logger().info(f"Processing accrual for date {posting_date} in {self.name}")
-		
+	def get_range_accrual_args(self, loan_doc=None):
+		"""Arguments of the shard jobs of a date range accrual"""
+		if self.loan and not loan_doc:
+			loan_doc = frappe.get_doc("Loan", self.loan)
+
+		return {
+			"start_date": self.start_date,
+			"end_date": self.end_date,
+			"term_loan": self.loan,
+			"loan_product": self.loan_product,
+			"accrual_type": self.accrual_type or "Regular",
+			"include_demand_loans": self._should_process_demand_loans(loan_doc),
+			"include_term_loans": self._should_process_term_loans(loan_doc),
+			"accrual_period": self.accrual_period or ACCRUAL_PERIOD_DAILY,
+		}
+
+	def simulate_accruals(self):
+		"""
+		Dry run: the accruals this document would post for its date range (or posting date),
+		projected from the current book without writing anything
+		"""
+		loan_doc = frappe.get_doc("Loan", self.loan) if self.loan else None
+		if self.start_date and self.end_date:
+			start_date, end_date = self.start_date, self.end_date
+		else:
+			start_date = end_date = self.posting_date or nowdate()
+
+		return simulate_accruals_for_range(
+			start_date,
+			end_date,
+			open_loans=[loan_doc] if loan_doc else None,
+			term_loan=self.loan,
+			loan_product=self.loan_product,
+			include_demand_loans=self._should_process_demand_loans(loan_doc),
+			include_term_loans=self._should_process_term_loans(loan_doc),
+		)
+
+	def _should_process_demand_loans(self, loan_doc):
 		# Process demand loans when process_type is not set or is "Demand Loans"
-		if (not self.loan or (loan_doc and not loan_doc.is_term_loan)) and (not self.process_type or self.process_type != "Term Loans"):
-			frappe.logger().info(f"Processing demand loans for {posting_date}")
-			make_accrual_interest_entry_for_demand_loans(
-				posting_date,
-				self.name,
-				open_loans=open_loans,
-				loan_product=self.loan_product,
-				accrual_type=self.accrual_type or "Regular",
-			)
+		return bool(
+			(not self.loan or (loan_doc and not loan_doc.is_term_loan))
+			and (not self.process_type or self.process_type != "Term Loans")
+		)
 
+	def _should_process_term_loans(self, loan_doc):
 		# Process term loans when process_type is not set or is "Term Loans"
-		if (not self.loan or (loan_doc and loan_doc.is_term_loan)) and (not self.process_type or self.process_type != "Demand Loans"):
-			frappe.logger().info(f"Processing term loans for {posting_date}")
-			make_accrual_interest_entry_for_term_loans(
-				posting_date,
+		return bool(
+			(not self.loan or (loan_doc and loan_doc.is_term_loan))
+			and (not self.process_type or self.process_type != "Demand Loans")
+		)
+
+	def _process_for_date(self, posting_date, open_loans, loan_doc):
+		"""
+		Process accrual for a specific date: the one-day window of process_accruals_for_range,
+		so the demand loans' state is prefetched for the whole book and the accruals are written
+		in batches
+		"""
+		with collect_metrics() as metrics:
+			process_accruals_for_range(
 				self.name,
+				posting_date,
+				posting_date,
+				open_loans=open_loans,
 				term_loan=self.loan,
 				loan_product=self.loan_product,
 				accrual_type=self.accrual_type or "Regular",
-			)
\ No newline at end of file
+				include_demand_loans=self._should_process_demand_loans(loan_doc),
+				include_term_loans=self._should_process_term_loans(loan_doc),
+			)
+		save_run_metrics(self.name, metrics)
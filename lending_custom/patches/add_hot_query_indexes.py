@@ -0,0 +1,9 @@
+import frappe
+
+
+def execute():
+	"""Add composite indexes for the accrual, term loan, reconciliation and GL entry hot queries"""
+	from lending_custom.query_indexes import add_hot_query_indexes
+
+	add_hot_query_indexes()
+	frappe.logger().info("Added lending_custom hot query indexes")
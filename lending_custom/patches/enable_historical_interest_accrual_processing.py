@@ -1,5 +1,7 @@
 import frappe
-from frappe.utils import add_days, getdate, cint, flt
+from frappe.utils import add_days, cint, flt
+
+from lending_custom.historical_accrual import get_date_after_last_accrual
 
 def execute():
 	"""Enable historical interest accrual processing by patching core functions"""
@@ -12,24 +14,19 @@ def execute():
 	original_calculate_accrual = loan_interest_accrual.calculate_accrual_amount_for_demand_loans
 	
 	def patched_get_last_accrual_date(loan, posting_date):
-		"""Modified to only consider accruals up to the posting_date for historical processing"""
+		"""
+		Modified to only consider accruals up to the posting_date for historical processing,
+		and accruals compacted over a period that covers the posting_date
+		"""
 		last_posting_date = frappe.db.sql(
 			""" SELECT MAX(posting_date) from `tabLoan Interest Accrual`
-			WHERE loan = %s and docstatus = 1 and posting_date <= %s""",
-			(loan, posting_date),
+			WHERE loan = %s and docstatus = 1 and (posting_date <= %s or last_accrual_date <= %s)""",
+			(loan, posting_date, posting_date),
 		)
 
 		if last_posting_date[0][0]:
-			last_interest_accrual_date = last_posting_date[0][0]
-			# interest for last interest accrual date is already booked, so add 1 day
 			last_disbursement_date = loan_interest_accrual.get_last_disbursement_date(loan, posting_date)
-
-			if last_disbursement_date and getdate(last_disbursement_date) > add_days(
-				getdate(last_interest_accrual_date), 1
-			):
-				last_interest_accrual_date = last_disbursement_date
-
-			return add_days(last_interest_accrual_date, 1)
+			return get_date_after_last_accrual(last_posting_date[0][0], last_disbursement_date)
 		else:
 			return frappe.db.get_value("Loan", loan, "disbursement_date")
 	
@@ -64,13 +61,18 @@ def execute():
 			pending_principal_amount = pending_principal_amount - flt(
 				pending_amounts["payable_principal_amount"]
 			)
-		else:
-			pending_amounts = calculate_amounts(loan.name, posting_date, payment_type="Loan Closure")
 
 		payable_interest = loan_interest_accrual.get_interest_amount(
 			no_of_days, pending_principal_amount, loan.rate_of_interest, loan.company, posting_date
 		)
 
+		if flt(payable_interest, precision) <= 0.0:
+			return
+
+		if not loan.is_term_loan:
+			# pending interest and penalty are only read for loans that accrue
+			pending_amounts = calculate_amounts(loan.name, posting_date, payment_type="Loan Closure")
+
 		args = frappe._dict(
 			{
 				"loan": loan.name,
@@ -86,11 +88,11 @@ def execute():
 				"posting_date": posting_date,
 				"due_date": posting_date,
 				"accrual_type": accrual_type,
+				"last_accrual_date": add_days(posting_date, 1 - no_of_days),
 			}
 		)
 
-		if flt(payable_interest, precision) > 0.0:
-			loan_interest_accrual.make_loan_interest_accrual_entry(args)
+		loan_interest_accrual.make_loan_interest_accrual_entry(args)
 	
 	def patched_get_term_loans(date, term_loan=None, loan_product=None):
 		"""Modified to allow historical processing by not requiring active status for old loans"""
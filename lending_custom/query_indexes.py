@@ -0,0 +1,157 @@
+"""
+Composite indexes for the lending hot queries, and a check of their query plans
+
+Each hot query filters on a column combination that the standard indexes do not cover.
+`add_hot_query_indexes` (run by the `add_hot_query_indexes` patch) creates one composite
+index per query, equality columns first, and `explain_hot_queries` (the
+`explain-lending-queries` bench command) runs EXPLAIN on every query, with parameters
+taken from the latest row of its table, and reports whether the planner uses the index.
+"""
+
+import frappe
+
+HOT_QUERIES = (
+	frappe._dict(
+		{
+			"name": "Last accrual date of a loan",
+			"source": "patched_get_last_accrual_date",
+			"doctype": "Loan Interest Accrual",
+			"index": "lending_custom_loan_docstatus_posting_date",
+			"columns": ("loan", "docstatus", "posting_date"),
+			"query": """SELECT MAX(posting_date) FROM `tabLoan Interest Accrual`
+				WHERE loan = %(loan)s AND docstatus = 1
+				AND (posting_date <= %(posting_date)s OR last_accrual_date <= %(posting_date)s)""",
+			"parameters": ("loan", "posting_date"),
+		}
+	),
+	frappe._dict(
+		{
+			"name": "Accrual already posted for a loan and date",
+			"source": "patched_calculate_accrual_amount_for_demand_loans",
+			"doctype": "Loan Interest Accrual",
+			"index": "lending_custom_loan_docstatus_posting_date",
+			"columns": ("loan", "docstatus", "posting_date"),
+			"query": """SELECT name FROM `tabLoan Interest Accrual`
+				WHERE loan = %(loan)s AND posting_date = %(posting_date)s AND docstatus = 1 LIMIT 1""",
+			"parameters": ("loan", "posting_date"),
+		}
+	),
+	frappe._dict(
+		{
+			"name": "Unaccrued term loan schedule rows",
+			"source": "get_term_loans_override",
+			"doctype": "Repayment Schedule",
+			"index": "lending_custom_parent_accrued_payment_date",
+			"columns": ("parent", "is_accrued", "payment_date", "principal_amount"),
+			"query": """SELECT rs.name FROM `tabRepayment Schedule` rs
+				WHERE rs.parent = %(parent)s AND rs.is_accrued = 0 AND rs.payment_date <= %(payment_date)s
+				AND rs.principal_amount > 0 AND rs.docstatus = 1""",
+			"parameters": ("parent", "payment_date"),
+		}
+	),
+	frappe._dict(
+		{
+			"name": "Loan Repayments matching bank transactions",
+			"source": "get_candidate_repayments",
+			"doctype": "Loan Repayment",
+			"index": "lending_custom_reconciliation_match",
+			"columns": ("reference_number", "payment_account", "clearance_date", "posting_date"),
+			"query": """SELECT name FROM `tabLoan Repayment`
+				WHERE docstatus = 1 AND clearance_date IS NULL AND reference_number IN (%(reference_number)s)
+				AND payment_account IN (%(payment_account)s) ORDER BY posting_date, name""",
+			"parameters": ("reference_number", "payment_account"),
+		}
+	),
+	frappe._dict(
+		{
+			"name": "GL entries of a Loan Repayment",
+			"source": "regenerate_gl_entries",
+			"doctype": "GL Entry",
+			"index": "lending_custom_voucher_cancelled",
+			"columns": ("voucher_type", "voucher_no", "is_cancelled"),
+			"query": """SELECT COUNT(*) FROM `tabGL Entry`
+				WHERE voucher_type = 'Loan Repayment' AND voucher_no = %(voucher_no)s AND is_cancelled = 0""",
+			"parameters": ("voucher_no",),
+			"sample_filters": {"voucher_type": "Loan Repayment"},
+		}
+	),
+)
+
+
+def add_hot_query_indexes():
+	"""Create the composite index of every hot query, existing indexes are left alone"""
+	added = set()
+	for query in HOT_QUERIES:
+		if (query.doctype, query.index) in added:
+			continue
+
+		frappe.db.add_index(query.doctype, list(query.columns), index_name=query.index)
+		added.add((query.doctype, query.index))
+
+
+def explain_hot_queries():
+	"""
+	Query plan of every hot query and whether it uses its composite index. A query whose
+	table has no row to take parameters from is skipped, as the plan of NULL parameters
+	says nothing about the index.
+	"""
+	return [explain_query(query) for query in HOT_QUERIES]
+
+
+def explain_query(query):
+	result = frappe._dict(
+		{
+			"name": query.name,
+			"source": query.source,
+			"index": query.index,
+			"index_exists": index_exists(query.doctype, query.index),
+			"skipped": False,
+			"uses_index": False,
+			"plan": "",
+		}
+	)
+
+	values = get_sample_values(query)
+	if any(value is None for value in values.values()):
+		result.update({"skipped": True, "plan": f"no {query.doctype} to take parameters from"})
+		return result
+
+	plan = frappe.db.sql(f"EXPLAIN {query.query}", values, as_dict=frappe.db.db_type != "postgres")
+
+	if frappe.db.db_type == "postgres":
+		plan_text = "\n".join(row[0] for row in plan)
+		uses_index = query.index in plan_text
+		access = plan_text.splitlines()[0] if plan_text else ""
+	else:
+		row = plan[0] if plan else frappe._dict()
+		# MariaDB answers MIN/MAX over an index prefix from the index alone, without a key
+		extra = row.get("Extra") or ""
+		uses_index = row.get("key") == query.index or "optimized away" in extra or "min/max" in extra
+		access = f"{row.get('type')} on {row.get('key') or 'no index'}, ~{row.get('rows') or 0} rows"
+
+	result.update({"uses_index": uses_index, "plan": access})
+	return result
+
+
+def get_sample_values(query):
+	"""Parameters of the query, from the latest matching row of its table so the plan is realistic"""
+	sample = frappe.db.get_value(
+		query.doctype,
+		query.sample_filters or {},
+		list(query.parameters),
+		as_dict=True,
+		order_by="creation desc",
+	)
+	return {field: (sample or {}).get(field) for field in query.parameters}
+
+
+def index_exists(doctype, index_name):
+	if frappe.db.db_type == "postgres":
+		return bool(
+			frappe.db.sql(
+				"SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s",
+				(f"tab{doctype}", index_name),
+			)
+		)
+
+	return bool(frappe.db.sql(f"SHOW INDEX FROM `tab{doctype}` WHERE Key_name = %s", index_name))
@@ -0,0 +1,265 @@
+"""
+Bank account partitioned auto-reconciliation of Loan Repayments
+
+A Bank Transaction only matches Loan Repayments paid into the GL account of its bank
+account, so bank accounts on different GL accounts never compete for a repayment and can
+be reconciled side by side. `reconcile_in_parallel` partitions the bank accounts with
+unreconciled deposits by GL account (bank accounts sharing one are reconciled together,
+one after the other) and runs every partition:
+
+- as its own job on the long queue (the API), each saving its summary in the cache
+  under the run; `get_parallel_reconciliation_summary` merges those finished so far
+- or in a local process pool (the bench command), which returns the merged summary
+
+A partition holds a lock on its GL account while it runs, so two runs (a queued job and
+a later one, or one for a single bank account) never reconcile against the same
+repayments at once; the partition that finds the lock taken is reported in
+failed_partitions. The summaries merge into the shape of auto_reconcile_loan_repayments.
+The row and time budgets apply to each partition. The pool size is configured per site:
+
+	bench --site <site> set-config lending_custom_reconciliation_workers 8
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+from lending_custom.accrual_workers import is_queue_available
+from lending_custom.repayment_matcher import get_bank_account_details
+
+WORKERS_KEY = "lending_custom_reconciliation_workers"
+PARTITION_TIMEOUT = 4 * 60 * 60
+# how long the summaries of a queued run are kept
+RUN_EXPIRY = 24 * 60 * 60
+
+SUMMARY_COUNTS = ("total_processed", "reconciled", "skipped", "failed")
+SUMMARY_DETAILS = ("reconciled_details", "failed_details", "failed_partitions")
+
+
+def reconcile_in_parallel(
+	bank_account=None,
+	from_date=None,
+	to_date=None,
+	max_rows=None,
+	max_seconds=None,
+	use_queue=False,
+	workers=None,
+):
+	"""
+	Reconcile every partition of bank accounts in parallel: in background jobs with
+	`use_queue`, otherwise in a local pool of `workers` processes. Requests use the queue,
+	they must not wait on a pool, so an unreachable queue is an error there.
+	"""
+	partitions = get_bank_account_partitions(bank_account, from_date, to_date)
+	args = {
+		"from_date": str(from_date) if from_date else None,
+		"to_date": str(to_date) if to_date else None,
+		"max_rows": cint(max_rows) or None,
+		"max_seconds": flt(max_seconds) or None,
+	}
+
+	if use_queue:
+		if not (frappe.flags.in_test or is_queue_available()):
+			frappe.throw(
+				_(
+					"The background job queue is not reachable, so the reconciliation cannot run in "
+					"parallel. Start the workers and Redis queue of the site, or reconcile without "
+					"parallel."
+				),
+				title=_("Background Jobs Unavailable"),
+			)
+		return enqueue_partitions(partitions, args)
+
+	if len(partitions) <= 1:
+		return merge_summaries(reconcile_partition(**partition, **args) for partition in partitions)
+
+	return run_partitions_in_process_pool(
+		frappe.local.site, frappe.local.sites_path, partitions, args, workers
+	)
+
+
+def get_bank_account_partitions(bank_account=None, from_date=None, to_date=None):
+	"""
+	Sorted bank accounts with unreconciled deposits, in one partition per GL account:
+	{"account": GL account, "bank_accounts": [...]}
+	"""
+	from lending_custom.loan_auto_reconciliation import filter_unreconciled_bank_transactions
+
+	bt = frappe.qb.DocType("Bank Transaction")
+	query = frappe.qb.from_(bt).select(bt.bank_account).distinct()
+	bank_accounts = sorted(
+		row.bank_account
+		for row in filter_unreconciled_bank_transactions(query, bank_account, from_date, to_date).run(
+			as_dict=True
+		)
+		if row.bank_account
+	)
+
+	details = get_bank_account_details(bank_accounts)
+	partitions = {}
+	for name in bank_accounts:
+		# a bank account without a GL account matches nothing, and shares with no one
+		account = details[name].account if name in details else name
+		partitions.setdefault(account, {"account": account, "bank_accounts": []})["bank_accounts"].append(
+			name
+		)
+
+	return list(partitions.values())
+
+
+def enqueue_partitions(partitions, args):
+	"""
+	Enqueue a job per partition; the summary counts nothing yet and names the run to get
+	the merged summary of
+	"""
+	run_id = frappe.generate_hash(length=10)
+	queued = []
+	for partition in partitions:
+		job = frappe.enqueue(
+			"lending_custom.reconciliation_workers.run_reconciliation_partition",
+			queue="long",
+			timeout=PARTITION_TIMEOUT,
+			# one queued job per GL account, whatever its bank accounts; reconcile_partition's
+			# lock covers jobs already running
+			job_id=f"auto-reconcile-loan-repayments::{partition['account']}",
+			deduplicate=True,
+			now=frappe.flags.in_test,
+			run_id=run_id,
+			**partition,
+			**args,
+		)
+		if job is not None:
+			queued.append(partition["account"])
+
+	frappe.cache.set_value(get_run_key(run_id), {"partitions": queued}, expires_in_sec=RUN_EXPIRY)
+
+	frappe.msgprint(
+		_("{0} bank account partition(s) queued for reconciliation").format(len(queued)),
+		title=_("Auto Reconciliation Queued"),
+		indicator="blue",
+	)
+
+	summary = merge_summaries([])
+	summary.update({"run_id": run_id, "pending_partitions": len(queued)})
+	return summary
+
+
+@frappe.whitelist()
+def get_parallel_reconciliation_summary(run_id):
+	"""Merged summary of the partitions of a queued run that have finished"""
+	run = frappe.cache.get_value(get_run_key(run_id))
+	if not run:
+		frappe.throw(_("Reconciliation run {0} not found or expired").format(frappe.bold(run_id)))
+
+	summaries = [frappe.cache.get_value(get_run_key(run_id, account)) for account in run["partitions"]]
+	summary = merge_summaries(s for s in summaries if s)
+	summary.update({"run_id": run_id, "pending_partitions": sum(1 for s in summaries if not s)})
+	return summary
+
+
+def run_reconciliation_partition(run_id, account, bank_accounts, **args):
+	"""Background job of a partition, its summary saved for the run"""
+	summary = reconcile_partition(account, bank_accounts, **args)
+	frappe.cache.set_value(get_run_key(run_id, account), summary, expires_in_sec=RUN_EXPIRY)
+	return summary
+
+
+def reconcile_partition(
+	account, bank_accounts, from_date=None, to_date=None, max_rows=None, max_seconds=None
+):
+	"""
+	Reconcile the bank accounts of a partition one after the other within the partition's
+	budget, holding the lock of its GL account, and merge their summaries. A failing bank
+	account, or a lock held by another run, ends the partition, recorded in failed_partitions.
+	"""
+	from lending_custom.loan_auto_reconciliation import auto_reconcile_loan_repayments
+
+	max_rows = cint(max_rows)
+	deadline = time.monotonic() + flt(max_seconds) if flt(max_seconds) > 0 else None
+	summaries = []
+
+	with account_lock(account) as locked:
+		if not locked:
+			error = _("GL account {0} is being reconciled by another run").format(account)
+			return merge_summaries(
+				[{"failed_partitions": [{"bank_accounts": bank_accounts, "error": error}]}]
+			)
+
+		try:
+			for bank_account in bank_accounts:
+				summary = auto_reconcile_loan_repayments(
+					bank_account=bank_account,
+					from_date=from_date,
+					to_date=to_date,
+					max_rows=max_rows - sum(s["total_processed"] for s in summaries) if max_rows else None,
+					max_seconds=max(deadline - time.monotonic(), 0.001) if deadline else None,
+				)
+				summaries.append(summary)
+				if summary["budget_exhausted"]:
+					break
+		except Exception as e:
+			frappe.db.rollback()
+			frappe.log_error(title=f"Auto reconciliation of {', '.join(bank_accounts)} failed")
+			summaries.append({"failed_partitions": [{"bank_accounts": bank_accounts, "error": str(e)}]})
+
+	return merge_summaries(summaries)
+
+
+@contextmanager
+def account_lock(account):
+	"""Hold the reconciliation lock of a GL account, yields whether it was free"""
+	lock = frappe.cache.lock(
+		frappe.cache.make_key(f"lending_custom_reconciliation_lock::{account}"), timeout=PARTITION_TIMEOUT
+	)
+	locked = lock.acquire(blocking=False)
+	try:
+		yield locked
+	finally:
+		if locked:
+			lock.release()
+
+
+def merge_summaries(summaries):
+	"""Summaries of auto_reconcile_loan_repayments added up into one of the same shape"""
+	merged = {
+		**dict.fromkeys(SUMMARY_COUNTS, 0),
+		**{key: [] for key in SUMMARY_DETAILS},
+		"budget_exhausted": False,
+	}
+	for summary in summaries:
+		for key in SUMMARY_COUNTS:
+			merged[key] += summary.get(key, 0)
+		for key in SUMMARY_DETAILS:
+			merged[key].extend(summary.get(key, []))
+		merged["budget_exhausted"] = merged["budget_exhausted"] or bool(summary.get("budget_exhausted"))
+
+	return merged
+
+
+def get_run_key(run_id, account=None):
+	key = f"lending_custom_reconciliation_run::{run_id}"
+	return f"{key}::{account}" if account else key
+
+
+def run_partitions_in_process_pool(site, sites_path, partitions, args, workers=None):
+	workers = cint(workers) or cint(frappe.conf.get(WORKERS_KEY)) or os.cpu_count() or 1
+	with ProcessPoolExecutor(
+		max_workers=min(workers, len(partitions)), mp_context=multiprocessing.get_context("spawn")
+	) as pool:
+		return merge_summaries(pool.map(partial(_run_partition_for_site, site, sites_path, args), partitions))
+
+
+def _run_partition_for_site(site, sites_path, args, partition):
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	try:
+		return reconcile_partition(**partition, **args)
+	finally:
+		frappe.destroy()
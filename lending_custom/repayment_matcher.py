@@ -0,0 +1,540 @@
+"""
+Set-based matching of Bank Transactions with Loan Repayments
+
+A deposit matches an unreconciled Loan Repayment with the same reference number, amount
+and date, paid into the GL account of the transaction's bank account. Rather than querying
+per transaction, `RepaymentMatcher` loads everything a batch of transactions can match in
+a fixed number of queries (the bank accounts' GL accounts, then the candidate repayments)
+and joins them in memory. Each repayment is handed out to one transaction only.
+
+Matching can be relaxed per site, for deposits that clear late or arrive net of bank fees:
+
+	bench --site <site> set-config lending_custom_reconciliation_date_window 3
+	bench --site <site> set-config lending_custom_reconciliation_amount_tolerance 50
+	bench --site <site> set-config lending_custom_reconciliation_normalize_references 1
+
+Candidates then come from a `CandidateIndex` sorted by (account, amount, date), so each
+lookup is two range searches (the amounts within the tolerance, then the dates within the
+window of each amount) instead of a scan. Every candidate in range whose reference matches
+is scored and the best one wins.
+
+reconcile_vouchers allocates the smaller of the deposit and the repayment, so a match
+whose amounts differ would leave one side open: the repayment partly allocated or the
+deposit unreconciled. Automatic reconciliation therefore skips such matches
+(SKIP_AMOUNT_DIFFERENCE), they show in the preview with their `amount_difference` for
+manual confirmation. A repayment already allocated to a Bank Transaction, even in part,
+is never a candidate again.
+
+A deposit can also pay for several repayments at once (the collection of a lending group)
+and a repayment can arrive in parts. With group matching on, the transactions left
+unmatched are tried against groups:
+
+	bench --site <site> set-config lending_custom_reconciliation_group_matching 1
+	bench --site <site> set-config lending_custom_reconciliation_max_group_size 6
+
+- one deposit, several repayments: the candidates within the date window whose reference
+  starts with the deposit's, or paid by the deposit's party, that sum to the deposit
+- several deposits, one repayment: deposits with the repayment's reference within the
+  date window of it that sum to the repayment
+
+Both are a subset-sum search over the amounts (`find_subset_sum`), bounded by the group
+size, the number of candidates searched and the number of steps, and pruned on the sums
+still reachable, so it stays fast however long the statement.
+"""
+
+import bisect
+import re
+
+import frappe
+from frappe.utils import add_days, cint, date_diff, flt, getdate
+
+DATE_WINDOW_KEY = "lending_custom_reconciliation_date_window"
+AMOUNT_TOLERANCE_KEY = "lending_custom_reconciliation_amount_tolerance"
+NORMALIZE_REFERENCES_KEY = "lending_custom_reconciliation_normalize_references"
+GROUP_MATCHING_KEY = "lending_custom_reconciliation_group_matching"
+MAX_GROUP_SIZE_KEY = "lending_custom_reconciliation_max_group_size"
+DEFAULT_MAX_GROUP_SIZE = 6
+
+SKIP_BANK_ACCOUNT_NOT_FOUND = "Bank account not found"
+SKIP_NO_MATCH = "No matching Loan Repayment found"
+SKIP_AMOUNT_DIFFERENCE = "Amount differs from the matching Loan Repayments, reconcile it manually"
+
+# absorbs float noise at the edges of the amount tolerance
+AMOUNT_EPSILON = 1e-6
+
+# the candidates nearest in date searched for a group, and the steps the search may take
+GROUP_CANDIDATE_LIMIT = 24
+SUBSET_SEARCH_STEPS = 20000
+
+
+class RepaymentMatcher:
+	"""Candidate Loan Repayments of a batch of bank transactions, indexed for matching"""
+
+	def __init__(self, transactions, tolerance=None):
+		self.tolerance = tolerance or get_match_tolerance()
+		self.bank_accounts = get_bank_account_details(
+			{t.bank_account for t in transactions if t.bank_account}
+		)
+		accounts = {details.account for details in self.bank_accounts.values()}
+		# shared by the indexes, so a repayment is handed out once whichever matched it
+		self.taken = set()
+
+		if self.tolerance.exact:
+			self.index = None
+			self.candidates = {}
+			for repayment in get_candidate_repayments(
+				accounts, reference_numbers={t.reference_number for t in transactions if t.reference_number}
+			):
+				key = get_match_key(
+					repayment.reference_number,
+					repayment.posting_date,
+					repayment.amount_paid,
+					repayment.payment_account,
+				)
+				self.candidates.setdefault(key, []).append(repayment)
+		else:
+			self.index = CandidateIndex(
+				get_window_repayments(accounts, transactions, self.tolerance), self.taken
+			)
+
+		self.group_index = None
+		if self.tolerance.group_matching:
+			self.group_index = self.index or CandidateIndex(
+				get_window_repayments(accounts, transactions, self.tolerance), self.taken
+			)
+
+	def match(self, transaction):
+		"""
+		(repayment, None) for the transaction's matching repayment, which no later match
+		gets, or (None, reason) when there is none. The repayment carries its match_score.
+		"""
+		bank_account = self.bank_accounts.get(transaction.bank_account)
+		if not bank_account:
+			return None, SKIP_BANK_ACCOUNT_NOT_FOUND
+
+		if self.index is not None:
+			repayment = self.index.take_best(
+				bank_account.account,
+				transaction.reference_number,
+				transaction.deposit,
+				transaction.date,
+				self.tolerance,
+			)
+			return (repayment, None) if repayment else (None, SKIP_NO_MATCH)
+
+		key = get_match_key(
+			transaction.reference_number, transaction.date, transaction.deposit, bank_account.account
+		)
+		candidates = self.candidates.get(key, [])
+		while candidates and candidates[0].name in self.taken:
+			candidates.pop(0)
+		if not candidates:
+			return None, SKIP_NO_MATCH
+
+		repayment = candidates.pop(0)
+		repayment.match_score = 1.0
+		self.taken.add(repayment.name)
+		return repayment, None
+
+	def match_groups(self, transactions):
+		"""
+		(transaction, repayments) for each transaction that pays for a group of two or more
+		repayments, which no later match gets. Needs group matching on.
+		"""
+		for transaction in transactions:
+			bank_account = self.bank_accounts.get(transaction.bank_account)
+			if not bank_account or not transaction.date:
+				continue
+
+			repayments = self.group_index.take_group(
+				bank_account.account,
+				transaction.reference_number,
+				transaction.party_type,
+				transaction.party,
+				transaction.deposit,
+				transaction.date,
+				self.tolerance,
+			)
+			if repayments:
+				yield transaction, repayments
+
+	def match_splits(self, transactions):
+		"""
+		(repayment, transactions) for each repayment deposited in parts: two or more of the
+		transactions with its reference, within the date window of it, summing to it. Each
+		transaction and repayment is matched once. Needs group matching on. Only the parts
+		among `transactions` are found, a page of them when called by the reconciliation.
+		"""
+		tolerance = self.tolerance
+		groups = {}
+		for transaction in transactions:
+			bank_account = self.bank_accounts.get(transaction.bank_account)
+			reference = normalize_reference(transaction.reference_number, tolerance.normalize_references)
+			if bank_account and transaction.date and reference:
+				groups.setdefault((bank_account.account, reference), []).append(transaction)
+
+		for (account, reference), deposits in groups.items():
+			if len(deposits) < 2:
+				continue
+
+			dates = [getdate(t.date) for t in deposits]
+			candidates = list(
+				self.group_index.find(
+					account,
+					0,
+					sum(flt(t.deposit) for t in deposits) + tolerance.amount_tolerance,
+					add_days(min(dates), -tolerance.date_window),
+					add_days(max(dates), tolerance.date_window),
+				)
+			)
+			candidates.sort(key=lambda r: (getdate(r.posting_date), r.name))
+
+			for repayment in candidates:
+				if (
+					normalize_reference(repayment.reference_number, tolerance.normalize_references)
+					!= reference
+				):
+					continue
+
+				parts = [
+					t
+					for t in deposits
+					if abs(date_diff(t.date, repayment.posting_date)) <= tolerance.date_window
+				]
+				chosen = find_subset_sum(
+					[t.deposit for t in parts[:GROUP_CANDIDATE_LIMIT]],
+					repayment.amount_paid,
+					tolerance.amount_tolerance,
+					tolerance.max_group_size,
+				)
+				if not chosen:
+					continue
+
+				parts = [parts[i] for i in chosen]
+				self.taken.add(repayment.name)
+				matched = {t.name for t in parts}
+				deposits = [t for t in deposits if t.name not in matched]
+				yield repayment, parts
+
+				if len(deposits) < 2:
+					break
+
+
+class CandidateIndex:
+	"""
+	Candidate repayments sorted by (account, amount, date): per account the sorted distinct
+	amounts, and per account and amount the sorted (date, name) pairs
+	"""
+
+	def __init__(self, repayments, taken=None):
+		self.repayments = {}
+		self.amounts = {}
+		self.dates = {}
+		for repayment in repayments:
+			account, amount = repayment.payment_account, flt(repayment.amount_paid)
+			self.repayments[repayment.name] = repayment
+			self.dates.setdefault((account, amount), []).append(
+				(getdate(repayment.posting_date), repayment.name)
+			)
+
+		for account, amount in self.dates:
+			self.amounts.setdefault(account, []).append(amount)
+		for values in (*self.amounts.values(), *self.dates.values()):
+			values.sort()
+
+		self.taken = set() if taken is None else taken
+
+	def find(self, account, min_amount, max_amount, from_date, to_date):
+		"""Untaken repayments of `account` within the amounts and dates"""
+		amounts = self.amounts.get(account, [])
+		first = bisect.bisect_left(amounts, flt(min_amount) - AMOUNT_EPSILON)
+		last = bisect.bisect_right(amounts, flt(max_amount) + AMOUNT_EPSILON)
+
+		window_start, window_end = getdate(from_date), getdate(to_date)
+		for candidate_amount in amounts[first:last]:
+			dates = self.dates[(account, candidate_amount)]
+			start = bisect.bisect_left(dates, (window_start, ""))
+			for candidate_date, name in dates[start:]:
+				if candidate_date > window_end:
+					break
+				if name not in self.taken:
+					yield self.repayments[name]
+
+	def take_best(self, account, reference_number, amount, date, tolerance):
+		"""The best scored matching repayment, which is then no longer a candidate"""
+		if not date:
+			return None
+
+		reference = normalize_reference(reference_number, tolerance.normalize_references)
+		best = None
+		for repayment in self.find(
+			account,
+			flt(amount) - tolerance.amount_tolerance,
+			flt(amount) + tolerance.amount_tolerance,
+			add_days(date, -tolerance.date_window),
+			add_days(date, tolerance.date_window),
+		):
+			if normalize_reference(repayment.reference_number, tolerance.normalize_references) != reference:
+				continue
+
+			score = score_candidate(amount, date, repayment, tolerance)
+			rank = (-score, getdate(repayment.posting_date), repayment.name)
+			if best is None or rank < best[0]:
+				best = (rank, repayment)
+
+		if not best:
+			return None
+
+		repayment = best[1]
+		repayment.match_score = -best[0][0]
+		self.taken.add(repayment.name)
+		return repayment
+
+	def take_group(self, account, reference_number, party_type, party, amount, date, tolerance):
+		"""
+		Two or more repayments of one collection that together make up `amount`, which are
+		then no longer candidates: of those within the date window whose reference starts
+		with `reference_number` or paid by the party, the nearest in date are searched
+		"""
+		if not date:
+			return None
+
+		reference = normalize_reference(reference_number, tolerance.normalize_references)
+		date = getdate(date)
+		related = [
+			repayment
+			for repayment in self.find(
+				account,
+				0,
+				flt(amount) + tolerance.amount_tolerance,
+				add_days(date, -tolerance.date_window),
+				add_days(date, tolerance.date_window),
+			)
+			if (
+				reference
+				and normalize_reference(
+					repayment.reference_number, tolerance.normalize_references
+				).startswith(reference)
+			)
+			or (party and repayment.applicant_type == party_type and repayment.applicant == party)
+		]
+		if len(related) < 2:
+			return None
+
+		related.sort(key=lambda r: (abs(date_diff(r.posting_date, date)), getdate(r.posting_date), r.name))
+		related = related[:GROUP_CANDIDATE_LIMIT]
+		chosen = find_subset_sum(
+			[r.amount_paid for r in related], amount, tolerance.amount_tolerance, tolerance.max_group_size
+		)
+		if not chosen:
+			return None
+
+		group = sorted((related[i] for i in chosen), key=lambda r: (getdate(r.posting_date), r.name))
+		for repayment in group:
+			repayment.match_score = score_candidate(repayment.amount_paid, date, repayment, tolerance)
+			self.taken.add(repayment.name)
+		return group
+
+
+def find_subset_sum(
+	amounts, target, tolerance=0, max_size=DEFAULT_MAX_GROUP_SIZE, max_steps=SUBSET_SEARCH_STEPS
+):
+	"""
+	Indexes of two to `max_size` of the amounts summing to `target` within the tolerance, or
+	None when there are none or the search ran out of steps. Amounts are compared in cents.
+
+	Depth first over the amounts largest first, pruning a branch once what is left cannot
+	reach the target (too little in the remaining amounts, or in `max_size` of the largest)
+	and skipping amounts equal to one already tried at the same depth.
+	"""
+	cents = [round(flt(amount) * 100) for amount in amounts]
+	target, tolerance = round(flt(target) * 100), round(flt(tolerance) * 100)
+	order = sorted((i for i, value in enumerate(cents) if value > 0), key=lambda i: -cents[i])
+	values = [cents[i] for i in order]
+
+	# suffix[i]: the sum of values[i:]
+	suffix = [0] * (len(values) + 1)
+	for i in range(len(values) - 1, -1, -1):
+		suffix[i] = suffix[i + 1] + values[i]
+
+	chosen = []
+	steps = 0
+
+	def search(start, remaining):
+		nonlocal steps
+		if abs(remaining) <= tolerance and len(chosen) >= 2:
+			return True
+		if len(chosen) >= max_size:
+			return False
+
+		slots = max_size - len(chosen)
+		for i in range(start, len(values)):
+			steps += 1
+			if steps > max_steps:
+				return False
+			if suffix[i] < remaining - tolerance or values[i] * slots < remaining - tolerance:
+				return False
+			if values[i] > remaining + tolerance or (i > start and values[i] == values[i - 1]):
+				continue
+
+			chosen.append(i)
+			if search(i + 1, remaining - values[i]):
+				return True
+			chosen.pop()
+
+		return False
+
+	if len(values) < 2 or not search(0, target):
+		return None
+
+	return sorted(order[i] for i in chosen)
+
+
+def get_match_tolerance(
+	date_window=None,
+	amount_tolerance=None,
+	normalize_references=None,
+	group_matching=None,
+	max_group_size=None,
+):
+	"""Matching tolerances and group matching, from the site config unless given"""
+	if date_window is None:
+		date_window = frappe.conf.get(DATE_WINDOW_KEY)
+	if amount_tolerance is None:
+		amount_tolerance = frappe.conf.get(AMOUNT_TOLERANCE_KEY)
+	if normalize_references is None:
+		normalize_references = frappe.conf.get(NORMALIZE_REFERENCES_KEY)
+	if group_matching is None:
+		group_matching = frappe.conf.get(GROUP_MATCHING_KEY)
+	if max_group_size is None:
+		max_group_size = frappe.conf.get(MAX_GROUP_SIZE_KEY)
+
+	tolerance = frappe._dict(
+		{
+			"date_window": max(cint(date_window), 0),
+			"amount_tolerance": max(flt(amount_tolerance), 0.0),
+			"normalize_references": bool(cint(normalize_references)),
+			"group_matching": bool(cint(group_matching)),
+			"max_group_size": max(cint(max_group_size) or DEFAULT_MAX_GROUP_SIZE, 2),
+		}
+	)
+	tolerance.exact = not (
+		tolerance.date_window or tolerance.amount_tolerance or tolerance.normalize_references
+	)
+	return tolerance
+
+
+def normalize_reference(reference_number, normalize=True):
+	"""Reference without case, separators and leading zeros, e.g. 'mp-00123 45' -> 'MP0012345'"""
+	if not normalize or not reference_number:
+		return reference_number or ""
+
+	return re.sub(r"[^0-9A-Z]", "", str(reference_number).upper()).lstrip("0")
+
+
+def score_candidate(amount, date, repayment, tolerance):
+	"""1 for an exact match, lower the further the date and amount are from the transaction's"""
+	date_penalty = abs(date_diff(repayment.posting_date, date)) / (tolerance.date_window + 1)
+	amount_penalty = (
+		abs(flt(repayment.amount_paid) - flt(amount)) / tolerance.amount_tolerance
+		if tolerance.amount_tolerance
+		else 0
+	)
+	return round(1 - (min(date_penalty, 1) + min(amount_penalty, 1)) / 2, 4)
+
+
+def get_match_key(reference_number, date, amount, account):
+	return (reference_number, getdate(date) if date else None, flt(amount), account)
+
+
+def get_window_repayments(accounts, transactions, tolerance):
+	"""Candidate repayments within the date window of any of the transactions"""
+	dates = [getdate(t.date) for t in transactions if t.date]
+	if not dates:
+		return []
+
+	return get_candidate_repayments(
+		accounts,
+		from_date=add_days(min(dates), -tolerance.date_window),
+		to_date=add_days(max(dates), tolerance.date_window),
+	)
+
+
+def get_bank_account_details(bank_accounts):
+	"""GL account and company of each Bank Account, in one query"""
+	if not bank_accounts:
+		return {}
+
+	return {
+		row.name: row
+		for row in frappe.get_all(
+			"Bank Account",
+			filters={"name": ("in", list(bank_accounts))},
+			fields=["name", "account", "company"],
+		)
+		if row.account
+	}
+
+
+def get_amount_difference(amount, repayments):
+	"""What `amount` exceeds the repayments' amounts paid by, 0 within float noise"""
+	difference = flt(amount) - sum(flt(repayment.amount_paid) for repayment in repayments)
+	return 0.0 if abs(difference) <= AMOUNT_EPSILON else difference
+
+
+def get_allocated_repayments_query():
+	"""Loan Repayments allocated to a submitted Bank Transaction, in whole or in part"""
+	btp = frappe.qb.DocType("Bank Transaction Payments")
+	bt = frappe.qb.DocType("Bank Transaction")
+	return (
+		frappe.qb.from_(btp)
+		.join(bt)
+		.on(bt.name == btp.parent)
+		.select(btp.payment_entry)
+		.where(btp.payment_document == "Loan Repayment")
+		.where(bt.docstatus == 1)
+	)
+
+
+def get_candidate_repayments(payment_accounts, reference_numbers=None, from_date=None, to_date=None):
+	"""
+	Unreconciled Loan Repayments paid into one of the accounts, with one of the reference
+	numbers and within the dates when given. Repayments partly allocated to a Bank
+	Transaction keep a NULL clearance date, so those are left out too.
+	"""
+	if not payment_accounts or (reference_numbers is not None and not reference_numbers):
+		return []
+
+	lr = frappe.qb.DocType("Loan Repayment")
+	query = (
+		frappe.qb.from_(lr)
+		.select(
+			lr.name,
+			lr.amount_paid,
+			lr.reference_number,
+			lr.posting_date,
+			lr.applicant_type,
+			lr.applicant,
+			lr.against_loan,
+			lr.payment_account,
+		)
+		.where(lr.docstatus == 1)
+		.where(lr.clearance_date.isnull())
+		.where(lr.payment_account.isin(list(payment_accounts)))
+		.where(lr.name.notin(get_allocated_repayments_query()))
+		# the oldest of several identical repayments is matched first
+		.orderby(lr.posting_date)
+		.orderby(lr.name)
+	)
+
+	if reference_numbers is not None:
+		query = query.where(lr.reference_number.isin(list(reference_numbers)))
+	if from_date:
+		query = query.where(lr.posting_date >= getdate(from_date))
+	if to_date:
+		query = query.where(lr.posting_date <= getdate(to_date))
+
+	if frappe.db.has_column("Loan Repayment", "repay_from_salary"):
+		query = query.where(lr.repay_from_salary == 0)
+
+	return query.run(as_dict=True)
@@ -0,0 +1,399 @@
+"""
+Repayment schedule engine
+
+Computes all columns of a Loan Repayment Schedule (payment date, interest, principal,
+total payment, balance and days) for a whole tenor in one pass over NumPy arrays.
+Nothing in here touches the database: callers resolve the loan and loan product
+settings once and pass them in, and LoanRepaymentScheduleOverride turns the
+returned columns into `repayment_schedule` child rows.
+"""
+
+from functools import lru_cache
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import add_days, add_months, cint, date_diff, flt, get_last_day, getdate
+from lending.loan_management.doctype.loan_repayment_schedule.loan_repayment_schedule import add_single_month
+
+# Number of distinct payment calendars memoized per worker
+CALENDAR_CACHE_SIZE = 1024
+
+# Upper bound on the number of rows a "Monthly Prorated" schedule may grow to while
+# searching for the period in which the balance is cleared
+MAX_SCHEDULE_PERIODS = 100000
+
+# Schedule types whose Monthly Prorated calendar and day counts the engine reproduces
+PRORATED_SCHEDULE_TYPES = (
+	"Monthly as per repayment start date",
+	"Monthly as per cycle date",
+	"Pro-rated calendar months",
+)
+
+SCHEDULE_FIELDS = (
+	"payment_date",
+	"principal_amount",
+	"interest_amount",
+	"total_payment",
+	"balance_loan_amount",
+	"number_of_days",
+)
+
+
+def _make_schedule(payment_dates, principal, interest, total, balance, days):
+	return frappe._dict(
+		{
+			"payment_date": list(payment_dates),
+			"principal_amount": principal,
+			"interest_amount": interest,
+			"total_payment": total,
+			"balance_loan_amount": balance,
+			"number_of_days": days,
+		}
+	)
+
+
+def iter_schedule_rows(schedule):
+	"""
+	Yield (payment_date, principal, interest, total_payment, balance, days) tuples as
+	plain Python values, in the argument order of `add_repayment_schedule_row`
+	"""
+	yield from zip(
+		schedule.payment_date,
+		schedule.principal_amount.tolist(),
+		schedule.interest_amount.tolist(),
+		schedule.total_payment.tolist(),
+		schedule.balance_loan_amount.tolist(),
+		schedule.number_of_days.tolist(),
+		strict=True,
+	)
+
+
+def get_changed_row_indexes(rows, schedule):
+	"""
+	Indexes of the existing schedule `rows` whose stored values differ from `schedule`.
+	Only rows present in both are compared; amounts are compared at the 9 decimal places
+	currency columns are stored with.
+	"""
+	count = min(len(rows), len(schedule.payment_date))
+	if not count:
+		return np.zeros(0, dtype=np.int64)
+
+	rows = rows[:count]
+	changed = np.fromiter(
+		(
+			getdate(row.payment_date) != payment_date
+			for row, payment_date in zip(rows, schedule.payment_date, strict=False)
+		),
+		dtype=bool,
+		count=count,
+	)
+	for fieldname in SCHEDULE_FIELDS[1:]:
+		stored = np.fromiter((flt(row.get(fieldname)) for row in rows), dtype=float, count=count)
+		changed |= np.round(stored, 9) != np.round(schedule[fieldname][:count], 9)
+
+	return np.flatnonzero(changed)
+
+
+def get_next_payment_date(payment_date, repayment_schedule_type, repayment_date_on):
+	"""Payment date of the period following `payment_date` on a One-time Percentage schedule"""
+	if repayment_schedule_type == "Pro-rated calendar months":
+		next_payment_date = get_last_day(payment_date)
+		if repayment_date_on == "Start of the next month":
+			next_payment_date = add_days(next_payment_date, 1)
+		return next_payment_date
+
+	return add_single_month(payment_date)
+
+
+def get_one_time_payment_dates(repayment_start_date, periods, repayment_schedule_type, repayment_date_on):
+	"""Payment dates of a One-time Percentage schedule, starting at `repayment_start_date` (memoized)"""
+	return _get_one_time_calendar(
+		getdate(repayment_start_date), cint(periods), repayment_schedule_type, repayment_date_on
+	)
+
+
+def get_prorated_payment_dates(repayment_start_date, periods, repayment_schedule_type, repayment_date_on):
+	"""
+	Period dates of a Monthly Prorated schedule, following the calendar of
+	lending's LoanRepaymentSchedule.make_repayment_schedule
+
+	Returns (interest_dates, payment_dates): the date each period's interest is computed
+	for and the date stored on the schedule row.
+	"""
+	interest_dates, payment_dates, _days = _get_prorated_calendar(
+		getdate(repayment_start_date), cint(periods), repayment_schedule_type, repayment_date_on
+	)
+	return interest_dates, payment_dates
+
+
+def get_prorated_day_counts(
+	repayment_start_date,
+	periods,
+	repayment_schedule_type,
+	repayment_date_on,
+	posting_date=None,
+	broken_period_interest_days=0,
+):
+	"""
+	Interest days and year divisor of every period, as in lending's
+	LoanRepaymentSchedule.get_amounts. The broken period only affects the first period.
+	"""
+	_interest_dates, _payment_dates, days = _get_prorated_calendar(
+		getdate(repayment_start_date), cint(periods), repayment_schedule_type, repayment_date_on
+	)
+	days = np.array(days, dtype=np.int64)
+
+	if repayment_schedule_type == "Monthly as per repayment start date":
+		return days, np.full(len(days), 12.0)
+
+	if len(days) and repayment_schedule_type == "Monthly as per cycle date":
+		if broken_period_interest_days < 0:
+			days[0] = date_diff(repayment_start_date, posting_date)
+		elif broken_period_interest_days:
+			days[0] += broken_period_interest_days
+
+	return days, np.full(len(days), 365.0)
+
+
+def clear_payment_calendar_cache():
+	"""Drop all memoized payment calendars"""
+	_get_one_time_calendar.cache_clear()
+	_get_prorated_calendar.cache_clear()
+
+
+# Calendars only depend on (start date, schedule type, repayment date on, periods), so
+# rescheduling many loans that share a start date computes each calendar once per worker
+
+
+@lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _get_one_time_calendar(repayment_start_date, periods, repayment_schedule_type, repayment_date_on):
+	payment_dates = []
+	payment_date = repayment_start_date
+	for _period in range(periods):
+		payment_dates.append(payment_date)
+		payment_date = get_next_payment_date(payment_date, repayment_schedule_type, repayment_date_on)
+
+	return tuple(payment_dates)
+
+
+@lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _get_prorated_calendar(repayment_start_date, periods, repayment_schedule_type, repayment_date_on):
+	interest_dates = []
+	payment_dates = []
+	days = []
+	payment_date = repayment_start_date
+	for _period in range(periods):
+		interest_dates.append(payment_date)
+		days.append(_get_prorated_days(payment_date, repayment_schedule_type, repayment_date_on))
+
+		if repayment_schedule_type == "Pro-rated calendar months":
+			next_payment_date = get_last_day(payment_date)
+			if repayment_date_on == "Start of the next month":
+				next_payment_date = add_days(next_payment_date, 1)
+			payment_date = next_payment_date
+
+		payment_dates.append(payment_date)
+
+		if (
+			repayment_schedule_type in ("Monthly as per repayment start date", "Monthly as per cycle date")
+			or repayment_date_on == "End of the current month"
+		):
+			payment_date = add_single_month(payment_date)
+
+	return tuple(interest_dates), tuple(payment_dates), tuple(days)
+
+
+def _get_prorated_days(payment_date, repayment_schedule_type, repayment_date_on):
+	if repayment_schedule_type == "Monthly as per repayment start date":
+		return 1
+
+	expected_payment_date = get_last_day(payment_date)
+	if repayment_date_on == "Start of the next month":
+		expected_payment_date = add_days(expected_payment_date, 1)
+
+	if repayment_schedule_type == "Monthly as per cycle date":
+		return date_diff(payment_date, add_months(payment_date, -1))
+	elif expected_payment_date == payment_date:
+		# using 30 days for calculating interest for all full months
+		return 30
+
+	return date_diff(get_last_day(payment_date), payment_date)
+
+
+def build_one_time_schedule(
+	loan_amount,
+	rate_of_interest,
+	repayment_periods,
+	monthly_repayment_amount,
+	repayment_start_date,
+	repayment_schedule_type,
+	repayment_date_on,
+):
+	"""
+	One-time Percentage schedule with exactly `repayment_periods` rows: interest is spread
+	evenly over the tenor and the last row settles whatever principal is left
+	"""
+	periods = cint(repayment_periods)
+	total_interest = flt(loan_amount) * (flt(rate_of_interest) / 100)
+	interest_per_period = total_interest / periods
+	principal_per_period = flt(monthly_repayment_amount) - interest_per_period
+
+	principal = np.full(periods, principal_per_period)
+	# np.subtract.accumulate subtracts left to right, so the opening balances are bit for bit
+	# the ones a period by period loop would produce
+	opening_balance = np.subtract.accumulate(np.concatenate(([flt(loan_amount)], principal[:-1])))
+	principal[-1] = opening_balance[-1]
+	balance = opening_balance - principal
+
+	interest = np.full(periods, interest_per_period)
+	payment_dates = get_one_time_payment_dates(
+		repayment_start_date, periods, repayment_schedule_type, repayment_date_on
+	)
+
+	return _make_schedule(
+		payment_dates,
+		principal,
+		interest,
+		principal + interest,
+		balance,
+		np.full(periods, 30, dtype=np.int64),
+	)
+
+
+def build_one_time_amortized_schedule(
+	loan_amount,
+	rate_of_interest,
+	repayment_periods,
+	monthly_repayment_amount,
+	repayment_start_date,
+	repayment_schedule_type,
+	repayment_date_on,
+):
+	"""
+	One-time Percentage schedule that stops once the balance is cleared and pads the
+	remaining periods with zero rows. Each row is dated at the end of its period.
+	"""
+	periods = cint(repayment_periods)
+	total_interest = flt(loan_amount) * (flt(rate_of_interest) / 100)
+	interest_per_period = total_interest / periods
+	principal_per_period = flt(monthly_repayment_amount) - interest_per_period
+
+	closing_balance = np.subtract.accumulate(
+		np.concatenate(([flt(loan_amount)], np.full(periods, principal_per_period)))
+	)[1:]
+
+	# a period is only scheduled while the balance carried into it is still positive
+	opening_balance = np.concatenate(([flt(loan_amount)], closing_balance[:-1]))
+	cleared = np.flatnonzero(opening_balance <= 0)
+	scheduled = int(cleared[0]) if cleared.size else periods
+
+	principal = np.zeros(periods)
+	interest = np.zeros(periods)
+	balance = np.zeros(periods)
+
+	principal[:scheduled] = principal_per_period
+	interest[:scheduled] = interest_per_period
+	balance[:scheduled] = closing_balance[:scheduled]
+
+	# the period that clears the loan only collects what is left of the balance
+	if scheduled and balance[scheduled - 1] < 0:
+		principal[scheduled - 1] += balance[scheduled - 1]
+		balance[scheduled - 1] = 0.0
+
+	# rows are dated at the end of their period; padding rows keep moving a month ahead except
+	# on pro-rated calendars, where they repeat the date of the last scheduled row
+	calendar = get_one_time_payment_dates(
+		repayment_start_date, periods + 1, repayment_schedule_type, repayment_date_on
+	)
+	if repayment_schedule_type == "Pro-rated calendar months":
+		payment_dates = calendar[1 : scheduled + 1] + (calendar[scheduled],) * (periods - scheduled)
+	else:
+		payment_dates = calendar[1:]
+
+	return _make_schedule(
+		payment_dates,
+		principal,
+		interest,
+		principal + interest,
+		balance,
+		np.full(periods, 30, dtype=np.int64),
+	)
+
+
+def build_prorated_schedule(
+	loan_amount,
+	rate_of_interest,
+	monthly_repayment_amount,
+	repayment_start_date,
+	repayment_schedule_type,
+	repayment_date_on,
+	posting_date=None,
+	adjusted_interest=0,
+	repayment_periods=None,
+):
+	"""
+	Monthly Prorated (reducing balance) schedule running until the balance is cleared.
+
+	The balance recurrence b[k+1] = b[k] * (1 + f[k]) - M is solved in closed form,
+	b[k] = g[k] * (L - M * sum(1 / g[1..k])) with g the running product of (1 + f), so
+	every column comes out of a few cumulative array operations instead of a loop.
+	"""
+	loan_amount = flt(loan_amount)
+	rate_of_interest = flt(rate_of_interest)
+	monthly_repayment_amount = flt(monthly_repayment_amount)
+
+	if loan_amount <= 0:
+		empty = np.zeros(0)
+		return _make_schedule([], empty, empty, empty, empty, np.zeros(0, dtype=np.int64))
+
+	broken_period_interest_days = 0
+	if posting_date:
+		broken_period_interest_days = date_diff(add_months(repayment_start_date, -1), posting_date)
+
+	horizon = max(cint(repayment_periods) + 1, 12)
+	while True:
+		_interest_dates, payment_dates = get_prorated_payment_dates(
+			repayment_start_date, horizon, repayment_schedule_type, repayment_date_on
+		)
+		days, divisor = get_prorated_day_counts(
+			repayment_start_date,
+			horizon,
+			repayment_schedule_type,
+			repayment_date_on,
+			posting_date=posting_date,
+			broken_period_interest_days=broken_period_interest_days,
+		)
+		factor = rate_of_interest * days / (divisor * 100)
+		growth = np.cumprod(1 + factor)
+		closing_balance = growth * (loan_amount - monthly_repayment_amount * np.cumsum(1 / growth))
+
+		cleared = np.flatnonzero(closing_balance <= 0)
+		if cleared.size:
+			periods = int(cleared[0]) + 1
+			break
+
+		# the balance has not come down over the last year of periods, it never will
+		if horizon >= MAX_SCHEDULE_PERIODS or (horizon > 12 and closing_balance[-1] >= closing_balance[-13]):
+			frappe.throw(
+				_("Monthly Repayment Amount {0} does not repay the loan amount {1}").format(
+					frappe.bold(monthly_repayment_amount), frappe.bold(loan_amount)
+				)
+			)
+
+		horizon = min(horizon * 2, MAX_SCHEDULE_PERIODS)
+
+	opening_balance = np.concatenate(([loan_amount], closing_balance[: periods - 1]))
+	interest = opening_balance * factor[:periods]
+	principal = monthly_repayment_amount - interest
+	balance = closing_balance[:periods].copy()
+
+	principal[-1] += balance[-1]
+	balance[-1] = 0.0
+
+	total = principal + interest
+	if adjusted_interest:
+		interest[0] += adjusted_interest
+		total[0] += adjusted_interest
+
+	return _make_schedule(payment_dates[:periods], principal, interest, total, balance, days[:periods])
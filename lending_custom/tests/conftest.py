@@ -0,0 +1,33 @@
+"""
+The tests run without a bench: the stand-in frappe and lending of the benchmarks are
+installed before any module under test is imported.
+"""
+
+import pytest
+
+from lending_custom.benchmarks import standin
+
+standin.install()
+
+# interest day count convention of every company, None falls back to Actual/Actual
+COMPANY_CONVENTIONS = {
+	"Actual 365 - C": "Actual/365",
+	"30 365 - C": "30/365",
+	"30 360 - C": "30/360",
+	"Actual 360 - C": "Actual/360",
+	"Actual Actual - C": "Actual/Actual",
+	"No Convention - C": None,
+}
+
+
+@pytest.fixture
+def companies(monkeypatch):
+	"""Companies of COMPANY_CONVENTIONS in the stand-in database"""
+	import frappe
+
+	for company, convention in COMPANY_CONVENTIONS.items():
+		monkeypatch.setitem(
+			frappe.db.values, ("Company", company), {"interest_day_count_convention": convention}
+		)
+
+	return list(COMPANY_CONVENTIONS)
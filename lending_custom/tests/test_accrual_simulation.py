@@ -0,0 +1,68 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from lending_custom import accrual_simulation
+from lending_custom.benchmarks.standin import _dict
+from lending_custom.interest_calculations import get_per_day_interest_custom
+
+# the window crosses 29 February of a leap year
+DATES = np.arange(np.datetime64("2024-02-26"), np.datetime64("2024-03-04"))
+
+
+@pytest.fixture
+def loans(monkeypatch, companies):
+	"""Demand loans of every company and interest calculation method, accrued up to the window"""
+	methods = ("Monthly Prorated", "One-time Percentage", None)
+	loans = [
+		_dict(
+			{
+				"name": f"LN-{i}",
+				"company": company,
+				"rate_of_interest": 9 + i,
+				"interest_calculation_method": methods[i % len(methods)],
+				"disbursement_date": datetime.date(2023, 1, 1),
+				"pending_principal_amount": 100000 + 2500 * i,
+			}
+		)
+		for i, company in enumerate(companies * 2)
+	]
+
+	monkeypatch.setattr(
+		accrual_simulation, "get_last_accrual_dates", lambda names, date: dict.fromkeys(names, date)
+	)
+	monkeypatch.setattr(accrual_simulation, "get_accrued_dates", lambda *args: {})
+	monkeypatch.setattr(accrual_simulation, "get_disbursement_dates", lambda *args: {})
+	monkeypatch.setattr(
+		accrual_simulation, "get_pending_principal", lambda loan: loan.pending_principal_amount
+	)
+	return loans
+
+
+def test_demand_loan_interest_matches_the_per_loan_function(loans):
+	expected = [
+		[
+			get_per_day_interest_custom(
+				loan.pending_principal_amount,
+				loan.rate_of_interest,
+				loan.company,
+				posting_date=date.item(),
+				interest_calculation_method=loan.interest_calculation_method or "Monthly Prorated",
+			)
+			for date in DATES
+		]
+		for loan in loans
+	]
+
+	interest = accrual_simulation.get_demand_loan_interest(loans, DATES)
+
+	assert interest == pytest.approx(np.array(expected), abs=1e-9)
+
+
+def test_one_time_percentage_loans_project_no_interest(loans):
+	interest = accrual_simulation.get_demand_loan_interest(loans, DATES)
+
+	one_time = [loan.interest_calculation_method == "One-time Percentage" for loan in loans]
+	assert not interest[one_time].any()
+	assert interest[[not row for row in one_time]].all()
@@ -0,0 +1,127 @@
+import datetime
+import random
+
+import pytest
+
+from lending_custom import accrual_writer, historical_accrual
+from lending_custom.benchmarks.standin import _dict, add_days
+
+START = datetime.date(2024, 1, 1)
+
+
+class Ledger:
+	"""Submitted accruals and disbursements, queried as the writer's grouped queries read them"""
+
+	def __init__(self, accruals, disbursements):
+		self.accruals = list(accruals)
+		self.disbursements = disbursements
+
+	def get_last_accrual_dates(self, loans, posting_date):
+		last_accrual_dates = {}
+		for accrual in self.accruals:
+			if accrual.loan in loans and (
+				accrual.posting_date <= posting_date or accrual.last_accrual_date <= posting_date
+			):
+				last_accrual_dates[accrual.loan] = max(
+					accrual.posting_date, last_accrual_dates.get(accrual.loan, accrual.posting_date)
+				)
+
+		return last_accrual_dates
+
+	def get_last_disbursement_dates(self, loans, posting_date):
+		return {
+			loan: max(earlier)
+			for loan in loans
+			if (earlier := [date for date in self.disbursements.get(loan, ()) if date < posting_date])
+		}
+
+	def post(self, doc, loans):
+		"""LoanInterestAccrual.validate with the patched get_last_accrual_date, then the submit"""
+		if not doc.last_accrual_date:
+			last_accrual_date = self.get_last_accrual_dates([doc.loan], doc.posting_date).get(doc.loan)
+			if last_accrual_date:
+				doc.last_accrual_date = historical_accrual.get_date_after_last_accrual(
+					last_accrual_date,
+					self.get_last_disbursement_dates([doc.loan], doc.posting_date).get(doc.loan),
+				)
+			else:
+				doc.last_accrual_date = loans[doc.loan].disbursement_date
+
+		self.accruals.append(doc)
+
+
+def make_book(seed):
+	rng = random.Random(seed)
+	loans = {
+		f"LN-{i}": _dict({"name": f"LN-{i}", "disbursement_date": add_days(START, rng.randint(0, 5))})
+		for i in range(4)
+	}
+	disbursements = {
+		name: sorted(
+			[loan.disbursement_date]
+			+ [add_days(loan.disbursement_date, rng.randint(1, 40)) for _ in range(rng.randint(0, 2))]
+		)
+		for name, loan in loans.items()
+	}
+
+	posted = []
+	for name, loan in loans.items():
+		for _ in range(rng.randint(0, 2)):
+			posting_date = add_days(loan.disbursement_date, rng.randint(1, 10))
+			posted.append(
+				_dict(
+					{
+						"loan": name,
+						"posting_date": posting_date,
+						"last_accrual_date": add_days(posting_date, -rng.randint(0, 3)),
+					}
+				)
+			)
+
+	batch = []
+	for _ in range(30):
+		loan = rng.choice(list(loans))
+		posting_date = add_days(loans[loan].disbursement_date, rng.randint(0, 45))
+		# a compacted accrual comes with the date it accrues from
+		last_accrual_date = add_days(posting_date, -rng.randint(0, 10)) if rng.random() < 0.2 else None
+		batch.append(
+			_dict({"loan": loan, "posting_date": posting_date, "last_accrual_date": last_accrual_date})
+		)
+		if rng.random() < 0.3:
+			# a second accrual of the same loan and date
+			batch.append(_dict({"loan": loan, "posting_date": posting_date, "last_accrual_date": None}))
+
+	return loans, disbursements, posted, batch
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_last_accrual_dates_match_sequential_posting(monkeypatch, seed):
+	loans, disbursements, posted, batch = make_book(seed)
+
+	sequential = Ledger(posted, disbursements)
+	expected = [_dict(doc) for doc in batch]
+	for doc in expected:
+		sequential.post(doc, loans)
+
+	ledger = Ledger(posted, disbursements)
+	monkeypatch.setattr(historical_accrual, "get_last_accrual_dates", ledger.get_last_accrual_dates)
+	monkeypatch.setattr(historical_accrual, "get_last_disbursement_dates", ledger.get_last_disbursement_dates)
+	docs = [_dict(doc) for doc in batch]
+	accrual_writer.set_last_accrual_dates(docs, loans)
+
+	assert [doc.last_accrual_date for doc in docs] == [doc.last_accrual_date for doc in expected]
+
+
+def test_same_loan_and_date_counts_the_earlier_row(monkeypatch):
+	loans = {"LN-1": _dict({"name": "LN-1", "disbursement_date": START})}
+	ledger = Ledger([], {"LN-1": [START]})
+	monkeypatch.setattr(historical_accrual, "get_last_accrual_dates", ledger.get_last_accrual_dates)
+	monkeypatch.setattr(historical_accrual, "get_last_disbursement_dates", ledger.get_last_disbursement_dates)
+
+	posting_date = add_days(START, 3)
+	docs = [
+		_dict({"loan": "LN-1", "posting_date": posting_date, "last_accrual_date": None}) for _ in range(2)
+	]
+	accrual_writer.set_last_accrual_dates(docs, loans)
+
+	assert [doc.last_accrual_date for doc in docs] == [START, add_days(posting_date, 1)]
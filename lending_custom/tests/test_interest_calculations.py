@@ -0,0 +1,145 @@
+import datetime
+import random
+
+import pytest
+
+from lending_custom.benchmarks.standin import ValidationError, _dict, flt
+from lending_custom.interest_calculations import (
+	calculate_payable_amounts,
+	get_per_day_interest_bulk,
+	get_per_day_interest_custom,
+	get_total_payable_interest,
+)
+
+
+def loop_total_payable_interest(loan_amount, rate_of_interest, repayment_amount):
+	"""The month by month walk of calculate_payable_amount_custom the closed form replaced"""
+	balance_amount = loan_amount
+	total_payable_interest = 0
+	while balance_amount > 0:
+		interest_amount = flt(balance_amount * rate_of_interest / (12 * 100))
+		balance_amount = flt(balance_amount + interest_amount - repayment_amount)
+		if balance_amount < 0:
+			interest_amount += balance_amount
+			balance_amount = 0
+
+		total_payable_interest += interest_amount
+
+	return total_payable_interest
+
+
+@pytest.mark.parametrize(
+	"loan_amount, rate_of_interest, repayment_amount",
+	[
+		(100000, 12, 8884.88),
+		(100000, 12, 100000),
+		(100000, 12, 200000),
+		(50000, 0, 5000),
+		(50000, 0, 3333.33),
+		(1000.1, 0, 0.1),
+		(0, 12, 1000),
+		(250000, 24, 5001),
+	],
+)
+def test_total_payable_interest_matches_the_loop(loan_amount, rate_of_interest, repayment_amount):
+	assert get_total_payable_interest(loan_amount, rate_of_interest, repayment_amount)[0] == pytest.approx(
+		loop_total_payable_interest(loan_amount, rate_of_interest, repayment_amount), abs=1e-6
+	)
+
+
+def test_total_payable_interest_matches_the_loop_for_a_book():
+	rng = random.Random(11)
+	loans = []
+	for _ in range(200):
+		loan_amount = round(rng.uniform(1000, 500000), 2)
+		rate_of_interest = rng.choice((0, 6, 9.5, 12, 18, 36))
+		minimum = loan_amount * rate_of_interest / 1200
+		loans.append((loan_amount, rate_of_interest, round(minimum + rng.uniform(1, loan_amount / 6), 2)))
+
+	interest = get_total_payable_interest(*zip(*loans, strict=True))
+	assert interest.tolist() == pytest.approx(
+		[loop_total_payable_interest(*loan) for loan in loans], abs=1e-5
+	)
+
+
+def test_repayment_not_covering_the_interest_is_refused():
+	with pytest.raises(ValidationError, match="Repayment Amount must be greater than 1000"):
+		get_total_payable_interest(100000, 12, 1000)
+
+
+def test_payable_amounts_of_a_batch():
+	docs = [
+		_dict(name="APP-1", loan_amount=100000, rate_of_interest=12, repayment_amount=8884.88),
+		_dict(
+			name="APP-2",
+			loan_amount=50000,
+			rate_of_interest=10,
+			repayment_amount=0,
+			interest_calculation_method="One-time Percentage",
+		),
+	]
+	calculate_payable_amounts(docs)
+
+	interest = loop_total_payable_interest(100000, 12, 8884.88)
+	assert docs[0].total_payable_interest == pytest.approx(interest, abs=1e-6)
+	assert docs[0].total_payable_amount == pytest.approx(100000 + interest, abs=1e-6)
+	assert docs[1].total_payable_interest == pytest.approx(5000)
+	assert docs[1].total_payable_amount == pytest.approx(55000)
+
+
+# Actual/Actual divides by 365 and 366 on either side of the leap year 2024
+POSTING_DATES = (
+	datetime.date(2023, 12, 31),
+	datetime.date(2024, 1, 1),
+	datetime.date(2024, 2, 29),
+	datetime.date(2024, 12, 31),
+	datetime.date(2025, 1, 1),
+)
+
+
+@pytest.mark.parametrize("interest_calculation_method", ["Monthly Prorated", "One-time Percentage"])
+def test_per_day_interest_bulk_matches_the_per_loan_function(companies, interest_calculation_method):
+	rng = random.Random(4)
+	loans = [
+		(rng.uniform(1000, 500000), rng.uniform(0, 36), company, posting_date)
+		for company in companies
+		for posting_date in POSTING_DATES
+	]
+	principal_amounts, rates_of_interest, loan_companies, posting_dates = zip(*loans, strict=True)
+
+	per_day_interest = get_per_day_interest_bulk(
+		principal_amounts,
+		rates_of_interest,
+		loan_companies,
+		posting_dates=posting_dates,
+		interest_calculation_methods=interest_calculation_method,
+	)
+
+	# without a convention the per loan function falls back on the company's
+	expected = [
+		get_per_day_interest_custom(*loan, interest_calculation_method=interest_calculation_method)
+		for loan in loans
+	]
+	assert per_day_interest.tolist() == pytest.approx(expected, rel=1e-12)
+
+
+def test_per_day_interest_bulk_mixes_calculation_methods(companies):
+	methods = ["Monthly Prorated", "One-time Percentage"] * 3
+
+	per_day_interest = get_per_day_interest_bulk(
+		[36500] * 6,
+		[10] * 6,
+		companies,
+		posting_dates=datetime.date(2024, 6, 1),
+		interest_calculation_methods=methods,
+	)
+
+	assert per_day_interest.tolist() == pytest.approx(
+		[
+			get_per_day_interest_custom(
+				36500, 10, company, datetime.date(2024, 6, 1), interest_calculation_method=method
+			)
+			for company, method in zip(companies, methods, strict=True)
+		]
+	)
+	assert per_day_interest.tolist()[1::2] == [0, 0, 0]
@@ -0,0 +1,141 @@
+import datetime
+import itertools
+import random
+
+import pytest
+
+from lending_custom.benchmarks.standin import _dict
+from lending_custom.repayment_matcher import CandidateIndex, find_subset_sum, get_match_tolerance
+
+
+def brute_force_subset_sum(amounts, target, tolerance=0, max_size=6):
+	"""Whether some two to max_size of the amounts sum to target within the tolerance, in cents"""
+	cents = [round(amount * 100) for amount in amounts]
+	target, tolerance = round(target * 100), round(tolerance * 100)
+	return any(
+		abs(sum(cents[i] for i in combination) - target) <= tolerance
+		for size in range(2, max_size + 1)
+		for combination in itertools.combinations(range(len(cents)), size)
+	)
+
+
+def assert_valid_subset(amounts, target, chosen, tolerance=0, max_size=6):
+	assert chosen == sorted(set(chosen))
+	assert 2 <= len(chosen) <= max_size
+	assert abs(sum(round(amounts[i] * 100) for i in chosen) - round(target * 100)) <= round(tolerance * 100)
+
+
+def test_subset_sum_agrees_with_brute_force():
+	rng = random.Random(7)
+	for _ in range(300):
+		amounts = [rng.choice((250, 500, 750, 1000, 1250.5, 333.33)) for _ in range(rng.randint(2, 9))]
+		target = rng.choice((500, 1000, 1583.83, 2250, 3000.5, 10000))
+		tolerance = rng.choice((0, 0, 1))
+		max_size = rng.randint(2, 5)
+
+		chosen = find_subset_sum(amounts, target, tolerance, max_size)
+		assert (chosen is not None) == brute_force_subset_sum(amounts, target, tolerance, max_size)
+		if chosen is not None:
+			assert_valid_subset(amounts, target, chosen, tolerance, max_size)
+
+
+def test_subset_sum_compares_in_cents():
+	# 0.1 + 0.2 is not 0.3 in floats
+	assert find_subset_sum([0.1, 0.2], 0.3) == [0, 1]
+	assert find_subset_sum([100.004, 200.006], 300.01) == [0, 1]
+	assert find_subset_sum([100.01, 200.01], 300.01) is None
+	assert find_subset_sum([100.01, 200.01], 300.01, tolerance=0.01) == [0, 1]
+
+
+def test_subset_sum_returns_original_indexes_with_duplicates():
+	amounts = [500, 200, 500, 300, 500]
+	chosen = find_subset_sum(amounts, 1500)
+	assert_valid_subset(amounts, 1500, chosen)
+	assert find_subset_sum([500, 500, 500], 1000) == [0, 1]
+	assert find_subset_sum([500] * 30, 3000, max_size=6) is not None
+	assert find_subset_sum([500] * 30, 3500, max_size=6) is None
+
+
+def test_subset_sum_needs_two_amounts_within_the_group_size():
+	assert find_subset_sum([1000], 1000) is None
+	assert find_subset_sum([1000, 0, -5], 1000) is None
+	assert find_subset_sum([100, 200, 300, 400], 1000, max_size=3) is None
+	assert find_subset_sum([100, 200, 300, 400], 1000, max_size=4) == [0, 1, 2, 3]
+
+
+def test_subset_sum_gives_up_after_the_step_limit():
+	# every sum of the amounts is a whole multiple of 2, so the odd cent target is out of reach
+	# and only the step limit ends the search early
+	rng = random.Random(3)
+	amounts = [rng.randint(1, 50) * 2 for _ in range(24)]
+	target = sum(sorted(amounts)[-4:]) - 0.01
+
+	assert find_subset_sum(amounts, target, max_size=6, max_steps=50) is None
+	assert find_subset_sum(amounts, target, max_size=6) is None
+
+	reachable = sum(amounts[:4])
+	assert find_subset_sum(amounts, reachable, max_size=6, max_steps=1) is None
+	assert_valid_subset(amounts, reachable, find_subset_sum(amounts, reachable, max_size=6))
+
+
+def make_repayment(name, amount, posting_date, account="Bank - C", reference="REF"):
+	return _dict(
+		{
+			"name": name,
+			"payment_account": account,
+			"amount_paid": amount,
+			"posting_date": posting_date,
+			"reference_number": reference,
+		}
+	)
+
+
+@pytest.fixture
+def index():
+	day = datetime.date(2026, 3, 10)
+	return CandidateIndex(
+		[
+			make_repayment("LR-1", 1000, day),
+			make_repayment("LR-2", 1000, day + datetime.timedelta(days=3)),
+			make_repayment("LR-3", 1000.5, day - datetime.timedelta(days=2)),
+			make_repayment("LR-4", 999.5, day),
+			make_repayment("LR-5", 1000, day, account="Other - C"),
+			make_repayment("LR-6", 1002, day),
+		]
+	)
+
+
+def find_names(index, *args):
+	return sorted(repayment.name for repayment in index.find(*args))
+
+
+def test_candidate_index_bounds_are_inclusive(index):
+	assert find_names(index, "Bank - C", 1000, 1000, "2026-03-10", "2026-03-10") == ["LR-1"]
+	assert find_names(index, "Bank - C", 999.5, 1000.5, "2026-03-08", "2026-03-13") == [
+		"LR-1",
+		"LR-2",
+		"LR-3",
+		"LR-4",
+	]
+	assert find_names(index, "Bank - C", 1000, 1000, "2026-03-11", "2026-03-12") == []
+	assert find_names(index, "Bank - C", 1000.51, 1001.99, "2026-03-01", "2026-03-31") == []
+	assert find_names(index, "Missing - C", 0, 5000, "2026-03-01", "2026-03-31") == []
+
+
+def test_candidate_index_skips_taken_repayments(index):
+	index.taken.add("LR-1")
+	assert find_names(index, "Bank - C", 1000, 1000, "2026-03-01", "2026-03-31") == ["LR-2"]
+
+
+def test_take_best_respects_the_tolerance(index):
+	tolerance = get_match_tolerance(date_window=2, amount_tolerance=0.5, normalize_references=0)
+	day = datetime.date(2026, 3, 12)
+
+	# LR-2 is a day off, LR-1 two days off and LR-3 four
+	assert index.take_best("Bank - C", "REF", 1000, day, tolerance).name == "LR-2"
+	assert index.take_best("Bank - C", "REF", 1000, day, tolerance).name == "LR-1"
+	# LR-4 and LR-3 are half a unit off, at the edge of the tolerance, but LR-3 is outside the window
+	assert index.take_best("Bank - C", "REF", 1000, day, tolerance).name == "LR-4"
+	assert index.take_best("Bank - C", "REF", 1000, day, tolerance) is None
+	assert index.take_best("Bank - C", "OTHER", 1002, "2026-03-10", tolerance) is None
+	assert index.take_best("Bank - C", "REF", 1002, "2026-03-10", tolerance).name == "LR-6"
@@ -0,0 +1,252 @@
+import datetime
+
+import pytest
+
+from lending_custom.benchmarks.standin import add_days, add_months, add_single_month, date_diff, get_last_day
+from lending_custom.schedule_engine import (
+	PRORATED_SCHEDULE_TYPES,
+	build_one_time_amortized_schedule,
+	build_one_time_schedule,
+	build_prorated_schedule,
+	iter_schedule_rows,
+)
+
+SCHEDULE_TYPES = (
+	("Monthly as per repayment start date", None),
+	("Pro-rated calendar months", "End of the current month"),
+	("Pro-rated calendar months", "Start of the next month"),
+)
+LOANS = (
+	# loan amount, rate of interest, periods, monthly repayment amount
+	(100000, 12, 12, 9333.33),
+	(250000, 18.5, 24, 12500),
+	(5000, 0, 5, 1000),
+	(73000.55, 7.25, 36, 2468.13),
+	# repays the loan before the last period
+	(10000, 10, 6, 4000),
+)
+
+
+def get_next_payment_date(payment_date, repayment_schedule_type, repayment_date_on):
+	if repayment_schedule_type == "Pro-rated calendar months":
+		next_payment_date = get_last_day(payment_date)
+		if repayment_date_on == "Start of the next month":
+			next_payment_date = add_days(next_payment_date, 1)
+		return next_payment_date
+
+	return add_single_month(payment_date)
+
+
+def loop_one_time_schedule(
+	loan_amount, rate_of_interest, repayment_periods, monthly_repayment_amount, payment_date, *schedule_type
+):
+	"""The period by period loop of make_repayment_schedule_one_time the engine replaced"""
+	rows = []
+	balance_amount = loan_amount
+	interest_per_period = loan_amount * (rate_of_interest / 100) / repayment_periods
+	principal_per_period = monthly_repayment_amount - interest_per_period
+
+	for period in range(repayment_periods):
+		new_balance = balance_amount - principal_per_period
+		if period == repayment_periods - 1:
+			principal_per_period = balance_amount
+			new_balance = 0.0
+
+		total_payment = principal_per_period + interest_per_period
+		rows.append((payment_date, principal_per_period, interest_per_period, total_payment, new_balance, 30))
+		balance_amount = new_balance
+		payment_date = get_next_payment_date(payment_date, *schedule_type)
+
+	return rows
+
+
+def loop_one_time_amortized_schedule(
+	loan_amount, rate_of_interest, repayment_periods, monthly_repayment_amount, payment_date, *schedule_type
+):
+	"""The while loop of make_repayment_schedule over get_amounts the engine replaced"""
+	rows = []
+	balance_amount = loan_amount
+	interest_per_period = loan_amount * (rate_of_interest / 100) / repayment_periods
+
+	while balance_amount > 0 and len(rows) < repayment_periods:
+		principal_amount = monthly_repayment_amount - interest_per_period
+		balance_amount = balance_amount - principal_amount
+		if balance_amount < 0:
+			principal_amount += balance_amount
+			balance_amount = 0.0
+
+		payment_date = get_next_payment_date(payment_date, *schedule_type)
+		rows.append(
+			(
+				payment_date,
+				principal_amount,
+				interest_per_period,
+				principal_amount + interest_per_period,
+				balance_amount,
+				30,
+			)
+		)
+
+	while len(rows) < repayment_periods:
+		if schedule_type[0] != "Pro-rated calendar months":
+			payment_date = add_single_month(payment_date)
+		rows.append((payment_date, 0, 0, 0, 0, 30))
+
+	return rows
+
+
+def loop_prorated_schedule(
+	loan_amount,
+	rate_of_interest,
+	monthly_repayment_amount,
+	repayment_start_date,
+	repayment_schedule_type,
+	repayment_date_on,
+	posting_date=None,
+	adjusted_interest=0,
+):
+	"""The while loop of lending's make_repayment_schedule over get_amounts for Monthly Prorated loans"""
+	rows = []
+	payment_date = repayment_start_date
+	balance_amount = loan_amount
+	broken_period_interest_days = date_diff(add_months(payment_date, -1), posting_date) if posting_date else 0
+	carry_forward_interest = adjusted_interest
+
+	while balance_amount > 0:
+		if repayment_schedule_type == "Monthly as per repayment start date":
+			days, months = 1, 12
+		else:
+			expected_payment_date = get_last_day(payment_date)
+			if repayment_date_on == "Start of the next month":
+				expected_payment_date = add_days(expected_payment_date, 1)
+
+			if repayment_schedule_type == "Monthly as per cycle date":
+				days = date_diff(payment_date, add_months(payment_date, -1))
+				if broken_period_interest_days < 0:
+					days = date_diff(repayment_start_date, posting_date)
+				else:
+					days += broken_period_interest_days
+			elif expected_payment_date == payment_date:
+				days = 30
+			else:
+				days = date_diff(get_last_day(payment_date), payment_date)
+			months = 365
+
+		interest_amount = balance_amount * rate_of_interest * days / (months * 100)
+		principal_amount = monthly_repayment_amount - interest_amount
+		balance_amount = balance_amount + interest_amount - monthly_repayment_amount
+		if balance_amount < 0:
+			principal_amount += balance_amount
+			balance_amount = 0.0
+
+		interest_amount += carry_forward_interest
+		total_payment = principal_amount + interest_amount
+
+		if repayment_schedule_type == "Pro-rated calendar months":
+			payment_date = get_last_day(payment_date)
+			if repayment_date_on == "Start of the next month":
+				payment_date = add_days(payment_date, 1)
+
+		rows.append((payment_date, principal_amount, interest_amount, total_payment, balance_amount, days))
+
+		if (
+			repayment_schedule_type in ("Monthly as per repayment start date", "Monthly as per cycle date")
+			or repayment_date_on == "End of the current month"
+		):
+			payment_date = add_single_month(payment_date)
+
+		broken_period_interest_days = 0
+		carry_forward_interest = 0
+
+	return rows
+
+
+def assert_same_rows(schedule, rows):
+	engine_rows = list(iter_schedule_rows(schedule))
+	assert len(engine_rows) == len(rows)
+	for engine_row, row in zip(engine_rows, rows, strict=True):
+		assert engine_row[0] == row[0]
+		assert engine_row[1:] == pytest.approx(row[1:], abs=1e-6)
+
+
+@pytest.mark.parametrize("schedule_type", SCHEDULE_TYPES)
+@pytest.mark.parametrize("loan", LOANS)
+def test_one_time_schedule_matches_the_loop(loan, schedule_type):
+	start = datetime.date(2026, 1, 31)
+	assert_same_rows(
+		build_one_time_schedule(*loan, start, *schedule_type),
+		loop_one_time_schedule(*loan, start, *schedule_type),
+	)
+
+
+@pytest.mark.parametrize("schedule_type", SCHEDULE_TYPES)
+@pytest.mark.parametrize("loan", LOANS)
+def test_one_time_amortized_schedule_matches_the_loop(loan, schedule_type):
+	start = datetime.date(2026, 1, 31)
+	assert_same_rows(
+		build_one_time_amortized_schedule(*loan, start, *schedule_type),
+		loop_one_time_amortized_schedule(*loan, start, *schedule_type),
+	)
+
+
+PRORATED_LOANS = (
+	# loan amount, rate of interest, monthly repayment amount
+	(100000, 12, 8884.88),
+	(250000, 18.5, 12500),
+	(73000.55, 7.25, 2468.13),
+	# zero rate
+	(5000, 0, 1000),
+	(5000, 0, 1234.56),
+	# a long tenor, 30 years of periods
+	(3000000, 9.5, 25226.12),
+)
+REPAYMENT_DATE_ON = ("End of the current month", "Start of the next month")
+
+
+@pytest.mark.parametrize("repayment_date_on", REPAYMENT_DATE_ON)
+@pytest.mark.parametrize("repayment_schedule_type", PRORATED_SCHEDULE_TYPES)
+@pytest.mark.parametrize("loan", PRORATED_LOANS)
+def test_prorated_schedule_matches_the_loop(loan, repayment_schedule_type, repayment_date_on):
+	start = datetime.date(2026, 1, 15)
+	assert_same_rows(
+		build_prorated_schedule(*loan, start, repayment_schedule_type, repayment_date_on),
+		loop_prorated_schedule(*loan, start, repayment_schedule_type, repayment_date_on),
+	)
+
+
+@pytest.mark.parametrize("repayment_date_on", REPAYMENT_DATE_ON)
+@pytest.mark.parametrize("repayment_schedule_type", PRORATED_SCHEDULE_TYPES)
+@pytest.mark.parametrize(
+	"start, posting_date",
+	[
+		# disbursed before the cycle: a longer first period
+		(datetime.date(2026, 3, 10), datetime.date(2026, 1, 25)),
+		# disbursed inside the cycle: the first period counts from the disbursement
+		(datetime.date(2026, 3, 10), datetime.date(2026, 2, 20)),
+		# a full first period, starting on a period boundary
+		(datetime.date(2026, 1, 31), datetime.date(2025, 12, 31)),
+		(datetime.date(2026, 2, 1), datetime.date(2026, 1, 1)),
+	],
+)
+def test_prorated_schedule_broken_period_matches_the_loop(
+	start, posting_date, repayment_schedule_type, repayment_date_on
+):
+	loan = (100000, 12, 8884.88)
+	assert_same_rows(
+		build_prorated_schedule(
+			*loan, start, repayment_schedule_type, repayment_date_on, posting_date=posting_date
+		),
+		loop_prorated_schedule(
+			*loan, start, repayment_schedule_type, repayment_date_on, posting_date=posting_date
+		),
+	)
+
+
+@pytest.mark.parametrize("repayment_schedule_type", PRORATED_SCHEDULE_TYPES)
+def test_prorated_schedule_adjusted_interest_matches_the_loop(repayment_schedule_type):
+	start = datetime.date(2026, 1, 15)
+	args = (50000, 14, 4500, start, repayment_schedule_type, "End of the current month")
+	assert_same_rows(
+		build_prorated_schedule(*args, posting_date=datetime.date(2025, 12, 1), adjusted_interest=321.45),
+		loop_prorated_schedule(*args, posting_date=datetime.date(2025, 12, 1), adjusted_interest=321.45),
+	)
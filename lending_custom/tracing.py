@@ -0,0 +1,141 @@
+"""
+Structured tracing for the loan hot paths
+
+Spans are named blocks of work (schedule build, get_amounts, calculate_totals, accrual
+per date, reconciliation per transaction) that record their duration and a few
+attributes such as row counts through `frappe.logger("lending_custom.trace")`.
+
+Tracing is configured per site:
+
+	bench --site <site> set-config lending_custom_trace_sample_rate 0.05
+
+A rate of 0 (the default) disables tracing: `span()` then hands out a shared no-op span
+and `traced` calls straight through. Otherwise the outermost span of a request is
+sampled at the given rate and every nested span follows its decision, so a sampled
+trace is always complete.
+"""
+
+import random
+import time
+from functools import wraps
+
+import frappe
+
+TRACE_LOGGER = "lending_custom.trace"
+SAMPLE_RATE_KEY = "lending_custom_trace_sample_rate"
+
+
+class _NullSpan:
+	"""Span handed out while tracing is disabled, every operation is a no-op"""
+
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+	def set(self, **attributes):
+		pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+	__slots__ = ("attributes", "name", "parent", "sampled", "start", "trace_id")
+
+	def __init__(self, name, attributes, sampled, trace_id, parent):
+		self.name = name
+		self.attributes = attributes
+		self.sampled = sampled
+		self.trace_id = trace_id
+		self.parent = parent
+		self.start = None
+
+	def __enter__(self):
+		_get_stack().append(self)
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		duration = time.perf_counter() - self.start
+		_get_stack().pop()
+
+		if self.sampled:
+			record = {
+				"span": self.name,
+				"trace_id": self.trace_id,
+				"parent": self.parent,
+				"duration_ms": round(duration * 1000, 3),
+			}
+			if exc_type:
+				record["error"] = exc_type.__name__
+			record.update(self.attributes)
+			frappe.logger(TRACE_LOGGER).info(record)
+
+		return False
+
+	def set(self, **attributes):
+		"""Add attributes, e.g. row counts known only at the end of the span"""
+		self.attributes.update(attributes)
+
+
+def get_sample_rate():
+	"""Share of requests traced on this site, between 0 and 1"""
+	try:
+		return float(frappe.conf.get(SAMPLE_RATE_KEY) or 0)
+	except (TypeError, ValueError):
+		return 0.0
+
+
+def _get_stack():
+	if not hasattr(frappe.local, "lending_custom_spans"):
+		frappe.local.lending_custom_spans = []
+
+	return frappe.local.lending_custom_spans
+
+
+def span(name, **attributes):
+	"""
+	Context manager timing a named block of work:
+
+		with span("schedule_build", loan=self.loan) as s:
+			...
+			s.set(rows=len(self.repayment_schedule))
+	"""
+	sample_rate = get_sample_rate()
+	if not sample_rate:
+		return NULL_SPAN
+
+	stack = _get_stack()
+	if stack:
+		parent = stack[-1]
+		return Span(name, attributes, parent.sampled, parent.trace_id, parent.name)
+
+	sampled = sample_rate >= 1 or random.random() < sample_rate
+	return Span(name, attributes, sampled, frappe.generate_hash(length=10) if sampled else None, None)
+
+
+def current_span():
+	"""Innermost open span, or the no-op span when nothing is being traced"""
+	stack = getattr(frappe.local, "lending_custom_spans", None)
+	return stack[-1] if stack else NULL_SPAN
+
+
+def traced(name):
+	"""Decorator wrapping every call of the function in a span called `name`"""
+
+	def decorator(fn):
+		@wraps(fn)
+		def wrapper(*args, **kwargs):
+			if not get_sample_rate():
+				return fn(*args, **kwargs)
+
+			with span(name):
+				return fn(*args, **kwargs)
+
+		return wrapper
+
+	return decorator